@@ -0,0 +1,206 @@
+# Computes the chatbot's stylistic features for a whole corpus at once, for offline
+# analytics: a column of a CSV file (e.g., the "review" column of dataset.csv), or
+# a directory of processed transcripts (one utterance per line, as written by
+# process_transcripts.py).
+#
+# Texts are streamed in chunks and analyzed in parallel across a process pool, with
+# only two chunks per worker in flight at a time, so memory stays flat on very
+# large inputs.  Dependency parses go to the CoreNLP server, and a semaphore shared by
+# all workers bounds how many parses run at once (--parse-concurrency), so the
+# batch job cannot overload the server the chatbot depends on.
+#
+# Results are written in input order to a Parquet file (if pyarrow is installed)
+# or a CSV file, one row per text.
+#
+# Usage:
+#   python batch_stylistic.py dataset.csv [--column review] [--output features.parquet]
+#   python batch_stylistic.py transcripts/ [--pattern "user_*.txt"] [--output features.parquet]
+#   Options: [--workers N] [--parse-concurrency 4] [--no-parse] [--chunksize 500] [--tokenizer nltk|regex]
+# In a directory written by process_transcripts.py, the default --pattern reads only
+# the user_*.txt files, since the all_*.txt files repeat the users' lines and the
+# chatbot_*.txt files hold the chatbot's.
+# =========================================================================================================
+
+import argparse
+import csv
+import glob
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import chatbot
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional
+    pa = None
+    pq = None
+
+COLUMNS = ["source", "index", "ttr", "tokens_per_sentence", "nsubj", "obj", "iobj", "nmod", "amod",
+           "avg_sentence_length", "punctuation_density"]
+
+# Shared by the worker processes: bounds the number of concurrent dependency parses.
+_parse_slots = None
+_parse = True
+
+
+# Function: iter_csv_texts(fname, column, chunksize)
+# Returns: A generator of (source, start index, texts) chunks from one column of a CSV file
+def iter_csv_texts(fname, column, chunksize):
+    start = 0
+    for df in pd.read_csv(fname, usecols=[column], chunksize=chunksize):
+        texts = df[column].fillna("").astype(str).tolist()
+        yield fname, start, texts
+        start += len(texts)
+
+
+# Function: iter_transcript_texts(directory, pattern, chunksize)
+# Returns: A generator of (source, start index, texts) chunks, where each text is
+#          one non-empty line of a transcript file matching pattern
+def iter_transcript_texts(directory, pattern, chunksize):
+    for fname in sorted(glob.glob(os.path.join(directory, pattern))):
+        start = 0
+        texts = []
+        with open(fname, "r", encoding="utf-8", errors="replace") as f_in:
+            for line in f_in:
+                line = line.strip()
+                if not line:
+                    continue
+                texts.append(line)
+                if len(texts) == chunksize:
+                    yield fname, start, texts
+                    start += len(texts)
+                    texts = []
+        if texts:
+            yield fname, start, texts
+
+
+# Function: init_worker(tokenizer, corenlp_url, parse_slots, parse)
+# Configures a worker process to match the parent's settings.
+def init_worker(tokenizer, corenlp_url, parse_slots, parse):
+    global _parse_slots, _parse
+    chatbot.TOKENIZER = tokenizer
+    chatbot.CORENLP_URL = corenlp_url
+    _parse_slots = parse_slots
+    _parse = parse
+
+
+# Function: analyze_chunk(source, start, texts)
+# Returns: A list of output rows (dictionaries with the keys in COLUMNS), one per text
+#
+# This function runs in a worker process.
+def analyze_chunk(source, start, texts):
+    rows = []
+    for offset, text in enumerate(texts):
+        features = chatbot.analyze_style(text)
+        dep_counts = (None,) * 5
+        if _parse:
+            with _parse_slots:
+                dep_parse = chatbot.get_dependency_parse(text)
+            if dep_parse is not None:
+                dep_counts = chatbot.get_dep_categories(dep_parse)
+        rows.append(dict(zip(COLUMNS, (source, start + offset, features.ttr, features.tokens_per_sentence)
+                             + tuple(dep_counts) + (features.avg_sentence_length, features.punctuation_density))))
+    return rows
+
+
+# Class: FeatureWriter
+# Appends rows to a Parquet file (one row group per chunk) or, if the path does not
+# end in ".parquet", to a CSV file.
+class FeatureWriter:
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.parquet = filepath.endswith(".parquet")
+        if self.parquet:
+            self.schema = pa.schema([("source", pa.string()), ("index", pa.int64())]
+                                    + [(name, pa.float64()) for name in COLUMNS[2:4]]
+                                    + [(name, pa.int64()) for name in COLUMNS[4:9]]
+                                    + [(name, pa.float64()) for name in COLUMNS[9:]])
+            self.writer = pq.ParquetWriter(filepath, self.schema)
+        else:
+            self.fout = open(filepath, "w", newline="", encoding="utf-8")
+            self.writer = csv.DictWriter(self.fout, fieldnames=COLUMNS)
+            self.writer.writeheader()
+
+    def write(self, rows):
+        if self.parquet:
+            self.writer.write_table(pa.Table.from_pylist(rows, schema=self.schema))
+        else:
+            self.writer.writerows(rows)
+
+    def close(self):
+        if self.parquet:
+            self.writer.close()
+        else:
+            self.fout.close()
+
+
+# Function: batch_stylistic(chunks, output, workers=None, parse_concurrency=4, parse=True)
+# chunks: An iterable of (source, start index, texts), e.g. from iter_csv_texts
+# output: The output file (.parquet or .csv)
+# workers: The number of worker processes (defaults to the number of CPUs)
+# parse_concurrency: The most dependency parses in flight across all workers
+# parse: False to skip dependency parsing (the dependency columns are left empty)
+# Returns: The number of texts analyzed
+def batch_stylistic(chunks, output, workers=None, parse_concurrency=4, parse=True):
+    workers = workers or os.cpu_count()
+    manager = multiprocessing.Manager()
+    parse_slots = manager.BoundedSemaphore(parse_concurrency)
+    writer = FeatureWriter(output)
+    total = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(chatbot.TOKENIZER, chatbot.CORENLP_URL, parse_slots, parse)) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(analyze_chunk, *chunk))
+                # Keep a few chunks per worker in flight, and write results in input order.
+                while len(pending) >= 2 * workers:
+                    rows = pending.popleft().result()
+                    writer.write(rows)
+                    total += len(rows)
+            while pending:
+                rows = pending.popleft().result()
+                writer.write(rows)
+                total += len(rows)
+    finally:
+        writer.close()
+        manager.shutdown()
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute stylistic features for a CSV column or transcript directory.")
+    parser.add_argument("input", help="a CSV file, or a directory of processed transcripts")
+    parser.add_argument("--column", default="review", help="the CSV column to analyze")
+    parser.add_argument("--pattern", default="user_*.txt",
+                        help="transcript files to read from the directory (default: the users' lines)")
+    parser.add_argument("--output", default="stylistic_features.parquet", help=".parquet or .csv")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--parse-concurrency", type=int, default=4, help="most dependency parses in flight")
+    parser.add_argument("--no-parse", action="store_true", help="skip dependency parsing")
+    parser.add_argument("--chunksize", type=int, default=500, help="texts per task")
+    parser.add_argument("--tokenizer", choices=["nltk", "regex"], default=chatbot.TOKENIZER)
+    args = parser.parse_args()
+    chatbot.TOKENIZER = args.tokenizer
+
+    output = args.output
+    if output.endswith(".parquet") and pq is None:
+        output = output[:-len(".parquet")] + ".csv"
+        print("pyarrow is not installed; writing {0} instead.".format(output))
+
+    if os.path.isdir(args.input):
+        chunks = iter_transcript_texts(args.input, args.pattern, args.chunksize)
+    else:
+        chunks = iter_csv_texts(args.input, args.column, args.chunksize)
+
+    start = time.perf_counter()
+    total = batch_stylistic(chunks, output, args.workers, args.parse_concurrency, not args.no_parse)
+    elapsed = time.perf_counter() - start
+    print("Analyzed {0} texts in {1:.1f}s ({2:,.0f} texts/sec); wrote {3}.".format(
+        total, elapsed, total / max(elapsed, 1e-9), output))
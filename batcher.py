@@ -0,0 +1,105 @@
+# Micro-batches sentiment predictions from concurrent chat sessions.
+#
+# Predicting one utterance at a time spends most of its time in scikit-learn's
+# per-call input validation rather than in the model itself.  InferenceBatcher
+# queues requests from all sessions and flushes them to a single vectorized
+# predict call when the batch is full or the oldest request has waited
+# max_wait_ms, whichever comes first.  Flushed batches run in the executor while
+# the next batch fills.
+# =========================================================================================================
+
+import asyncio
+import time
+
+import chatbot
+from metrics import Histogram
+
+
+# Class: InferenceBatcher
+# model: The trained classification model used for predicting sentiment
+# vectorizer: OPTIONAL; The trained vectorizer, if using TFIDF
+# word2vec: OPTIONAL; The pretrained Word2Vec model, if using Word2Vec
+# max_batch_size: The most requests predicted together
+# max_wait_ms: The longest a request waits for its batch to fill
+# executor: The executor predictions run in (None for the event loop's default)
+#
+# batch_sizes and queue_wait_ms are Histograms of the size of each flushed batch
+# and of how long each request waited before its batch was flushed, for tuning
+# throughput against tail latency.
+class InferenceBatcher:
+    def __init__(self, model, vectorizer=None, word2vec=None, max_batch_size=32, max_wait_ms=2.0,
+                 executor=None):
+        self.model = model
+        self.vectorizer = vectorizer
+        self.word2vec = word2vec
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        self.pending = []
+        self.timer = None
+        self.in_flight = set()
+
+        size_buckets = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+        self.batch_sizes = Histogram([size for size in size_buckets if size < max_batch_size] + [max_batch_size])
+        self.queue_wait_ms = Histogram([0.1, 0.25, 0.5, 1, 2, 5, 10, 25, 50, 100, 250, 1000])
+
+    # submit(user_input): Queues one utterance and returns an asyncio.Future that
+    # resolves to its predicted label.
+    def submit(self, user_input):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((user_input, future, time.perf_counter()))
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif len(self.pending) == 1:
+            self.timer = loop.call_later(self.max_wait, self.flush)
+        return future
+
+    # predict(user_input): Convenience wrapper that waits for the label.
+    async def predict(self, user_input):
+        return await self.submit(user_input)
+
+    # flush(): Sends everything queued so far to the executor as one batch.
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+
+        flushed = time.perf_counter()
+        self.batch_sizes.observe(len(batch))
+        for user_input, future, queued in batch:
+            self.queue_wait_ms.observe(1000 * (flushed - queued))
+
+        task = asyncio.get_running_loop().create_task(self.run_batch(batch))
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+
+    # run_batch(batch): Predicts a batch in the executor and resolves its futures.
+    async def run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            labels = await loop.run_in_executor(self.executor, chatbot.predict_sentiment_batch,
+                                                [user_input for user_input, future, queued in batch],
+                                                self.model, self.vectorizer, self.word2vec)
+        except Exception as e:
+            for user_input, future, queued in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (user_input, future, queued), label in zip(batch, labels):
+            if not future.done():
+                future.set_result(label)
+
+    # close(): Flushes anything still queued and waits for in-flight batches.
+    async def close(self):
+        self.flush()
+        if self.in_flight:
+            await asyncio.gather(*self.in_flight, return_exceptions=True)
+
+    # format_stats(): Returns a summary of the batch size and queue wait histograms.
+    def format_stats(self):
+        return "{0}\n{1}".format(self.batch_sizes.format("batch_size"), self.queue_wait_ms.format("queue_wait_ms"))
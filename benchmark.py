@@ -0,0 +1,729 @@
+# Benchmarks for the chatbot's hot paths.  Each benchmark is a subcommand, e.g.:
+#   python benchmark.py tokenizers
+# Results are printed to the terminal.
+# =========================================================================================================
+
+import argparse
+import json
+import multiprocessing
+import resource
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import chatbot
+import intents
+from corenlp_client import CoreNLPClient, CoreNLPUnavailable
+
+
+# Function: time_call(func, *args)
+# func: The function to time
+# Returns: The function's return value, and the elapsed wall-clock time in seconds
+def time_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+# Function: compare_tokenizers(documents)
+# documents: A list of strings
+# Returns: The fraction of documents tokenized identically by both modes, and the
+#          fraction of NLTK tokens that the regex tokenizer also produced
+#
+# This function validates the "regex" tokenizer against NLTK's word_tokenize.
+def compare_tokenizers(documents):
+    exact = 0
+    shared = 0
+    total = 0
+    for document in documents:
+        nltk_tokens = chatbot.get_tokens(document, mode="nltk")
+        regex_tokens = chatbot.get_tokens(document, mode="regex")
+        if nltk_tokens == regex_tokens:
+            exact += 1
+        shared += sum((Counter(nltk_tokens) & Counter(regex_tokens)).values())
+        total += max(len(nltk_tokens), len(regex_tokens))
+    return exact / max(len(documents), 1), shared / max(total, 1)
+
+
+# Function: bench_tokenizers(args)
+# Reports tokens/sec for each get_tokens mode on the dataset, and how closely the
+# regex tokenizer agrees with word_tokenize.
+def bench_tokenizers(args):
+    documents, labels = chatbot.load_as_list(args.data)
+    chatbot.load_tokenizer()
+
+    for mode in ("nltk", "regex"):
+        token_lists, elapsed = time_call(lambda: [chatbot.get_tokens(d, mode=mode) for d in documents])
+        num_tokens = sum(len(tokens) for tokens in token_lists)
+        print("{0:>6}: {1} tokens in {2:.3f}s ({3:,.0f} tokens/sec)".format(
+            mode, num_tokens, elapsed, num_tokens / elapsed))
+
+    exact, overlap = compare_tokenizers(documents)
+    print("Documents tokenized identically: {0:.1%}".format(exact))
+    print("Token agreement with word_tokenize: {0:.2%}".format(overlap))
+
+
+# Function: tfidf_peak_rss(data, repeat, model_index, dense, tokenizer)
+# data: path of the training CSV file
+# repeat: How many copies of the dataset to train on (to simulate a larger corpus)
+# model_index: Which of the instantiate_models() models to train
+# dense: True to densify the TFIDF matrices as train_model_tfidf/test_model_tfidf
+#        used to, False to use the current sparse path
+# tokenizer: The chatbot.TOKENIZER setting to use
+# Returns: The peak resident set size of the current process, in MiB
+#
+# This function is meant to run in a fresh child process, so that the peak RSS
+# reflects only this one training and evaluation run.
+def tfidf_peak_rss(data, repeat, model_index, dense, tokenizer):
+    chatbot.TOKENIZER = tokenizer
+    documents, labels = chatbot.load_as_list(data)
+    documents, labels = documents * repeat, labels * repeat
+    vectorizer, tfidf_train = chatbot.vectorize_train(documents)
+    model = chatbot.instantiate_models()[model_index]
+
+    if dense:
+        model.fit(tfidf_train.toarray(), labels)
+        model.predict(vectorizer.transform(documents).toarray())
+    else:
+        chatbot.train_model_tfidf(model, tfidf_train, labels)
+        chatbot.predict_features(model, vectorizer.transform(documents))
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Function: bench_tfidf_memory(args)
+# Reports the peak RSS of TFIDF training and evaluation for each model, with the
+# old densified matrices and with the sparse path.
+def bench_tfidf_memory(args):
+    context = multiprocessing.get_context("spawn")
+    print("{0:<24}{1:>14}{2:>14}".format("Model", "Dense (MiB)", "Sparse (MiB)"))
+    for model_index, model in enumerate(chatbot.instantiate_models()):
+        peaks = []
+        for dense in (True, False):
+            with context.Pool(1) as pool:
+                peaks.append(pool.apply(tfidf_peak_rss, (args.data, args.repeat, model_index, dense, chatbot.TOKENIZER)))
+        print("{0:<24}{1:>14.1f}{2:>14.1f}".format(type(model).__name__, *peaks))
+
+
+# Function: free_port()
+# Returns: A local TCP port that nothing is listening on
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Function: spawn_fake_corenlp(latency_ms)
+# Returns: The fake CoreNLP server's process and URL.  It runs in its own process
+#          so that it does not compete with the benchmark for the GIL.
+def spawn_fake_corenlp(latency_ms):
+    port = free_port()
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_corenlp.py")
+    process = subprocess.Popen([sys.executable, script, "--port", str(port), "--latency-ms", str(latency_ms)],
+                               stdout=subprocess.DEVNULL)
+    for attempt in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return process, "http://127.0.0.1:{0}".format(port)
+
+
+# Function: nltk_dependency_parse(url, text)
+# The previous get_dependency_parse: a new nltk parser (and HTTP session) per call.
+def nltk_dependency_parse(url, text):
+    from nltk.parse.corenlp import CoreNLPDependencyParser
+    return next(CoreNLPDependencyParser(url=url).raw_parse(text)).to_conll(4)
+
+
+# Inputs with several sentences, which must be parsed the same way as nltk parses
+# them (one sentence per line).
+MULTI_SENTENCE_INPUTS = ["I loved it. You will hate it!", "It was fine.\nThey hated me."]
+
+
+# Function: check_parse_parity(client, url, documents)
+# Returns: The documents whose parse by the client differs from nltk's
+def check_parse_parity(client, url, documents):
+    return [document for document in documents
+            if client.dependency_parse(document) != nltk_dependency_parse(url, document)]
+
+
+# Function: parse_latencies(parse, documents, threads)
+# parse: A function that parses one document
+# Returns: The per-call latencies in milliseconds, and the total elapsed seconds
+def parse_latencies(parse, documents, threads):
+    def timed(document):
+        start = time.perf_counter()
+        parse(document)
+        return 1000 * (time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies, elapsed = time_call(lambda: list(pool.map(timed, documents)))
+    return np.array(latencies), elapsed
+
+
+# Function: bench_corenlp(args)
+# Reports dependency-parse throughput and latency through nltk's per-call parser
+# and through the pooled CoreNLPClient, then how quickly the client gives up when
+# the server is down.  Uses the local fake server unless --url is given, and stops
+# first if the two parse any input (including MULTI_SENTENCE_INPUTS) differently.
+def bench_corenlp(args):
+    server = None
+    url = args.url
+    if url is None:
+        server, url = spawn_fake_corenlp(args.latency_ms)
+    documents, labels = chatbot.load_as_list(args.data)
+    documents = documents[:args.requests]
+
+    client = CoreNLPClient(url, max_connections=args.threads)
+    mismatches = check_parse_parity(client, url, MULTI_SENTENCE_INPUTS + documents[:20])
+    if mismatches:
+        if server is not None:
+            server.terminate()
+        raise SystemExit("The pooled client parses {0} inputs differently from nltk, e.g. {1!r}".format(
+            len(mismatches), mismatches[0]))
+    parsers = [("nltk per call", lambda text: nltk_dependency_parse(url, text)),
+               ("pooled client", client.dependency_parse)]
+    print("{0} parses on {1} threads against {2}".format(len(documents), args.threads, url))
+    for name, parse in parsers:
+        latencies, elapsed = parse_latencies(parse, documents, args.threads)
+        print("{0:>14}: {1:8.1f} parses/sec  p50 {2:6.2f} ms  p99 {3:6.2f} ms".format(
+            name, len(documents) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99)))
+    client.close()
+    if server is not None:
+        server.terminate()
+        server.wait()
+
+    # Point a client at a port nobody is listening on to time the degraded path.
+    client = CoreNLPClient("http://127.0.0.1:{0}".format(free_port()), timeout=1.0)
+    latencies = []
+    for document in documents[:20]:
+        start = time.perf_counter()
+        try:
+            client.dependency_parse(document)
+        except CoreNLPUnavailable:
+            pass
+        latencies.append(1000 * (time.perf_counter() - start))
+    print("Server down: first call {0:.1f} ms, after the breaker opens {1:.3f} ms per call".format(
+        latencies[0], float(np.median(latencies[-10:]))))
+
+
+# Function: separate_style_metrics(user_input)
+# The stylistic metrics as stylistic_report computed them before analyze_style:
+# one tokenization per metric.
+def separate_style_metrics(user_input):
+    return (chatbot.compute_ttr(user_input), chatbot.tokens_per_sentence(user_input),
+            chatbot.custom_feature_1(user_input), chatbot.custom_feature_2(user_input))
+
+
+# Function: bench_stylistic(args)
+# Times the separate stylistic metric functions against the single-pass
+# analyze_style on inputs of increasing length (built by joining dataset reviews),
+# and reports the largest relative difference between their values.
+def bench_stylistic(args):
+    documents, labels = chatbot.load_as_list(args.data)
+    chatbot.load_tokenizer()
+    print("{0:>10}{1:>16}{2:>19}{3:>10}{4:>12}".format("Chars", "Separate (ms)", "Single pass (ms)", "Speedup",
+                                                      "Max diff"))
+    for length in args.lengths:
+        text = ""
+        for document in documents:
+            if len(text) >= length:
+                break
+            text += document + " "
+        text = text[:length]
+
+        separate, separate_seconds = time_call(
+            lambda: [separate_style_metrics(text) for i in range(args.repeat)])
+        single, single_seconds = time_call(
+            lambda: [chatbot.analyze_style(text, mode="nltk") for i in range(args.repeat)])
+        expected = np.array(separate[0])
+        actual = np.array([single[0].ttr, single[0].tokens_per_sentence, single[0].avg_sentence_length,
+                           single[0].punctuation_density])
+        max_diff = np.max(np.abs(actual - expected) / np.maximum(np.abs(expected), 1e-12))
+        print("{0:>10}{1:>16.3f}{2:>19.3f}{3:>9.2f}x{4:>12.2e}".format(
+            len(text), 1000 * separate_seconds / args.repeat, 1000 * single_seconds / args.repeat,
+            separate_seconds / single_seconds, max_diff))
+
+
+# Function: keyword_next_state(user_input)
+# The original match_next_state: a case-sensitive search for "quit",
+# "sentiment", and "styl", one regular expression at a time.
+def keyword_next_state(user_input):
+    if re.search(r"\bquit\b", user_input) is not None:
+        return "quit"
+    elif re.search(r"\bsentiment\b", user_input) is not None:
+        return "sentiment_analysis"
+    elif re.search(r"\bstyl", user_input) is not None:
+        return "stylistic_analysis"
+    return None
+
+
+# Replies to the next-step prompt, by the intent they express (None for replies
+# that should get the retry prompt).  "{0}" is filled in with each spelling of
+# the intent's name.
+INTENT_TEMPLATES = ("{0}", "{0} please", "let's do {0}", "I'd like the {0} one again", "{0}!", "um, {0} I guess")
+INTENT_NAMES = {"quit": "quit", "sentiment_analysis": "sentiment", "stylistic_analysis": "stylistic"}
+INTENT_SYNONYMS = {"quit": ["exit", "bye", "goodbye", "I'm done", "that's all", "Quit", "QUIT", "stop"],
+                   "sentiment_analysis": ["my feelings", "the emotion one", "positive or negative?", "Sentiment",
+                                          "sentiment analysis"],
+                   "stylistic_analysis": ["my writing style", "grammar", "Stylistic", "the style one",
+                                          "how I write"],
+                   None: ["hmm, not sure", "what?", "maybe later", "I don't know", "tell me a joke",
+                          "I'm not quite sure", "whatever"]}
+# Replies that ask for an analysis but also contain a word that can end a session.
+INTENT_MIXED = {"sentiment_analysis": ["Redo the sentiment analysis, then I'm done",
+                                       "Let's see you analyze my sentiment again", "one more sentiment, then stop",
+                                       "see your sentiment analysis again?"],
+                "stylistic_analysis": ["Do the stylistic one and don't end the chat",
+                                       "I'm not finished, do the stylistic analysis",
+                                       "stylistic analysis and that's all"]}
+
+
+# Function: misspell(word, rng)
+# Returns: The word with one random typo: a deleted, repeated, or replaced
+#          character, or two adjacent characters swapped
+def misspell(word, rng):
+    i = int(rng.integers(1, len(word) - 1))
+    kind = rng.integers(4)
+    if kind == 0:
+        return word[:i] + word[i + 1:]
+    if kind == 1:
+        return word[:i] + word[i] + word[i:]
+    if kind == 2:
+        return word[:i] + "aeiourstn"[rng.integers(9)] + word[i + 1:]
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+# Function: intent_examples(typos, seed=100)
+# typos: The number of misspellings of each intent's name
+# Returns: A list of (category, reply, expected intent) examples, where category
+#          is "names", "synonyms", "typos", "mixed", or "other"
+def intent_examples(typos, seed=100):
+    rng = np.random.default_rng(seed)
+    examples = []
+    for intent, name in INTENT_NAMES.items():
+        spellings = [("names", name)] + [("typos", misspell(name, rng)) for i in range(typos)]
+        for category, spelling in spellings:
+            if spelling != name or category == "names":
+                examples.extend((category, template.format(spelling), intent) for template in INTENT_TEMPLATES)
+    for intent, replies in INTENT_SYNONYMS.items():
+        examples.extend(("synonyms" if intent else "other", reply, intent) for reply in replies)
+    for intent, replies in INTENT_MIXED.items():
+        examples.extend(("mixed", reply, intent) for reply in replies)
+    return examples
+
+
+# Function: bench_intents(args)
+# Reports how many replies to the next-step prompt the original keyword search
+# and intents.ROUTER each classify correctly (every miss costs the user a retry
+# prompt), and how long each takes per reply.
+def bench_intents(args):
+    examples = intent_examples(args.typos, args.seed)
+    categories = sorted({category for category, reply, intent in examples})
+    replies = [reply for category, reply, intent in examples]
+    print("{0:<22}".format("Matcher") + "".join("{0:>12}".format(category) for category in categories)
+          + "{0:>12}{1:>14}".format("all", "us/reply"))
+    for name, match in (("keywords (original)", keyword_next_state), ("intent router", intents.ROUTER.classify)):
+        correct = Counter(category for category, reply, intent in examples if match(reply) == intent)
+        totals = Counter(category for category, reply, intent in examples)
+        results, seconds = time_call(lambda: [match(reply) for i in range(args.repeat) for reply in replies])
+        print("{0:<22}".format(name) + "".join("{0:>12.1%}".format(correct[category] / totals[category])
+                                               for category in categories)
+              + "{0:>12.1%}{1:>14.2f}".format(sum(correct.values()) / len(examples),
+                                              1e6 * seconds / (args.repeat * len(replies))))
+
+
+# Names and next-step requests used to build synthetic conversations.  The last
+# request matches no state, so the retry path is exercised too.
+SYNTHETIC_NAMES = ("Alex", "Sam", "Jordan", "Taylor", "Morgan", "Riley")
+NEXT_ACTIONS = ("sentiment", "stylistic", "sentiment analysis again, please", "let's do the stylistic one",
+                "hmm, not sure")
+
+
+# Function: synthetic_sessions(reviews, count, rounds, seed=100)
+# reviews: The texts that user turns are sampled from (e.g., dataset.csv reviews)
+# count: The number of conversations
+# rounds: The number of next-step requests in each conversation after the first
+#         sentiment and stylistic analyses
+# Returns: A list of conversations, each a list of user lines that ends with "quit"
+def synthetic_sessions(reviews, count, rounds, seed=100):
+    rng = np.random.default_rng(seed)
+    sessions = []
+    for i in range(count):
+        lines = ["My name is {0}".format(SYNTHETIC_NAMES[rng.integers(len(SYNTHETIC_NAMES))]),
+                 reviews[rng.integers(len(reviews))], reviews[rng.integers(len(reviews))]]
+        for j in range(rounds):
+            action = NEXT_ACTIONS[rng.integers(len(NEXT_ACTIONS))]
+            lines.append(action)
+            if chatbot.match_next_state(action) is not None:
+                lines.append(reviews[rng.integers(len(reviews))])
+        lines.append("quit")
+        sessions.append(lines)
+    return sessions
+
+
+# Function: scripted_sessions(patterns)
+# patterns: Transcript files, directories, or glob patterns (see process_transcripts.find_transcripts)
+# Returns: A list of conversations, each the list of one logged session's user lines
+def scripted_sessions(patterns):
+    from process_transcripts import find_transcripts, iter_turns
+
+    sessions = {}
+    for fname in find_transcripts(patterns):
+        for session, turn, speaker, text in iter_turns(fname):
+            if speaker == "user":
+                sessions.setdefault((fname, session), []).append(text)
+    return list(sessions.values())
+
+
+# Function: run_session(lines, model, vectorizer=None, word2vec=None)
+# lines: The user's lines, in order
+# Returns: A list of (state, latency in ms) pairs, one per turn
+#
+# This function drives the dialogue state machine headlessly, the way server.py
+# does: each turn is analyze_turn() followed by transition().  It stops at "quit"
+# or when the lines run out.
+def run_session(lines, model, vectorizer=None, word2vec=None):
+    session = chatbot.ChatSession()
+    chatbot.start_session(session)
+    turns = []
+    for line in lines:
+        state = session.state
+        start = time.perf_counter()
+        analysis = chatbot.analyze_turn(state, line, model, vectorizer, word2vec)
+        chatbot.transition(session, line, analysis)
+        turns.append((state, 1000 * (time.perf_counter() - start)))
+        if session.state == "quit":
+            break
+    return turns
+
+
+# Function: summarize_latencies(latencies)
+# latencies: A list of latencies in ms
+# Returns: A dictionary with their count, mean, p50, p95, p99 and maximum
+def summarize_latencies(latencies):
+    latencies = np.asarray(latencies)
+    return {"count": len(latencies), "mean_ms": float(latencies.mean()),
+            "p50_ms": float(np.percentile(latencies, 50)), "p95_ms": float(np.percentile(latencies, 95)),
+            "p99_ms": float(np.percentile(latencies, 99)), "max_ms": float(latencies.max())}
+
+
+# Function: compare_results(results, baseline, max_regression=None, min_ms=0.1)
+# results, baseline: Results written by bench_e2e
+# max_regression: OPTIONAL; The largest acceptable slowdown, as a fraction (0.2 = 20%)
+# min_ms: Slowdowns smaller than this many milliseconds are not regressions, so
+#         that noise in near-instant states is ignored
+# Returns: A list of descriptions of the regressions beyond max_regression
+#
+# Prints the change in each state's p50/p95/p99 latency and in sessions/sec.
+def compare_results(results, baseline, max_regression=None, min_ms=0.1):
+    regressions = []
+    if results["config"] != baseline["config"]:
+        print("Note: the baseline was run with different settings: {0}".format(
+            {key: value for key, value in baseline["config"].items() if results["config"].get(key) != value}))
+    print("Compared with the baseline:")
+    for state, summary in results["states"].items():
+        if state not in baseline["states"]:
+            continue
+        changes = []
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            before = baseline["states"][state][key]
+            change = summary[key] / max(before, 1e-9) - 1
+            changes.append("{0} {1:+.1%}".format(key[:3], change))
+            if (max_regression is not None and key == "p95_ms" and change > max_regression
+                    and summary[key] - before > min_ms):
+                regressions.append("{0} p95 {1:+.1%}".format(state, change))
+        print("  {0:<20}{1}".format(state, "  ".join(changes)))
+    change = results["sessions_per_sec"] / max(baseline["sessions_per_sec"], 1e-9) - 1
+    print("  {0:<20}{1:+.1%}".format("sessions/sec", change))
+    if max_regression is not None and -change > max_regression:
+        regressions.append("sessions/sec {0:+.1%}".format(change))
+    return regressions
+
+
+# Function: bench_e2e(args)
+# Replays synthetic conversations (user lines sampled from dataset reviews) or
+# logged transcripts through the state machine, with the saved model and the
+# local fake CoreNLP server, and reports per-state latency percentiles and
+# sessions/sec.  Results can be saved as JSON and compared with an earlier run.
+def bench_e2e(args):
+    server = None
+    url = args.url
+    if url is None:
+        server, url = spawn_fake_corenlp(args.latency_ms)
+    chatbot.CORENLP_URL = url
+    chatbot._corenlp_client = None
+    chatbot.PARSE_CACHE.clear()
+    chatbot.STYLISTIC_CACHE.clear()
+    chatbot.configure_sentiment_cache(args.sentiment_cache_ttl)
+
+    embedding_path = chatbot.default_embedding_path()
+    model, vectorizer = chatbot.load_artifacts(args.model, chatbot.training_fingerprint(args.data, embedding_path))
+    word2vec = chatbot.load_w2v(embedding_path) if vectorizer is None else None
+
+    if args.transcripts:
+        sessions = scripted_sessions(args.transcripts)
+    else:
+        documents, labels = chatbot.load_as_list(args.data)
+        sessions = synthetic_sessions(documents, args.sessions, args.rounds, args.seed)
+
+    try:
+        run_session(sessions[0], model, vectorizer, word2vec)  # Warm up (tokenizer, connections)
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            session_turns, elapsed = time_call(
+                lambda: list(pool.map(lambda lines: run_session(lines, model, vectorizer, word2vec), sessions)))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    latencies = {}
+    for turns in session_turns:
+        for state, latency in turns:
+            latencies.setdefault(state, []).append(latency)
+    all_latencies = [latency for turns in session_turns for state, latency in turns]
+    results = {"config": {"sessions": len(sessions), "source": "transcripts" if args.transcripts else "synthetic",
+                          "rounds": args.rounds, "concurrency": args.concurrency, "latency_ms": args.latency_ms,
+                          "tokenizer": chatbot.TOKENIZER, "model": type(model).__name__,
+                          "features": "tfidf" if vectorizer is not None else "w2v",
+                          "sentiment_cache_ttl": args.sentiment_cache_ttl},
+               "turns": len(all_latencies), "elapsed_s": elapsed, "sessions_per_sec": len(sessions) / elapsed,
+               "turns_per_sec": len(all_latencies) / elapsed,
+               "states": {state: summarize_latencies(values) for state, values in latencies.items()},
+               "all": summarize_latencies(all_latencies)}
+
+    print("{0} sessions, {1} turns in {2:.2f}s: {3:.1f} sessions/sec, {4:.1f} turns/sec".format(
+        len(sessions), len(all_latencies), elapsed, results["sessions_per_sec"], results["turns_per_sec"]))
+    print("{0:<20}{1:>8}{2:>10}{3:>10}{4:>10}{5:>10}".format("State", "Turns", "p50 ms", "p95 ms", "p99 ms", "Max ms"))
+    for state, summary in list(results["states"].items()) + [("all", results["all"])]:
+        print("{0:<20}{count:>8}{p50_ms:>10.2f}{p95_ms:>10.2f}{p99_ms:>10.2f}{max_ms:>10.2f}".format(
+            state, **summary))
+    if chatbot.SENTIMENT_CACHE is not None:
+        print(chatbot.SENTIMENT_CACHE.format("sentiment_cache"))
+
+    if args.output:
+        with open(args.output, "w") as fout:
+            json.dump(results, fout, indent=2)
+    if args.compare:
+        with open(args.compare) as fin:
+            regressions = compare_results(results, json.load(fin), args.max_regression)
+        if regressions:
+            sys.exit("Latency regression: " + "; ".join(regressions))
+
+
+# Modules that chatbot.py should only import when they are first needed.
+DEFERRED_MODULES = ("pandas", "sklearn", "nltk", "requests", "scipy")
+
+# Run in a fresh interpreter by measure_first_response: starts up the way
+# "python chatbot.py serve" does (import, load the saved model and, for Word2Vec
+# models, the embeddings) and answers one message, then prints how long each step took.
+FIRST_RESPONSE_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import chatbot
+imported = time.perf_counter()
+model_path, data, tokenizer, deferred = sys.argv[1:5]
+chatbot.TOKENIZER = tokenizer
+embedding_path = chatbot.default_embedding_path()
+model, vectorizer = chatbot.load_artifacts(model_path, chatbot.training_fingerprint(data, embedding_path))
+word2vec = chatbot.load_w2v(embedding_path) if vectorizer is None else None
+loaded = time.perf_counter()
+chatbot.sentiment_response(chatbot.predict_sentiment("I really enjoyed this, it was great!", model, vectorizer,
+                                                     word2vec))
+answered = time.perf_counter()
+print(json.dumps({"import_ms": 1000 * (imported - start), "load_ms": 1000 * (loaded - imported),
+                  "first_response_ms": 1000 * (answered - start),
+                  "deferred_imported": [m for m in deferred.split(",") if m in sys.modules]}))
+"""
+
+
+# Function: chatbot_env()
+# Returns: An environment for a fresh interpreter that can import chatbot.py from
+#          any working directory
+def chatbot_env():
+    env = dict(os.environ)
+    repo_dir = os.path.dirname(os.path.abspath(chatbot.__file__))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [repo_dir, env.get("PYTHONPATH")]))
+    return env
+
+
+# Function: measure_import()
+# Returns: The time "import chatbot" takes according to python -X importtime (in
+#          ms), and the slowest modules it imports as (cumulative ms, name) pairs
+#
+# Modules imported by the interpreter itself (while importing site) are skipped.
+def measure_import():
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import chatbot"],
+                            capture_output=True, text=True, check=True, env=chatbot_env())
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if name.strip() == "site":
+            modules = []
+            continue
+        modules.append((int(cumulative_us) / 1000, name.strip()))
+    total = next(ms for ms, name in reversed(modules) if name == "chatbot")
+    return total, sorted(modules, reverse=True)[1:11]
+
+
+# Function: measure_first_response(model_path, data, tokenizer)
+# Returns: The timings printed by FIRST_RESPONSE_SCRIPT, run in a fresh interpreter
+def measure_first_response(model_path, data, tokenizer):
+    result = subprocess.run([sys.executable, "-c", FIRST_RESPONSE_SCRIPT, model_path, data, tokenizer,
+                             ",".join(DEFERRED_MODULES)],
+                            capture_output=True, text=True, check=True, env=chatbot_env())
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+# Function: bench_scorer(args)
+# Exports the saved model with linear_scorer.export_model, checks that both
+# predict the same labels on the data, and reports the time per predict call of
+# each for several batch sizes.
+def bench_scorer(args):
+    import linear_scorer
+    embedding_path = chatbot.default_embedding_path()
+    model, vectorizer = chatbot.load_artifacts(args.model, chatbot.training_fingerprint(args.data, embedding_path))
+    scorer = linear_scorer.export_model(model)
+    word2vec = chatbot.load_w2v(embedding_path) if vectorizer is None else None
+    features, labels = linear_scorer.featurize(args.data, vectorizer, word2vec)
+    mismatches, max_diff = linear_scorer.check_parity(model, scorer, features)
+    print("{0} -> {1}: {2} of {3:,} predictions differ{4}".format(
+        type(model).__name__, type(scorer).__name__, mismatches, features.shape[0],
+        ", max score difference {0:.2e}".format(max_diff) if max_diff is not None else ""))
+
+    print("{0:>8}{1:>20}{2:>16}{3:>10}".format("Batch", "scikit-learn (us)", "scorer (us)", "Speedup"))
+    for batch_size in args.batch_sizes:
+        batches = [features[start:start + batch_size]
+                   for start in range(0, features.shape[0] - batch_size + 1, batch_size)] or [features]
+        calls = max(args.calls // len(batches), 1)
+        sklearn_results, sklearn_seconds = time_call(
+            lambda: [model.predict(batch) for i in range(calls) for batch in batches])
+        scorer_results, scorer_seconds = time_call(
+            lambda: [scorer.predict(batch) for i in range(calls) for batch in batches])
+        total_calls = calls * len(batches)
+        print("{0:>8}{1:>20.1f}{2:>16.1f}{3:>9.1f}x".format(
+            batches[0].shape[0], 1e6 * sklearn_seconds / total_calls, 1e6 * scorer_seconds / total_calls,
+            sklearn_seconds / scorer_seconds))
+
+
+# Function: bench_startup(args)
+# Reports how long "import chatbot" takes (and what it spends it on), and the time
+# from interpreter start to the first sentiment reply with the saved model.  Exits
+# with an error if either exceeds its threshold, to catch startup regressions.
+def bench_startup(args):
+    import_times = []
+    for i in range(args.repeat):
+        total, slowest = measure_import()
+        import_times.append(total)
+    import_ms = float(np.median(import_times))
+    print("import chatbot: {0:.1f} ms (median of {1}, python -X importtime)".format(import_ms, args.repeat))
+    for cumulative_ms, name in slowest:
+        print("  {0:>8.1f} ms  {1}".format(cumulative_ms, name))
+
+    runs = [measure_first_response(args.model, args.data, chatbot.TOKENIZER) for i in range(args.repeat)]
+    first_response_ms = float(np.median([run["first_response_ms"] for run in runs]))
+    print("Time to first response: {0:.1f} ms (import {1:.1f} ms, loading the model {2:.1f} ms)".format(
+        first_response_ms, float(np.median([run["import_ms"] for run in runs])),
+        float(np.median([run["load_ms"] for run in runs]))))
+    print("Deferred modules imported by then: {0}".format(", ".join(runs[-1]["deferred_imported"]) or "none"))
+
+    if args.output:
+        with open(args.output, "w") as fout:
+            json.dump({"import_ms": import_ms, "first_response_ms": first_response_ms, "runs": runs}, fout, indent=2)
+
+    failures = []
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        failures.append("import took {0:.1f} ms (limit {1} ms)".format(import_ms, args.max_import_ms))
+    if args.max_first_response_ms is not None and first_response_ms > args.max_first_response_ms:
+        failures.append("first response took {0:.1f} ms (limit {1} ms)".format(
+            first_response_ms, args.max_first_response_ms))
+    if failures:
+        sys.exit("Startup regression: " + "; ".join(failures))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the chatbot's hot paths.")
+    parser.add_argument("--tokenizer", choices=["nltk", "regex"], default=chatbot.TOKENIZER,
+                        help="the get_tokens mode used by the benchmarks (default: %(default)s)")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    tokenizers = subparsers.add_parser("tokenizers", help="get_tokens throughput and regex tokenizer accuracy")
+    tokenizers.add_argument("--data", default="dataset.csv")
+    tokenizers.set_defaults(func=bench_tokenizers)
+
+    tfidf_memory = subparsers.add_parser("tfidf-memory", help="peak RSS of dense vs. sparse TFIDF training")
+    tfidf_memory.add_argument("--data", default="dataset.csv")
+    tfidf_memory.add_argument("--repeat", type=int, default=1, help="copies of the dataset to train on")
+    tfidf_memory.set_defaults(func=bench_tfidf_memory)
+
+    corenlp = subparsers.add_parser("corenlp", help="dependency-parse throughput, latency and failure handling")
+    corenlp.add_argument("--data", default="dataset.csv")
+    corenlp.add_argument("--url", default=None, help="a real CoreNLP server (default: start the local fake)")
+    corenlp.add_argument("--requests", type=int, default=500)
+    corenlp.add_argument("--threads", type=int, default=8)
+    corenlp.add_argument("--latency-ms", type=float, default=5, help="latency injected by the fake server")
+    corenlp.set_defaults(func=bench_corenlp)
+
+    stylistic = subparsers.add_parser("stylistic", help="separate stylistic metrics vs. single-pass analyze_style")
+    stylistic.add_argument("--data", default="dataset.csv")
+    stylistic.add_argument("--lengths", type=int, nargs="+", default=[200, 2000, 20000, 200000],
+                           help="input lengths in characters")
+    stylistic.add_argument("--repeat", type=int, default=5)
+    stylistic.set_defaults(func=bench_stylistic)
+
+    startup = subparsers.add_parser("startup", help="import time and time to first response")
+    startup.add_argument("--model", default=chatbot.MODEL_FILE)
+    startup.add_argument("--data", default="dataset.csv", help="the training data the model should come from")
+    startup.add_argument("--repeat", type=int, default=5)
+    startup.add_argument("--max-import-ms", type=float, default=None, help="fail if importing takes longer")
+    startup.add_argument("--max-first-response-ms", type=float, default=None,
+                         help="fail if the first response takes longer")
+    startup.add_argument("--output", default=None, help="also write the results to this JSON file")
+    startup.set_defaults(func=bench_startup)
+
+    e2e = subparsers.add_parser("e2e", help="per-state latency of whole conversations through the state machine")
+    e2e.add_argument("--model", default=chatbot.MODEL_FILE)
+    e2e.add_argument("--data", default="dataset.csv", help="training data, and the reviews user lines come from")
+    e2e.add_argument("--transcripts", nargs="*", default=None,
+                     help="replay the users' lines from these transcripts instead of synthetic sessions")
+    e2e.add_argument("--sessions", type=int, default=200, help="number of synthetic sessions")
+    e2e.add_argument("--rounds", type=int, default=4, help="next-step requests per synthetic session")
+    e2e.add_argument("--seed", type=int, default=100)
+    e2e.add_argument("--concurrency", type=int, default=1, help="sessions run at once")
+    e2e.add_argument("--url", default=None, help="a real CoreNLP server (default: start the local fake)")
+    e2e.add_argument("--latency-ms", type=float, default=0, help="latency injected by the fake server")
+    e2e.add_argument("--output", default=None, help="write the results to this JSON file")
+    e2e.add_argument("--compare", default=None, help="compare with results saved by an earlier --output")
+    e2e.add_argument("--max-regression", type=float, default=None,
+                     help="fail if a state's p95 or sessions/sec is this fraction worse than --compare's")
+    e2e.add_argument("--sentiment-cache-ttl", type=float, default=chatbot.SENTIMENT_CACHE_TTL,
+                     help="seconds a cached sentiment result stays valid (0 disables the cache)")
+    e2e.set_defaults(func=bench_e2e)
+
+    scorer = subparsers.add_parser("scorer", help="scikit-learn predict vs. the exported NumPy scorer")
+    scorer.add_argument("--model", default=chatbot.MODEL_FILE)
+    scorer.add_argument("--data", default="dataset.csv", help="the documents predicted")
+    scorer.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32, 1000])
+    scorer.add_argument("--calls", type=int, default=2000, help="predict calls per batch size")
+    scorer.set_defaults(func=bench_scorer)
+
+    intent = subparsers.add_parser("intents", help="next-step intent recognition rate and latency")
+    intent.add_argument("--typos", type=int, default=20, help="random misspellings of each intent's name")
+    intent.add_argument("--seed", type=int, default=100)
+    intent.add_argument("--repeat", type=int, default=1000)
+    intent.set_defaults(func=bench_intents)
+
+    args = parser.parse_args()
+    chatbot.TOKENIZER = args.tokenizer
+    args.func(args)
@@ -0,0 +1,290 @@
+# A bounded, thread-safe LRU cache for expensive per-utterance results, such as
+# CoreNLP dependency parses, stylistic features, and sentiment predictions.
+#
+# The cache is bounded by the total size of its entries (measured as the length of
+# each pickled key and value) rather than by the number of entries, so a few very
+# long inputs cannot crowd out memory.  Entries can also expire a fixed time after
+# they were cached (ttl).  It can be saved to and loaded from a file, so results
+# survive restarts.
+#
+# SQLiteCache keeps entries in an SQLite database file instead, so that every
+# process on a host (e.g., several server workers) shares them, and TieredCache
+# puts an LRUCache in front of it, so repeated lookups in one process do not touch
+# the file.
+# =========================================================================================================
+
+import hashlib
+import os
+import pickle as pkl
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+# Function: normalize_text(text)
+# text: A string of arbitrary length
+# Returns: The text in Unicode NFC form with runs of whitespace collapsed to one
+#          space and leading/trailing whitespace removed
+#
+# Use this only for results that do not depend on the exact whitespace (a
+# dependency parse does not; punctuation density does).
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+# Function: text_key(text)
+# text: A string of arbitrary length
+# Returns: A short, fixed-size cache key for the text
+def text_key(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+# Function: entry_size(key, value)
+# Returns: The approximate size of a cache entry in bytes
+def entry_size(key, value):
+    return len(pkl.dumps((key, value), protocol=pkl.HIGHEST_PROTOCOL))
+
+
+# Function: format_stats(name, stats)
+# Returns: A one-line summary of a cache's stats(), e.g. for periodic logging
+def format_stats(name, stats):
+    return "{0}: hits={hits} misses={misses} hit_rate={hit_rate:.1%} entries={entries} bytes={bytes}".format(
+        name, **stats)
+
+
+# Class: LRUCache
+# max_bytes: The most bytes of entries kept; the least recently used are evicted first
+# max_entries: OPTIONAL; The most entries kept
+# ttl: OPTIONAL; The seconds an entry stays valid after it is cached
+#
+# hits and misses count get() lookups (a lookup of an expired entry is a miss).
+class LRUCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_entries=None, ttl=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, size, expiry time or None)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    # get(key, default=None): Returns the cached value (marking it most recently
+    # used), or default on a miss.
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self.size -= self.entries.pop(key)[1]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # put(key, value): Caches value, evicting least recently used entries as needed.
+    # Values larger than max_bytes are not cached.
+    def put(self, key, value):
+        size = entry_size(key, value)
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size, time.monotonic() + self.ttl if self.ttl is not None else None)
+            self.size += size
+            while self.size > self.max_bytes or (self.max_entries is not None and len(self.entries) > self.max_entries):
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    # stats(): Returns a dictionary of hit/miss counts, the hit rate, and the cache's size.
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "entries": len(self.entries), "bytes": self.size}
+
+    # format(name): Returns a one-line summary, e.g. for periodic logging.
+    def format(self, name):
+        return format_stats(name, self.stats())
+
+    # save(filepath): Writes the entries (least to most recently used) to a file,
+    # atomically.  Their expiry times are not saved; loaded entries start a new ttl.
+    def save(self, filepath):
+        with self.lock:
+            items = [(key, value) for key, (value, size, expires) in self.entries.items()]
+        with open(filepath + ".tmp", 'wb') as fout:
+            pkl.dump(items, fout, protocol=pkl.HIGHEST_PROTOCOL)
+        os.replace(filepath + ".tmp", filepath)
+
+    # load(filepath): Adds the entries saved by save(), keeping their recency order.
+    def load(self, filepath):
+        with open(filepath, 'rb') as fin:
+            items = pkl.load(fin)
+        for key, value in items:
+            self.put(key, value)
+
+
+# Class: SQLiteCache
+# filepath: The database file, shared by every process that opens it
+# max_entries: The most entries kept; the least recently used are evicted first
+# ttl: OPTIONAL; The seconds an entry stays valid after it is cached
+#
+# Values are pickled, so only share the file between processes of the same
+# application.  Each thread uses its own connection; the database is in WAL mode,
+# so readers do not wait for writers.  A lookup that fails because the database is
+# busy counts as a miss, a put that fails is dropped, and stats() reports the
+# last size it could read, so a slow disk never fails a turn.  hits and misses
+# count this process's lookups only.
+class SQLiteCache:
+    # A hit refreshes an entry's last-use time at most this often, in seconds, so
+    # that most hits do not write to the database.
+    TOUCH_INTERVAL = 60.0
+    # Expired and excess entries are removed once every PRUNE_EVERY puts.
+    PRUNE_EVERY = 256
+
+    def __init__(self, filepath, max_entries=100000, ttl=None):
+        self.filepath = filepath
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.size = (0, 0)  # The entries and bytes stats() last read
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.connection().execute("CREATE TABLE IF NOT EXISTS cache (key BLOB PRIMARY KEY, value BLOB NOT NULL, "
+                                  "expires REAL, used REAL NOT NULL)")
+        self.connection().execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+
+    # connection(): Returns this thread's connection to the database.
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.filepath, timeout=1.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def __len__(self):
+        return self.connection().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def get(self, key, default=None):
+        now = time.time()
+        try:
+            row = self.connection().execute("SELECT value, expires, used FROM cache WHERE key = ?",
+                                            (key,)).fetchone()
+            if row is not None and row[1] is not None and row[1] <= now:
+                row = None
+            if row is not None and now - row[2] > self.TOUCH_INTERVAL:
+                self.connection().execute("UPDATE cache SET used = ? WHERE key = ?", (now, key))
+        except sqlite3.OperationalError:
+            row = None
+        with self.lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return pkl.loads(row[0]) if row is not None else default
+
+    def put(self, key, value):
+        now = time.time()
+        with self.lock:
+            self.puts += 1
+            prune = self.puts % self.PRUNE_EVERY == 0
+        try:
+            self.connection().execute("INSERT OR REPLACE INTO cache (key, value, expires, used) VALUES (?, ?, ?, ?)",
+                                      (key, pkl.dumps(value, protocol=pkl.HIGHEST_PROTOCOL),
+                                       now + self.ttl if self.ttl is not None else None, now))
+            if prune:
+                self.prune()
+        except sqlite3.OperationalError:
+            pass
+
+    # prune(): Removes expired entries, then the least recently used entries over max_entries.
+    def prune(self):
+        connection = self.connection()
+        connection.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+        connection.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used DESC "
+                           "LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def clear(self):
+        self.connection().execute("DELETE FROM cache")
+
+    def stats(self):
+        try:
+            size = tuple(self.connection().execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) "
+                                                   "FROM cache").fetchone())
+        except sqlite3.OperationalError:
+            size = None
+        with self.lock:
+            if size is not None:
+                self.size = size
+            entries, size = self.size
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0, "entries": entries, "bytes": size}
+
+    def format(self, name):
+        return format_stats(name, self.stats())
+
+
+# Class: TieredCache
+# local: An LRUCache for this process
+# shared: A SQLiteCache shared with other processes
+#
+# Lookups try the local cache first, and copy shared hits into it; puts go to
+# both.  stats() counts a lookup as a hit if either cache had the value, and
+# reports the local and shared hits separately.
+class TieredCache:
+    def __init__(self, local, shared):
+        self.local = local
+        self.shared = shared
+
+    def __len__(self):
+        return len(self.shared)
+
+    def get(self, key, default=None):
+        value = self.local.get(key)
+        if value is None:
+            value = self.shared.get(key)
+            if value is None:
+                return default
+            self.local.put(key, value)
+        return value
+
+    def put(self, key, value):
+        self.local.put(key, value)
+        self.shared.put(key, value)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def stats(self):
+        local, shared = self.local.stats(), self.shared.stats()
+        lookups = local["hits"] + local["misses"]
+        hits = local["hits"] + shared["hits"]
+        return {"hits": hits, "misses": lookups - hits, "hit_rate": hits / lookups if lookups else 0.0,
+                "local_hits": local["hits"], "shared_hits": shared["hits"], "entries": shared["entries"],
+                "bytes": shared["bytes"]}
+
+    def format(self, name):
+        stats = self.stats()
+        return format_stats(name, stats) + " (local_hits={local_hits} shared_hits={shared_hits})".format(**stats)
@@ -1,22 +1,57 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.naive_bayes import GaussianNB
-import pandas as pd
 import numpy as np
 import pickle as pkl
-from sklearn.linear_model import LogisticRegression
-from sklearn.svm import LinearSVC
-from sklearn.neural_network import MLPClassifier
-from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score
 import string
 import re
 import csv
-import nltk
+import os
+import sys
+import argparse
+import hashlib
+from itertools import chain
+from typing import NamedTuple, Optional
+import time
 from time import localtime, strftime
-from nltk.parse.corenlp import CoreNLPDependencyParser
+import threading
+import intents
+import metrics
+from cache import LRUCache, SQLiteCache, TieredCache, normalize_text, text_key
+from transcript import TranscriptWriter
+
+# pandas, scikit-learn, NLTK and the CoreNLP client (which needs requests) are
+# imported by the functions that use them, so a process that only serves one
+# model does not pay to import the others, and importing this module stays fast.
+# "python benchmark.py startup" measures import and time-to-first-response.
 
 #-----------------------------------FILE WRITER-------------------------------------------------------
+# The terminal chatbot logs its conversation as structured JSONL records (see
+# transcript.py) through a background writer, opened by open_transcript().
+
+TRANSCRIPT_FILE = "transcripts.jsonl"
+
+transcript = None
+transcript_session = None
+
+
+# Function: open_transcript(path=TRANSCRIPT_FILE, per_session=False)
+# path: The JSONL file to append to (or, with per_session, a directory of per-session files)
+# Returns: The TranscriptWriter, which is also what log_message() writes to
+def open_transcript(path=TRANSCRIPT_FILE, per_session=False):
+    global transcript, transcript_session
+    transcript = TranscriptWriter(path, per_session)
+    transcript_session = "{0}_{1}".format(strftime("%Y-%m-%d_%H:%M:%S", localtime()), os.getpid())
+    return transcript
 
-f = open("{0}.txt".format(strftime("%Y-%m-%d_%H:%M:%S", localtime())), "w")
+
+# Function: log_message(speaker, text, state=None, latency=None)
+# speaker: "chatbot" or "user"
+# state: The dialogue state the message belongs to
+# latency: For chatbot replies, the seconds spent producing the reply
+#
+# This function queues the message for the transcript opened by open_transcript
+# (and does nothing if none is open).
+def log_message(speaker, text, state=None, latency=None):
+    if transcript is not None:
+        transcript.log(transcript_session, speaker, text, state, latency)
 
 
 # If you store the downloaded .pkl file in the same directory as this Python
@@ -24,13 +59,47 @@ f = open("{0}.txt".format(strftime("%Y-%m-%d_%H:%M:%S", localtime())), "w")
 # file elsewhere, you will need to update the file path accordingly.
 EMBEDDING_FILE = "w2v.pkl"
 
+# Memory-mapped version of EMBEDDING_FILE, written once by embedding_store.py
+# (python embedding_store.py w2v.pkl w2v_store).  When this directory exists it is
+# loaded instead of the pickle, which makes startup near-instant and lets every
+# process on a host share one copy of the vectors.
+EMBEDDING_STORE = "w2v_store"
+
+# A store holding only the words found in the training data and transcripts,
+# written by prune_embeddings.py.  When this directory exists it is loaded instead
+# of EMBEDDING_STORE (and may fall back to it for other words).
+PRUNED_STORE = "w2v_pruned"
+
+
+# Function: default_embedding_path()
+# Returns: PRUNED_STORE or EMBEDDING_STORE, the first that has been created, and
+#          EMBEDDING_FILE otherwise
+def default_embedding_path():
+    for store_path in (PRUNED_STORE, EMBEDDING_STORE):
+        if os.path.isdir(store_path):
+            return store_path
+    return EMBEDDING_FILE
+
+
+# "python chatbot.py train" saves the trained model here, along with a fingerprint
+# of the training data and embeddings it was trained with, and
+# "python chatbot.py serve" loads it instead of retraining.
+MODEL_FILE = "model.pkl"
+
 
 # Function: load_w2v
-# filepath: path of w2v.pkl
+# filepath: path of w2v.pkl, or of a store directory written by embedding_store.py
 # Returns: A dictionary containing words as keys and pre-trained word2vec representations as numpy arrays of shape (300,)
+#          (or an EmbeddingStore, which supports the same lookups)
 def load_w2v(filepath):
+    if os.path.isdir(filepath):
+        from embedding_store import open_store
+        return open_store(filepath)
+
     with open(filepath, 'rb') as fin:
-        return pkl.load(fin)
+        word2vec = pkl.load(fin)
+    _embedding_files[id(word2vec)] = (word2vec, filepath)  # For embeddings_tag
+    return word2vec
 
 
 # Function: load_as_list(fname)
@@ -40,12 +109,107 @@ def load_w2v(filepath):
 # This helper function reads in the specified, specially-formatted CSV file
 # and returns a list of documents (documents) and a list of binary values (label).
 def load_as_list(fname):
+    import pandas as pd
     df = pd.read_csv(fname)
     documents = df['review'].values.tolist()
     labels = df['label'].values.tolist()
     return documents, labels
 
 
+# Function: load_in_chunks(fname, chunksize, skip_rows=0)
+# fname: A string indicating a filename
+# chunksize: The number of rows to read at a time
+# skip_rows: The number of data rows to skip at the start of the file
+# Returns: A generator of (documents, labels) list pairs, one per chunk
+#
+# This helper reads the same CSV format as load_as_list, but only holds one chunk
+# of the file in memory at a time.
+def load_in_chunks(fname, chunksize, skip_rows=0):
+    import pandas as pd
+    for df in pd.read_csv(fname, chunksize=chunksize, skiprows=range(1, skip_rows + 1)):
+        yield df['review'].values.tolist(), df['label'].values.tolist()
+
+
+# Function: file_fingerprint(filepath)
+# filepath: path of a file or of a directory (such as an embedding store)
+# Returns: A hex digest identifying the contents of the file or directory
+#
+# Files up to 64 MiB are hashed in full.  Larger files (e.g., w2v.pkl) are
+# identified by their size plus samples from their start, middle, and end, so
+# that checking the embeddings stays fast enough to do on every startup.
+def file_fingerprint(filepath):
+    sample_size = 1 << 20
+    digest = hashlib.sha256()
+
+    if os.path.isdir(filepath):
+        for name in sorted(os.listdir(filepath)):
+            digest.update(name.encode("utf-8"))
+            digest.update(file_fingerprint(os.path.join(filepath, name)).encode("ascii"))
+        return digest.hexdigest()
+
+    size = os.path.getsize(filepath)
+    digest.update(str(size).encode("ascii"))
+    with open(filepath, "rb") as fin:
+        if size <= 64 * sample_size:
+            for block in iter(lambda: fin.read(sample_size), b""):
+                digest.update(block)
+        else:
+            for offset in (0, size // 2, size - sample_size):
+                fin.seek(offset)
+                digest.update(fin.read(sample_size))
+    return digest.hexdigest()
+
+
+# Function: training_fingerprint(data_file, embedding_file)
+# data_file: path of the training CSV file
+# embedding_file: path of the Word2Vec representations (None, or a missing file, for TFIDF models)
+# Returns: A dictionary identifying the inputs a model was trained from
+def training_fingerprint(data_file, embedding_file=None):
+    fingerprint = {"data": file_fingerprint(data_file)}
+    if embedding_file is not None and os.path.exists(embedding_file):
+        fingerprint["embeddings"] = file_fingerprint(embedding_file)
+    return fingerprint
+
+
+# Function: save_artifacts(filepath, model, vectorizer, fingerprint, tokenizer=None)
+# filepath: path to write the artifacts to
+# model: A trained classification model
+# vectorizer: The trained vectorizer, if using TFIDF (None otherwise)
+# fingerprint: The training_fingerprint() of the model's training inputs
+# tokenizer: OPTIONAL; The TOKENIZER the model was trained with (default: the current one)
+# Returns: Nothing (writes output to file)
+def save_artifacts(filepath, model, vectorizer, fingerprint, tokenizer=None):
+    artifacts = {"model": model, "vectorizer": vectorizer, "fingerprint": fingerprint,
+                 "tokenizer": tokenizer or TOKENIZER}
+    with open(filepath + ".tmp", 'wb') as fout:
+        pkl.dump(artifacts, fout, protocol=pkl.HIGHEST_PROTOCOL)
+    os.replace(filepath + ".tmp", filepath)
+
+
+# Function: load_artifacts(filepath, fingerprint)
+# filepath: path of artifacts written by save_artifacts
+# fingerprint: The training_fingerprint() of the current training inputs
+# Returns: The trained model and vectorizer (None if not using TFIDF)
+#
+# Raises a ValueError if the artifacts were trained from different data or
+# embeddings than the ones given by fingerprint.  Only the inputs recorded when
+# the artifacts were saved are compared (e.g., a model trained without
+# embeddings is not affected by changes to them).
+#
+# Also sets TOKENIZER to the tokenizer the model was trained with (if recorded),
+# so that inputs are split into the same tokens at serve time as in training.
+def load_artifacts(filepath, fingerprint):
+    global TOKENIZER
+    with open(filepath, 'rb') as fin:
+        artifacts = pkl.load(fin)
+    if any(fingerprint.get(name) != digest for name, digest in artifacts["fingerprint"].items()):
+        raise ValueError("{0} is stale: the training data or embeddings have changed since it "
+                         "was saved.  Run \"python chatbot.py train\" to retrain.".format(filepath))
+    if artifacts.get("tokenizer"):
+        TOKENIZER = artifacts["tokenizer"]
+    return artifacts["model"], artifacts["vectorizer"]
+
+
 # Function: extract_user_info(user_input)
 # user_input: A string of arbitrary length
 # Returns: name as string
@@ -57,18 +221,79 @@ def extract_user_info(user_input):
     return name
 
 
-# Function to convert a given string into a list of tokens
-# Args:
-#   inp_str: input string
-# Returns: token list, dtype: list of strings
-def get_tokens(inp_str):
-    # Initialize NLTK tokenizer
+# Selects the tokenizer used by get_tokens.  "nltk" uses NLTK's word_tokenize;
+# "regex" uses a single precompiled regular expression that approximates
+# word_tokenize (see regex_tokenize) and is much faster, for latency-critical
+# paths.  Run "python benchmark.py tokenizers" to check how closely the two agree
+# on dataset.csv and how fast each one is.
+TOKENIZER = "nltk"
+
+_punkt_loaded = False
+
+# Opening double quotes (at the start of the input, or after whitespace or an
+# opening bracket), which word_tokenize rewrites as ``.
+_OPEN_QUOTE_RE = re.compile(r'(^|[\s(\[{<])"')
+
+# Approximates NLTK's Treebank word tokenizer in one pass: common contractions and
+# clitics are split off, punctuation becomes separate tokens, and periods,
+# commas and colons inside numbers (3.5, 1,000, 10:30) and acronyms (U.S.) are kept.
+_REGEX_TOKEN_RE = re.compile(r"""
+      ``|''
+    | (?:[A-Za-z]\.){2,}(?=[\s"')\]}>]|$)
+    | \b(?:Mrs|Mr|Ms|Dr)\.
+    | \.\.\.|--
+    | \b(?:can(?=not\b)|gon(?=na\b)|got(?=ta\b)|wan(?=na\b)|gim(?=me\b)|lem(?=me\b))
+    | [^\s.,;:@#$%&?!()\[\]{}<>"'`]+?(?=n't\b)
+    | n't\b
+    | '(?:ll|re|ve|s|m|d)\b
+    | [^\s.,;:@#$%&?!()\[\]{}<>"'`]+(?:(?:\.|(?<=\d)[,:](?=\d))[^\s.,;:@#$%&?!()\[\]{}<>"'`]+)*
+    | \S
+""", re.VERBOSE | re.IGNORECASE)
+
+
+# Function: load_tokenizer()
+# This function does not take any input
+# Returns: Nothing
+#
+# This function makes sure NLTK's punkt models are available, downloading them if
+# needed.  The lookup only happens on the first call in each process; later calls
+# return immediately.
+def load_tokenizer():
+    global _punkt_loaded
+    if _punkt_loaded:
+        return
+    import nltk
     try:
         nltk.data.find('tokenizers/punkt')
     except LookupError:
         print("NLTK tokenizer not found, downloading...")
         nltk.download('punkt')
-    return nltk.tokenize.word_tokenize(inp_str)
+    _punkt_loaded = True
+
+
+# Function: regex_tokenize(inp_str)
+# inp_str: input string
+# Returns: token list, dtype: list of strings
+#
+# A fast approximation of nltk.tokenize.word_tokenize that needs no NLTK models.
+def regex_tokenize(inp_str):
+    if '"' in inp_str:
+        inp_str = _OPEN_QUOTE_RE.sub(r"\1 `` ", inp_str).replace('"', " '' ")
+    return _REGEX_TOKEN_RE.findall(inp_str)
+
+
+# Function to convert a given string into a list of tokens
+# Args:
+#   inp_str: input string
+#   mode: OPTIONAL; "nltk" or "regex" (defaults to the global TOKENIZER setting)
+# Returns: token list, dtype: list of strings
+def get_tokens(inp_str, mode=None):
+    with metrics.span("tokenize"):
+        if (mode or TOKENIZER) == "regex":
+            return regex_tokenize(inp_str)
+        load_tokenizer()
+        from nltk.tokenize import word_tokenize
+        return word_tokenize(inp_str)
 
 
 # Function: vectorize_train, see project statement for more details
@@ -77,6 +302,7 @@ def get_tokens(inp_str):
 def vectorize_train(training_documents):
     # Initialize the TfidfVectorizer model and document-term matrix
 
+    from sklearn.feature_extraction.text import TfidfVectorizer
     vectorizer = TfidfVectorizer(tokenizer=get_tokens, lowercase=True, token_pattern=None)
     X_train_tfidf = vectorizer.fit_transform(training_documents)
     return vectorizer, X_train_tfidf
@@ -99,6 +325,8 @@ def w2v(word2vec, token):
 
     if token in word2vec:
         word_vector = word2vec[token]
+    elif hasattr(word2vec, "embed"):
+        word_vector = word2vec.embed([token])[0]  # Resolved by the store's OOV index, if it has one
 
     return word_vector
 
@@ -112,17 +340,106 @@ def w2v(word2vec, token):
 # each token in the string, and averages across those embeddings to produce a
 # single, averaged embedding for the entire input.
 def string2vec(word2vec, user_input):
-    tokens = get_tokens(user_input)
-    embeddings = []
-    for token in tokens:
-        token_embedding = w2v(word2vec, token)
-        embeddings.append(token_embedding)
+    return strings2vec(word2vec, [user_input])[0]
 
-    if not embeddings:
-        return np.zeros(300)
-    averaged_embedding = np.mean(embeddings, axis=0)
 
-    return averaged_embedding
+# Function: embed_tokens(word2vec, tokens)
+# word2vec: The pretrained Word2Vec model (a dictionary or an EmbeddingStore)
+# tokens: A list of strings
+# Returns: An array of shape (len(tokens), 300) holding one embedding per token
+#
+# Out-of-vocabulary tokens get a zero vector, as in w2v().  An EmbeddingStore
+# gathers every row with a single fancy-indexing operation.  For the dictionary
+# format, a small matrix holding only the distinct in-vocabulary tokens is stacked
+# first, so the per-token work is a dictionary lookup rather than an array copy.
+#
+# While metrics are enabled, the gather is timed ("embed_gather") and the tokens
+# left with a zero vector are counted ("oov_tokens").
+def embed_tokens(word2vec, tokens):
+    with metrics.span("embed_gather"):
+        vectors = _embed_tokens(word2vec, tokens)
+    if metrics.ENABLED:
+        metrics.count("oov_tokens", len(tokens) - int(np.count_nonzero(vectors.any(axis=1))))
+        metrics.count("tokens", len(tokens))
+    return vectors
+
+
+# _embed_tokens(word2vec, tokens): The gather itself, without the metrics.
+def _embed_tokens(word2vec, tokens):
+    if hasattr(word2vec, "embed"):
+        return word2vec.embed(tokens)
+
+    types = {token: None for token in tokens if token in word2vec}
+    for row, token in enumerate(types):
+        types[token] = row
+    matrix = np.zeros((len(types) + 1, 300))
+    if types:
+        matrix[:-1] = np.stack([word2vec[token] for token in types])
+    oov_row = len(types)
+    ids = np.fromiter((types.get(token, oov_row) for token in tokens), dtype=np.int64, count=len(tokens))
+    return matrix[ids]
+
+
+# Function: strings2vec(word2vec, documents, max_batch_tokens=65536)
+# word2vec: The pretrained Word2Vec model
+# documents: A list of strings
+# max_batch_tokens: The maximum number of token embeddings gathered at once
+# Returns: An array of shape (len(documents), 300), where row i is string2vec(word2vec, documents[i])
+#
+# This function embeds a whole corpus in one pass.  Tokens from consecutive
+# documents are concatenated, gathered in one operation by embed_tokens, and
+# averaged per document with a segmented sum (np.add.reduceat).  Documents are
+# processed in batches of at most max_batch_tokens tokens (a single longer
+# document gets a batch to itself) to bound the size of the gathered array.
+# Documents with no tokens get a zero vector.
+def strings2vec(word2vec, documents, max_batch_tokens=65536):
+    token_lists = [get_tokens(document) for document in documents]
+    lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=len(token_lists))
+    embeddings = np.zeros((len(documents), getattr(word2vec, "dim", 300)))
+
+    start = 0
+    while start < len(documents):
+        end = start + 1
+        batch_tokens = lengths[start]
+        while end < len(documents) and batch_tokens + lengths[end] <= max_batch_tokens:
+            batch_tokens += lengths[end]
+            end += 1
+
+        if batch_tokens > 0:
+            batch_lengths = lengths[start:end]
+            offsets = np.cumsum(batch_lengths) - batch_lengths
+            nonempty = batch_lengths > 0
+            vectors = embed_tokens(word2vec, list(chain.from_iterable(token_lists[start:end])))
+            sums = np.add.reduceat(vectors, offsets[nonempty], axis=0, dtype=np.float64)
+            embeddings[start:end][nonempty] = sums / batch_lengths[nonempty, None]
+        start = end
+
+    return embeddings
+
+
+# The names accepted by instantiate_model(), in the order instantiate_models() returns them.
+MODEL_NAMES = ("nb", "logistic", "svm", "mlp")
+
+
+# Function: instantiate_model(name)
+# name: "nb", "logistic", "svm", or "mlp"
+# Returns: An instantiated (untrained) machine learning model
+#
+# Only the scikit-learn module for the requested model family is imported.
+def instantiate_model(name):
+    if name == "nb":
+        from sklearn.naive_bayes import GaussianNB
+        return GaussianNB()
+    if name == "logistic":
+        from sklearn.linear_model import LogisticRegression
+        return LogisticRegression(random_state=100)
+    if name == "svm":
+        from sklearn.svm import LinearSVC
+        return LinearSVC(random_state=100)
+    if name == "mlp":
+        from sklearn.neural_network import MLPClassifier
+        return MLPClassifier(random_state=100)
+    raise ValueError("Unknown model: {0}".format(name))
 
 
 # Function: instantiate_models()
@@ -133,25 +450,91 @@ def string2vec(word2vec, user_input):
 # returns them for later downstream use.  You do not need to train the models
 # in this function.
 def instantiate_models():
-    nb = GaussianNB()
-    lr = LogisticRegression(random_state=100)
-    svm = LinearSVC(random_state=100)
-    mlp = MLPClassifier(random_state=100)
+    nb, lr, svm, mlp = (instantiate_model(name) for name in MODEL_NAMES)
 
     return nb, lr, svm, mlp
 
 
+# Models (by class name) that only accept dense input.  TFIDF matrices are
+# converted for these models DENSE_CHUNK_ROWS rows at a time, so memory use stays
+# bounded no matter how many documents there are.  All other models are given
+# the sparse matrix.
+DENSE_ONLY_MODELS = ("GaussianNB",)
+DENSE_CHUNK_ROWS = 256
+
+
+# Function: dense_chunks(matrix)
+# matrix: A sparse (or dense) document-term matrix
+# Returns: A generator of (row slice, dense array) pairs covering the matrix
+def dense_chunks(matrix):
+    for start in range(0, matrix.shape[0], DENSE_CHUNK_ROWS):
+        rows = slice(start, start + DENSE_CHUNK_ROWS)
+        chunk = matrix[rows]
+        yield rows, chunk.toarray() if hasattr(chunk, "toarray") else chunk
+
+
+# Function: fit_gaussian_nb_chunked(model, matrix, training_labels)
+# model: An instantiated GaussianNB model
+# matrix: A sparse document-term matrix
+# training_labels: A list of integers (all 0 or 1)
+# Returns: A trained version of the input model
+#
+# This function fits GaussianNB with partial_fit over dense chunks of the matrix.
+# Each partial_fit call adds a variance smoothing term derived from its own chunk
+# and removes the one it expects the previous call to have added, so the stored
+# variances are corrected before every call to keep chunks from contaminating
+# each other.  At the end, the smoothing term is set to the one fit() would have
+# computed from the whole matrix (its largest column variance, computed without
+# densifying), which gives the same model as fit() on the dense matrix.
+def fit_gaussian_nb_chunked(model, matrix, training_labels):
+    labels = np.asarray(training_labels)
+    classes = np.unique(labels)
+
+    def shift_variance(delta):
+        variance_attr = "var_" if "var_" in vars(model) else "sigma_"  # sigma_ before scikit-learn 1.0
+        setattr(model, variance_attr, getattr(model, variance_attr) + delta)
+
+    first_chunk = True
+    for rows, chunk in dense_chunks(matrix):
+        if not first_chunk:
+            shift_variance(model.var_smoothing * np.var(chunk, axis=0).max() - model.epsilon_)
+        model.partial_fit(chunk, labels[rows], classes=classes)
+        first_chunk = False
+
+    column_means = np.asarray(matrix.mean(axis=0)).ravel()
+    column_sq_means = np.asarray(matrix.multiply(matrix).mean(axis=0)).ravel()
+    epsilon = model.var_smoothing * (column_sq_means - column_means ** 2).max()
+    shift_variance(epsilon - model.epsilon_)
+    model.epsilon_ = epsilon
+    return model
+
+
+# Function: predict_features(model, features)
+# model: A trained machine learning model
+# features: A feature matrix (sparse or dense)
+# Returns: The predicted labels, as a numpy array
+#
+# Sparse matrices are passed to the model as-is, except for DENSE_ONLY_MODELS,
+# which predict one bounded-size dense chunk at a time.
+def predict_features(model, features):
+    if type(model).__name__ in DENSE_ONLY_MODELS and hasattr(features, "toarray"):
+        return np.concatenate([model.predict(chunk) for rows, chunk in dense_chunks(features)])
+    return model.predict(features)
+
+
 # Function: train_model_tfidf(model, word2vec, training_documents, training_labels)
 # model: An instantiated machine learning model
 # tfidf_train: A document-term matrix built from the training data
 # training_labels: A list of integers (all 0 or 1)
 # Returns: A trained version of the input model
 #
-# This function trains an input machine learning model using averaged Word2Vec
-# embeddings for the training documents.
+# This function trains an input machine learning model using the TFIDF
+# document-term matrix for the training documents.  The matrix stays sparse for
+# models that accept sparse input.
 def train_model_tfidf(model, tfidf_train, training_labels):
-    tfidf_dense = tfidf_train.toarray()
-    model.fit(tfidf_dense, training_labels)
+    if type(model).__name__ in DENSE_ONLY_MODELS:
+        return fit_gaussian_nb_chunked(model, tfidf_train, training_labels)
+    model.fit(tfidf_train, training_labels)
     return model
 
 
@@ -165,17 +548,25 @@ def train_model_tfidf(model, tfidf_train, training_labels):
 # This function trains an input machine learning model using averaged Word2Vec
 # embeddings for the training documents.
 def train_model_w2v(model, word2vec, training_documents, training_labels):
-    embeddings_list = []
-
-    for document in training_documents:
-        doc_embedding = string2vec(word2vec, document)
-        embeddings_list.append(doc_embedding)
-
-    X_train_w2v = np.array(embeddings_list)
+    X_train_w2v = strings2vec(word2vec, training_documents)
     model.fit(X_train_w2v, training_labels)
     return model
 
 
+# Function: score_predictions(test_labels, predicted_labels)
+# test_labels: A list of integers (all 0 or 1)
+# predicted_labels: The labels predicted for the same documents
+# Returns: Precision, recall, F1, and accuracy values for the predictions
+def score_predictions(test_labels, predicted_labels):
+    from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score
+    precision = precision_score(test_labels, predicted_labels)
+    recall = recall_score(test_labels, predicted_labels)
+    f1 = f1_score(test_labels, predicted_labels)
+    accuracy = accuracy_score(test_labels, predicted_labels)
+
+    return precision, recall, f1, accuracy
+
+
 # Function: test_model_tfidf(model, word2vec, training_documents, training_labels)
 # model: An instantiated machine learning model
 # vectorizer: An initialized TfidfVectorizer model
@@ -188,15 +579,10 @@ def train_model_w2v(model, word2vec, training_documents, training_labels):
 # that document.  It compares the predicted and actual test labels and returns
 # precision, recall, f1, and accuracy scores.
 def test_model_tfidf(model, vectorizer, test_documents, test_labels):
-    X_test_tfidf = vectorizer.transform(test_documents).toarray()
-    predicted_labels = model.predict(X_test_tfidf)
-
-    precision = precision_score(test_labels, predicted_labels)
-    recall = recall_score(test_labels, predicted_labels)
-    f1 = f1_score(test_labels, predicted_labels)
-    accuracy = accuracy_score(test_labels, predicted_labels)
+    X_test_tfidf = vectorizer.transform(test_documents)
+    predicted_labels = predict_features(model, X_test_tfidf)
 
-    return precision, recall, f1, accuracy
+    return score_predictions(test_labels, predicted_labels)
 
 
 # Function: test_model_w2v(model, word2vec, training_documents, training_labels)
@@ -211,21 +597,10 @@ def test_model_tfidf(model, vectorizer, test_documents, test_labels):
 # that document.  It compares the predicted and actual test labels and returns
 # precision, recall, f1, and accuracy scores.
 def test_model_w2v(model, word2vec, test_documents, test_labels):
-    test_embeddings = []
-
-    for doc in test_documents:
-        doc_embedding = string2vec(word2vec, doc)
-        test_embeddings.append(doc_embedding)
-
-    X_test_w2v = np.array(test_embeddings)
+    X_test_w2v = strings2vec(word2vec, test_documents)
     predicted_labels = model.predict(X_test_w2v)
 
-    precision = precision_score(test_labels, predicted_labels)
-    recall = recall_score(test_labels, predicted_labels)
-    f1 = f1_score(test_labels, predicted_labels)
-    accuracy = accuracy_score(test_labels, predicted_labels)
-
-    return precision, recall, f1, accuracy
+    return score_predictions(test_labels, predicted_labels)
 
 
 # Function: compute_ttr(user_input)
@@ -236,6 +611,8 @@ def test_model_w2v(model, word2vec, test_documents, test_labels):
 # Type-token ratio is computed as: num_types / num_tokens, where num_types is
 # the number of unique tokens.
 def compute_ttr(user_input):
+    import nltk
+
     # Tokenize the input text
     tokens = nltk.tokenize.word_tokenize(user_input)
 
@@ -258,6 +635,8 @@ def compute_ttr(user_input):
 #
 # This function computes the average number of tokens per sentence
 def tokens_per_sentence(user_input):
+    import nltk
+
     # Tokenize the input into sentences
     sentences = nltk.tokenize.sent_tokenize(user_input)
 
@@ -277,6 +656,34 @@ def tokens_per_sentence(user_input):
     return tps
 
 
+# URL of the Stanford CoreNLP server used for dependency parses.
+CORENLP_URL = os.environ.get("CORENLP_URL", "http://localhost:9000")
+
+_corenlp_client = None
+_corenlp_lock = threading.Lock()
+
+# Users often resubmit the same text when they redo an analysis, so dependency
+# parses and stylistic features are cached.  Parses are keyed by the input with
+# whitespace normalized; the features (punctuation density counts every character)
+# by the exact input.  See load_caches/save_caches for keeping them across runs.
+PARSE_CACHE = LRUCache(max_bytes=32 * 1024 * 1024)
+STYLISTIC_CACHE = LRUCache(max_bytes=16 * 1024 * 1024)
+PARSE_CACHE_FILE = "parse_cache.pkl"
+STYLISTIC_CACHE_FILE = "stylistic_cache.pkl"
+
+
+# Function: get_corenlp_client()
+# Returns: The CoreNLPClient shared by every caller in this process, so parses
+#          reuse one pool of keep-alive connections
+def get_corenlp_client():
+    global _corenlp_client
+    with _corenlp_lock:
+        if _corenlp_client is None:
+            from corenlp_client import CoreNLPClient
+            _corenlp_client = CoreNLPClient(CORENLP_URL)
+        return _corenlp_client
+
+
 # Function: get_dependency_parse(input)
 # This function accepts a raw string input and returns a CoNLL-formatted output
 # string with each line indicating a word, its POS tag, the index of its head
@@ -286,18 +693,64 @@ def tokens_per_sentence(user_input):
 # Returns:
 # output - A string containing one row per word, with each row containing the
 #          word, its POS tag, the index of its head word, and its relation to
-#          the head word.
+#          the head word, or None if the CoreNLP server is unavailable.
 def get_dependency_parse(input: str):
-    # Initialize the CoreNLPDependencyParser with the server URL
-    parser = CoreNLPDependencyParser(url='http://localhost:9000')
+    key = text_key(normalize_text(input))
+    output = PARSE_CACHE.get(key)
+    if output is not None:
+        return output
 
-    parse = parser.raw_parse(input)
+    from corenlp_client import CoreNLPUnavailable
+    try:
+        with metrics.span("corenlp_parse"):
+            output = get_corenlp_client().dependency_parse(input)
+    except CoreNLPUnavailable:
+        metrics.count("corenlp_errors")
+        return None  # Not cached, so the parse is retried next time
+    PARSE_CACHE.put(key, output)
+    return output
 
-    dep_graph = next(parse)
 
-    output = dep_graph.to_conll(4)
+# Function: load_caches(cache_dir)
+# cache_dir: A directory written by save_caches (nothing is loaded if it does not exist)
+#
+# This function fills PARSE_CACHE and STYLISTIC_CACHE from an earlier run.
+def load_caches(cache_dir):
+    for cache, filename in ((PARSE_CACHE, PARSE_CACHE_FILE), (STYLISTIC_CACHE, STYLISTIC_CACHE_FILE)):
+        filepath = os.path.join(cache_dir, filename)
+        if os.path.exists(filepath):
+            cache.load(filepath)
+
+
+# Function: save_caches(cache_dir)
+# cache_dir: The directory to write PARSE_CACHE and STYLISTIC_CACHE to
+def save_caches(cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    PARSE_CACHE.save(os.path.join(cache_dir, PARSE_CACHE_FILE))
+    STYLISTIC_CACHE.save(os.path.join(cache_dir, STYLISTIC_CACHE_FILE))
+
+
+# Function: start_metrics(filepath, interval=10.0, writer=None)
+# filepath: Where the metrics are written: a Prometheus text file if it ends in
+#           ".prom", and otherwise a JSON log with one snapshot per line
+# interval: Seconds between exports
+# writer: OPTIONAL; The TranscriptWriter to report on (defaults to the one opened
+#         by open_transcript)
+# Returns: The MetricsExporter (call stop() to write the final snapshot)
+#
+# Turns on the timing spans and counters of the hot path, and exports them with
+# the parse and stylistic caches' statistics and the transcript's counts.
+def start_metrics(filepath, interval=10.0, writer=None):
+    def transcript_stats():
+        current = writer or transcript
+        return ({"written": current.written, "dropped": current.dropped, "failed": current.failed}
+                if current is not None else {})
 
-    return output
+    metrics.register_gauges("parse_cache", PARSE_CACHE.stats)
+    metrics.register_gauges("stylistic_cache", STYLISTIC_CACHE.stats)
+    metrics.register_gauges("sentiment_cache", lambda: SENTIMENT_CACHE.stats() if SENTIMENT_CACHE is not None else {})
+    metrics.register_gauges("transcript", transcript_stats)
+    return metrics.MetricsExporter([metrics.make_sink(filepath)], interval)
 
 
 # Function: get_dep_categories(parsed_input)
@@ -391,6 +844,367 @@ def custom_feature_2(user_input):
 
 
 
+# Precomputed once for analyze_style(): a table that deletes punctuation (so the
+# number of punctuation characters is the drop in length), the sentence splitter
+# used by custom_feature_1, and a regex sentence splitter for the "regex" tokenizer.
+_PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+_SENTENCE_END_RE = re.compile(r'[.!?]')
+_REGEX_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+
+
+# Class: StylisticFeatures
+# The stylistic metrics reported by the chatbot for one input.  dep_counts holds
+# the five counts from get_dep_categories, or None if they were not computed (or
+# the dependency parser was unavailable).
+class StylisticFeatures(NamedTuple):
+    ttr: float                          # compute_ttr
+    tokens_per_sentence: float          # tokens_per_sentence
+    dep_counts: Optional[tuple]         # get_dep_categories
+    avg_sentence_length: float          # custom_feature_1
+    punctuation_density: float          # custom_feature_2
+
+
+# Function: analyze_style(user_input, mode=None)
+# user_input: A string of arbitrary length
+# mode: OPTIONAL; "nltk" or "regex" (defaults to the global TOKENIZER setting)
+# Returns: A StylisticFeatures with every metric except dep_counts
+#
+# This function computes the same values as compute_ttr, tokens_per_sentence,
+# custom_feature_1 and custom_feature_2, but segments and tokenizes the input only
+# once: word_tokenize itself splits the input into sentences before tokenizing
+# them, so the per-sentence tokens give both the type-token ratio and the tokens
+# per sentence.  (tokens_per_sentence tokenizes each sentence with word_tokenize,
+# which splits it into sentences again; on the rare sentence that splits twice,
+# e.g. "...argument.).", the token count can differ by one.)  The "regex" mode
+# approximates sentence splitting and tokenization with precompiled regular
+# expressions, like get_tokens.
+def analyze_style(user_input, mode=None):
+    if (mode or TOKENIZER) == "regex":
+        sentences = [sentence for sentence in _REGEX_SENTENCE_RE.split(user_input.strip()) if sentence]
+        sentence_tokens = [regex_tokenize(sentence) for sentence in sentences]
+    else:
+        load_tokenizer()
+        from nltk.tokenize import sent_tokenize, word_tokenize
+        sentences = sent_tokenize(user_input)
+        sentence_tokens = [word_tokenize(sentence, preserve_line=True) for sentence in sentences]
+
+    num_tokens = sum(len(tokens) for tokens in sentence_tokens)
+    ttr = len(set(chain.from_iterable(sentence_tokens))) / num_tokens if num_tokens > 0 else 0
+    tps = num_tokens / len(sentences) if len(sentences) > 0 else 0
+
+    word_counts = [len(sentence.split()) for sentence in _SENTENCE_END_RE.split(user_input)]
+    word_counts = [count for count in word_counts if count > 0]
+    avg_sentence_length = sum(word_counts) / len(word_counts) if len(word_counts) > 0 else 0
+
+    num_punctuation = len(user_input) - len(user_input.translate(_PUNCTUATION_TABLE))
+    punctuation_density = num_punctuation / len(user_input) if len(user_input) > 0 else 0
+
+    return StylisticFeatures(ttr, tps, None, avg_sentence_length, punctuation_density)
+
+
+#-----------------------------------DIALOGUE-------------------------------------------------------
+# The dialogue logic is written as pure transition handlers: they take a
+# ChatSession and the user's input, update the session, and return the chatbot's
+# replies without doing any I/O.  The *_state() functions below wrap them with
+# input()/print() for the terminal chatbot, and server.py drives the same handlers
+# for many concurrent sessions.
+
+WELCOME_MESSAGE = "Welcome to my chatbot!  "
+NAME_PROMPT = "What is your name?"
+SENTIMENT_PROMPT = "Thanks {0}!  What do you want to talk about today?"
+STYLISTIC_PROMPT = "I'd also like to do a quick stylistic analysis. What's on your mind today?"
+NEXT_ACTION_PROMPT = ("What would you like to do next?  You can quit, redo the "
+                      "sentiment analysis, or redo the stylistic analysis.")
+RETRY_PROMPT = ("Sorry, I didn't understand that.  Would you like "
+                "to quit, redo the sentiment analysis, or redo the stylistic analysis?")
+GOODBYE_MESSAGE = "Chatbot session has ended. Goodbye!"
+
+# States whose transitions need analyze_turn() to run first.  This is the
+# CPU-heavy (or, for stylistic analysis, parser-bound) part of a turn.
+ANALYSIS_STATES = ("sentiment_analysis", "stylistic_analysis")
+
+
+# Class: ChatSession
+# Holds the dialogue state of one user's conversation: the current state, the
+# user's name, and how many times sentiment analysis has run.
+class ChatSession:
+    def __init__(self, session_id=None):
+        self.session_id = session_id
+        self.state = "welcome_state"
+        self.name = ""
+        self.sentiment_analysis_run = 0
+
+
+# Users often redo the sentiment analysis with the same text, and many inputs are
+# stock phrases ("hi", "I'm fine"), so sentiment results are cached as well: the
+# input's features (the averaged embedding; None for TFIDF), predicted label,
+# and score (decision_function, if the model has one), keyed by the input with
+# whitespace normalized and by the model, tokenizer and (for Word2Vec models)
+# embeddings that produced them, since the compact, pruned and pickled
+# embeddings give different vectors.
+# Entries expire after SENTIMENT_CACHE_TTL seconds.  configure_sentiment_cache()
+# can disable the cache, or back it with an SQLite file that every process on the
+# host shares.
+SENTIMENT_CACHE_TTL = 3600
+SENTIMENT_CACHE = LRUCache(max_bytes=8 * 1024 * 1024, ttl=SENTIMENT_CACHE_TTL)
+_model_tags = {}
+_embedding_tags = {}
+_embedding_files = {}  # The file each Word2Vec dictionary was loaded from by load_w2v
+
+
+# Function: configure_sentiment_cache(ttl=SENTIMENT_CACHE_TTL, shared_path=None)
+# ttl: The seconds a cached result stays valid (0 disables the cache)
+# shared_path: OPTIONAL; An SQLite file to share results with other processes,
+#              behind a per-process LRUCache
+def configure_sentiment_cache(ttl=SENTIMENT_CACHE_TTL, shared_path=None):
+    global SENTIMENT_CACHE
+    if not ttl:
+        SENTIMENT_CACHE = None
+        return
+    SENTIMENT_CACHE = LRUCache(max_bytes=8 * 1024 * 1024, ttl=ttl)
+    if shared_path:
+        SENTIMENT_CACHE = TieredCache(SENTIMENT_CACHE, SQLiteCache(shared_path, ttl=ttl))
+
+
+# Function: model_tag(model, vectorizer)
+# Returns: A short hash of the pickled model and vectorizer, computed once per pair,
+#          so cached results from a different model are never used
+def model_tag(model, vectorizer):
+    entry = _model_tags.get((id(model), id(vectorizer)))
+    if entry is None or entry[0] is not model or entry[1] is not vectorizer:
+        digest = hashlib.blake2b(pkl.dumps((model, vectorizer), protocol=pkl.HIGHEST_PROTOCOL), digest_size=8)
+        entry = (model, vectorizer, digest.hexdigest())
+        _model_tags[(id(model), id(vectorizer))] = entry
+    return entry[2]
+
+
+# Function: embeddings_tag(word2vec)
+# word2vec: A Word2Vec dictionary or embedding store, or None
+# Returns: A short hash identifying the embeddings, computed once per object:
+#          of each store directory's (or w2v.pkl's) path and file_fingerprint,
+#          or of every vector for a dictionary that was not loaded by load_w2v
+def embeddings_tag(word2vec):
+    if word2vec is None:
+        return "none"
+    entry = _embedding_tags.get(id(word2vec))
+    if entry is None or entry[0] is not word2vec:
+        digest = hashlib.blake2b(digest_size=8)
+        if hasattr(word2vec, "fallback_path"):
+            paths = [word2vec.primary.path, word2vec.fallback_path]
+        elif hasattr(word2vec, "path"):
+            paths = [word2vec.path]
+        elif _embedding_files.get(id(word2vec), (None,))[0] is word2vec:
+            paths = [_embedding_files[id(word2vec)][1]]
+        else:
+            paths = []
+            for word, vector in word2vec.items():
+                digest.update(word.encode("utf-8"))
+                digest.update(np.asarray(vector, dtype=np.float32).tobytes())
+        for path in paths:
+            digest.update(os.path.abspath(path).encode("utf-8"))
+            digest.update(file_fingerprint(path).encode("ascii"))
+        entry = (word2vec, digest.hexdigest())
+        _embedding_tags[id(word2vec)] = entry
+    return entry[1]
+
+
+# Function: score_sentiment_batch(user_inputs, model, vectorizer=None, word2vec=None)
+# Returns: An (embedding, label, score) tuple for each input, as SENTIMENT_CACHE
+#          holds them (plain tuples, so that any script can load them)
+#
+# All inputs are featurized and predicted together, so the per-call overhead of
+# model.predict is paid once for the whole batch.
+def score_sentiment_batch(user_inputs, model, vectorizer=None, word2vec=None):
+    with metrics.span("featurize"):
+        if vectorizer is not None:
+            test = vectorizer.transform(user_inputs)  # Use if you selected a TFIDF model
+        else:
+            test = strings2vec(word2vec, user_inputs)  # Use if you selected a w2v model
+    from linear_scorer import predict_with_scores
+    with metrics.span("predict"):
+        labels, scores = predict_with_scores(model, test)
+    if scores is None:
+        scores = [None] * len(labels)
+    embeddings = test.astype(np.float32) if vectorizer is None else [None] * len(labels)
+    return list(zip(embeddings, labels, scores))
+
+
+# Function: predict_sentiment_batch(user_inputs, model, vectorizer=None, word2vec=None)
+# user_inputs: A list of strings
+# model: The trained classification model used for predicting sentiment
+# vectorizer: OPTIONAL; The trained vectorizer, if using TFIDF (leave empty otherwise)
+# word2vec: OPTIONAL; The pretrained Word2Vec model, if using Word2Vec (leave empty otherwise)
+# Returns: A numpy array with the predicted label for each input
+#
+# Inputs found in SENTIMENT_CACHE are not featurized or predicted again; the
+# rest (each distinct input once) are scored in one batch by score_sentiment_batch.
+def predict_sentiment_batch(user_inputs, model, vectorizer=None, word2vec=None):
+    cache = SENTIMENT_CACHE
+    if cache is None:
+        return np.array([label for embedding, label, score in
+                         score_sentiment_batch(user_inputs, model, vectorizer, word2vec)])
+
+    prefix = "{0}:{1}:{2}:".format(model_tag(model, vectorizer), TOKENIZER,
+                                   embeddings_tag(word2vec) if vectorizer is None else "none")
+    keys = [text_key(prefix + normalize_text(user_input)) for user_input in user_inputs]
+    results = [cache.get(key) for key in keys]
+    missing = {}
+    for i, result in enumerate(results):
+        if result is None:
+            missing.setdefault(keys[i], i)
+    if missing:
+        scored = score_sentiment_batch([user_inputs[i] for i in missing.values()], model, vectorizer, word2vec)
+        computed = dict(zip(missing, scored))
+        for key, result in computed.items():
+            cache.put(key, result)
+        results = [result if result is not None else computed[key] for key, result in zip(keys, results)]
+    return np.array([label for embedding, label, score in results])
+
+
+# Function: predict_sentiment(user_input, model, vectorizer=None, word2vec=None)
+# user_input: A string of arbitrary length
+# model: The trained classification model used for predicting sentiment
+# vectorizer: OPTIONAL; The trained vectorizer, if using TFIDF (leave empty otherwise)
+# word2vec: OPTIONAL; The pretrained Word2Vec model, if using Word2Vec (leave empty otherwise)
+# Returns: The predicted label
+def predict_sentiment(user_input, model, vectorizer=None, word2vec=None):
+    return predict_sentiment_batch([user_input], model, vectorizer, word2vec)[0]
+
+
+# Function: sentiment_response(label)
+# label: The label predicted by predict_sentiment
+# Returns: The chatbot's reply for that label
+def sentiment_response(label):
+    if label == 0:
+        return "Hmm, it seems like you're feeling a bit down."
+    elif label == 1:
+        return "It sounds like you're in a positive mood!"
+    else:
+        return "Hmm, that's weird.  My classifier predicted a value of: {0}".format(label)
+
+
+# Function: stylistic_features(user_input)
+# user_input: A string of arbitrary length
+# Returns: A StylisticFeatures (dep_counts is None if the parser is unavailable)
+#
+# Results are cached in STYLISTIC_CACHE, except when the dependency counts are
+# missing, so that they are filled in once the parser is back.
+def stylistic_features(user_input):
+    key = text_key(user_input)
+    features = STYLISTIC_CACHE.get(key)
+    if features is not None:
+        return StylisticFeatures(*features)
+
+    dep_parse = get_dependency_parse(user_input)
+    with metrics.span("style_analysis"):
+        features = analyze_style(user_input)._replace(
+            dep_counts=get_dep_categories(dep_parse) if dep_parse is not None else None)
+    if features.dep_counts is not None:
+        STYLISTIC_CACHE.put(key, tuple(features))  # A plain tuple, so saved caches load in any script
+    return features
+
+
+# Function: stylistic_report(user_input)
+# user_input: A string of arbitrary length
+# Returns: The chatbot's stylistic analysis of the input, as a multi-line string
+def stylistic_report(user_input):
+    features = stylistic_features(user_input)
+
+    if features.dep_counts is not None:
+        dependencies = ("# Nominal Subjects: {0}\n# Direct Objects: {1}\n# Indirect Objects: {2}"
+                        "\n# Nominal Modifiers: {3}\n# Adjectival Modifiers: {4}".format(*features.dep_counts))
+    else:
+        # The CoreNLP server is down or overloaded, so report everything else without waiting on it.
+        dependencies = "(Dependency counts are unavailable right now.)"
+
+    # Generate a stylistic analysis of the user's input
+    lines = ["Thanks!  Here's what I discovered about your writing style.",
+             "Type-Token Ratio: {0}".format(features.ttr),
+             "Average Tokens Per Sentence: {0}".format(features.tokens_per_sentence),
+             # "Dependencies:\n{0}".format(get_dependency_parse(user_input)), # Uncomment to view the full dependency parse.
+             dependencies,
+             "Custom Feature #1: {0}".format(features.avg_sentence_length),
+             "Custom Feature #2: {0}".format(features.punctuation_density)]
+    return "\n".join(lines)
+
+
+# Function: match_next_state(user_input)
+# user_input: A string of arbitrary length
+# Returns: "quit", "sentiment_analysis", or "stylistic_analysis", or None if the
+#          input does not ask for any of them
+#
+# The input is classified by intents.ROUTER, which also understands synonyms
+# ("exit", "my writing style") and misspellings ("sentimnet").
+def match_next_state(user_input):
+    return intents.ROUTER.classify(user_input)
+
+
+# Function: start_session(session)
+# session: A new ChatSession
+# Returns: A list of the chatbot's opening messages
+def start_session(session):
+    session.state = "get_user_info"
+    return [WELCOME_MESSAGE, NAME_PROMPT]
+
+
+# Function: analyze_turn(state, user_input, model, vectorizer=None, word2vec=None)
+# state: The session's current state
+# user_input: The user's response in that state
+# Returns: The predicted label in the sentiment_analysis state, the stylistic
+#          report in the stylistic_analysis state, and None otherwise
+#
+# This is the expensive part of a turn.  It reads nothing from the session, so it
+# can safely run in a worker thread while the session waits.
+def analyze_turn(state, user_input, model, vectorizer=None, word2vec=None):
+    if state == "sentiment_analysis":
+        return predict_sentiment(user_input, model, vectorizer, word2vec)
+    elif state == "stylistic_analysis":
+        return stylistic_report(user_input)
+    return None
+
+
+# Function: transition(session, user_input, analysis=None)
+# session: A ChatSession
+# user_input: The user's response to the chatbot's last message
+# analysis: The result of analyze_turn() for this turn (for ANALYSIS_STATES)
+# Returns: A list of the chatbot's replies
+#
+# This function implements the dialogue management logic described for
+# run_chatbot() below, one user turn at a time.  It updates session.state, which
+# is "quit" once the conversation is over.
+def transition(session, user_input, analysis=None):
+    if session.state == "get_user_info":
+        session.name = extract_user_info(user_input)
+        session.state = "sentiment_analysis"
+        return [SENTIMENT_PROMPT.format(session.name)]
+
+    elif session.state == "sentiment_analysis":
+        session.sentiment_analysis_run += 1
+        # Decide the next state based on the number of times sentiment analysis has run
+        if session.sentiment_analysis_run == 1:
+            session.state = "stylistic_analysis"
+            return [sentiment_response(analysis), STYLISTIC_PROMPT]
+        session.state = "check_next_state"
+        return [sentiment_response(analysis), NEXT_ACTION_PROMPT]
+
+    elif session.state == "stylistic_analysis":
+        session.state = "check_next_state"
+        return [analysis, NEXT_ACTION_PROMPT]
+
+    elif session.state == "check_next_state":
+        next_state = match_next_state(user_input)
+        if next_state is None:
+            return [RETRY_PROMPT]
+        session.state = next_state
+        if next_state == "quit":
+            return [GOODBYE_MESSAGE]
+        elif next_state == "sentiment_analysis":
+            return [SENTIMENT_PROMPT.format(session.name)]
+        return [STYLISTIC_PROMPT]
+
+    raise ValueError("Unknown state encountered: {0}".format(session.state))
+
+
 # Function: welcome_state()
 # This function does not take any input
 # Returns: A string indicating the next state
@@ -399,8 +1213,8 @@ def custom_feature_2(user_input):
 # the welcome message!  In this state, the chatbot greets the user.
 def welcome_state():
     # Display a welcome message to the user
-    user_input = print("Welcome to my chatbot!  ")
-    f.write("CHATBOT:\nWelcome to my chatbot!  ")
+    print(WELCOME_MESSAGE)
+    log_message("chatbot", WELCOME_MESSAGE, "welcome_state")
 
     return "get_user_info"
 
@@ -415,9 +1229,9 @@ def welcome_state():
 def get_info_state():
     # Request the user's name, and accept a user response of
     # arbitrary length.  Feel free to customize this!
-    user_input = input("What is your name?\n")
-    f.write("What is your name?\n")
-    f.write("\nUSER:\n{0}\n".format(user_input))
+    user_input = input(NAME_PROMPT + "\n")
+    log_message("chatbot", NAME_PROMPT, "get_user_info")
+    log_message("user", user_input, "get_user_info")
 
     # Extract the user's name
     name = extract_user_info(user_input)
@@ -437,26 +1251,18 @@ def get_info_state():
 # to customize this!
 def sentiment_analysis_state(name, model, vectorizer=None, word2vec=None):
     # Check the user's sentiment
-    user_input = input("Thanks {0}!  What do you want to talk about today?\n".format(name))
-    f.write("\nCHATBOT:\nThanks {0}!  What do you want to talk about today?\n".format(name))
-    f.write("\nUSER:\n{0}\n".format(user_input))
+    prompt = SENTIMENT_PROMPT.format(name)
+    user_input = input(prompt + "\n")
+    start = time.perf_counter()
+    log_message("chatbot", prompt, "sentiment_analysis")
+    log_message("user", user_input, "sentiment_analysis")
 
     # Predict the user's sentiment
-    # test = vectorizer.transform([user_input])  # Use if you selected a TFIDF model
-    test = string2vec(word2vec, user_input)  # Use if you selected a w2v model
-
-    label = None
-    label = model.predict(test.reshape(1, -1))
+    label = predict_sentiment(user_input, model, vectorizer, word2vec)
 
-    if label == 0:
-        print("Hmm, it seems like you're feeling a bit down.")
-        f.write("\nCHATBOT:\nHmm, it seems like you're feeling a bit down.\n")
-    elif label == 1:
-        print("It sounds like you're in a positive mood!")
-        f.write("\nCHATBOT:\nIt sounds like you're in a positive mood!\n")
-    else:
-        print("Hmm, that's weird.  My classifier predicted a value of: {0}".format(label))
-        f.write("\nCHATBOT:\nHmm, that's weird.  My classifier predicted a value of: {0}\n".format(label))
+    response = sentiment_response(label)
+    print(response)
+    log_message("chatbot", response, "sentiment_analysis", time.perf_counter() - start)
 
     return "stylistic_analysis"
 
@@ -468,36 +1274,14 @@ def sentiment_analysis_state(name, model, vectorizer=None, word2vec=None):
 # This function implements a state that asks the user what's on their mind, and
 # then analyzes their response.  Feel free to customize this!
 def stylistic_analysis_state():
-    user_input = input("I'd also like to do a quick stylistic analysis. What's on your mind today?\n")
-    f.write("\nCHATBOT:\nI'd also like to do a quick stylistic analysis. What's on your mind today?\n")
-    f.write("\nUSER:\n{0}\n".format(user_input))
-    ttr = compute_ttr(user_input)
-    tps = tokens_per_sentence(user_input)
-    dep_parse = get_dependency_parse(user_input)
-    num_nsubj, num_obj, num_iobj, num_nmod, num_amod = get_dep_categories(dep_parse)
-    custom_1 = custom_feature_1(user_input)
-    custom_2 = custom_feature_2(user_input)
+    user_input = input(STYLISTIC_PROMPT + "\n")
+    start = time.perf_counter()
+    log_message("chatbot", STYLISTIC_PROMPT, "stylistic_analysis")
+    log_message("user", user_input, "stylistic_analysis")
 
-    # Generate a stylistic analysis of the user's input
-    print("Thanks!  Here's what I discovered about your writing style.")
-    print("Type-Token Ratio: {0}".format(ttr))
-    print("Average Tokens Per Sentence: {0}".format(tps))
-    # print("Dependencies:\n{0}".format(dep_parse)) # Uncomment to view the full dependency parse.
-    print("# Nominal Subjects: {0}\n# Direct Objects: {1}\n# Indirect Objects: {2}"
-          "\n# Nominal Modifiers: {3}\n# Adjectival Modifiers: {4}".format(num_nsubj, num_obj,
-                                                                           num_iobj, num_nmod, num_amod))
-    print("Custom Feature #1: {0}".format(custom_1))
-    print("Custom Feature #2: {0}".format(custom_2))
-
-    f.write("\nCHATBOT:\nThanks!  Here's what I discovered about your writing style.\n")
-    f.write("Type-Token Ratio: {0}\n".format(ttr))
-    f.write("Average Tokens Per Sentence: {0}\n".format(tps))
-    # f.write("Dependencies:\n{0}\n".format(dep_parse)) # Uncomment to view the full dependency parse.
-    f.write("# Nominal Subjects: {0}\n# Direct Objects: {1}\n# Indirect Objects: {2}"
-          "\n# Nominal Modifiers: {3}\n# Adjectival Modifiers: {4}\n".format(num_nsubj, num_obj,
-                                                                           num_iobj, num_nmod, num_amod))
-    f.write("Custom Feature #1: {0}\n".format(custom_1))
-    f.write("Custom Feature #2: {0}\n".format(custom_2))
+    report = stylistic_report(user_input)
+    print(report)
+    log_message("chatbot", report, "stylistic_analysis", time.perf_counter() - start)
 
     return "check_next_action"
 
@@ -510,35 +1294,16 @@ def stylistic_analysis_state():
 # to do next.  The user can indicate that they would like to quit, redo the sentiment
 # analysis, or redo the stylistic analysis.  Feel free to customize this!
 def check_next_state():
-    next_state = ""
-
-    user_input = input("What would you like to do next?  You can quit, redo the "
-                       "sentiment analysis, or redo the stylistic analysis.\n")
-    f.write("\nCHATBOT:\nWhat would you like to do next?  You can quit, redo the "
-                       "sentiment analysis, or redo the stylistic analysis.\n")
-    f.write("\nUSER:\n{0}\n".format(user_input))
-
-    match = False # Only becomes true once a match is found
-    while not match:
-        quit_match = re.search(r"\bquit\b", user_input) # This is *not* comprehensive ...feel free to update! -Natalie
-        sentiment_match = re.search(r"\bsentiment\b", user_input)
-        analysis_match = re.search(r"\bstyl", user_input)
-
-        if quit_match is not None:
-            next_state = "quit"
-            match = True
-        elif sentiment_match is not None:
-            next_state = "sentiment_analysis"
-            match = True
-        elif analysis_match is not None:
-            next_state = "stylistic_analysis"
-            match = True
-        else:
-            user_input = input("Sorry, I didn't understand that.  Would you like "
-                               "to quit, redo the sentiment analysis, or redo the stylistic analysis?\n")
-            f.write("\nCHATBOT:\nSorry, I didn't understand that.  Would you like "
-                               "to quit, redo the sentiment analysis, or redo the stylistic analysis?\n")
-            f.write("\nUSER:\n{0}\n".format(user_input))
+    user_input = input(NEXT_ACTION_PROMPT + "\n")
+    log_message("chatbot", NEXT_ACTION_PROMPT, "check_next_state")
+    log_message("user", user_input, "check_next_state")
+
+    next_state = match_next_state(user_input)
+    while next_state is None:
+        user_input = input(RETRY_PROMPT + "\n")
+        log_message("chatbot", RETRY_PROMPT, "check_next_state")
+        log_message("user", user_input, "check_next_state")
+        next_state = match_next_state(user_input)
 
     return next_state
 
@@ -612,7 +1377,8 @@ def run_chatbot(model, vectorizer=None, word2vec=None):
             print(f"Unknown state encountered: {state}")
             break
 
-    print("Chatbot session has ended. Goodbye!")
+    print(GOODBYE_MESSAGE)
+    log_message("chatbot", GOODBYE_MESSAGE, "quit")
 
     return
 
@@ -620,29 +1386,67 @@ def run_chatbot(model, vectorizer=None, word2vec=None):
 # This is your main() function.  Use this space to try out and debug your code
 # using your terminal.  The code you include in this space will not be graded.
 if __name__ == "__main__":
-    # Set things up ahead of time by training the TfidfVectorizer and Naive Bayes model
-    documents, labels = load_as_list("dataset.csv")
+    # "train" trains the model and saves it to MODEL_FILE; "serve" loads the saved
+    # model and runs the chatbot.  Without a command, the saved model is used if it
+    # is up to date, and otherwise the model is trained (and saved) first.
+    parser = argparse.ArgumentParser(description="Sentiment and stylistic analysis chatbot.")
+    parser.add_argument("command", nargs="?", choices=["train", "serve"])
+    parser.add_argument("--data", default="dataset.csv", help="the training data the model should come from")
+    parser.add_argument("--cache-dir", default=None, help="keep parse and stylistic caches here across runs")
+    parser.add_argument("--transcript", default=TRANSCRIPT_FILE, help="JSONL file (or directory) to log the chat to")
+    parser.add_argument("--per-session", action="store_true", help="log each session to its own file in --transcript")
+    parser.add_argument("--metrics", default=None, help="export hot-path timings and counters to this .prom or JSONL file")
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="seconds between metrics exports")
+    parser.add_argument("--profile-dir", default=None, help="let SIGUSR2 start/stop a sampling profiler writing here")
+    parser.add_argument("--sentiment-cache-ttl", type=float, default=SENTIMENT_CACHE_TTL,
+                        help="seconds a cached sentiment result stays valid (0 disables the cache)")
+    parser.add_argument("--shared-cache", default=None, help="share sentiment results through this SQLite file")
+    args = parser.parse_args()
+    configure_sentiment_cache(args.sentiment_cache_ttl, args.shared_cache)
+
+    embedding_path = default_embedding_path()
+    fingerprint = training_fingerprint(args.data, embedding_path)
+
+    model, vectorizer = None, None
+    if args.command != "train":
+        try:
+            model, vectorizer = load_artifacts(MODEL_FILE, fingerprint)
+        except (OSError, ValueError) as e:
+            if args.command == "serve":
+                sys.exit("Cannot serve: {0}".format(e))
 
     # Load the Word2Vec representations so that you can make use of it later
-    word2vec = load_w2v(EMBEDDING_FILE)  # Use if you selected a Word2Vec model
-
-    # Compute TFIDF representations so that you can make use of them later
-    # vectorizer, tfidf_train = vectorize_train(documents)  # Use if you selected a TFIDF model
-
-    # Instantiate and train the machine learning models
-    # To save time, only uncomment the lines corresponding to the sentiment
-    # analysis model you chose for your chatbot!
-
-    # nb_tfidf, logistic_tfidf, svm_tfidf, mlp_tfidf = instantiate_models() # Uncomment to instantiate a TFIDF model
-    nb_w2v, logistic_w2v, svm_w2v, mlp_w2v = instantiate_models()  # Uncomment to instantiate a w2v model
-    # nb_tfidf = train_model_tfidf(nb_tfidf, tfidf_train, labels)
-    # nb_w2v = train_model_w2v(nb_w2v, word2vec, documents, labels)
-    # logistic_tfidf = train_model_tfidf(logistic_tfidf, tfidf_train, labels)
-    # logistic_w2v = train_model_w2v(logistic_w2v, word2vec, documents, labels)
-    # svm_tfidf = train_model_tfidf(svm_tfidf, tfidf_train, labels)
-    svm_w2v = train_model_w2v(svm_w2v, word2vec, documents, labels)
-    # mlp_tfidf = train_model_tfidf(mlp_tfidf, tfidf_train, labels)
-    # mlp_w2v = train_model_w2v(mlp_w2v, word2vec, documents, labels)
+    # (only needed when the model uses Word2Vec features, i.e. there is no TFIDF vectorizer)
+    word2vec = load_w2v(embedding_path) if vectorizer is None and os.path.exists(embedding_path) else None  # Use if you selected a Word2Vec model
+
+    if model is None:
+        # Set things up ahead of time by training the TfidfVectorizer and Naive Bayes model
+        documents, labels = load_as_list(args.data)
+
+        # Compute TFIDF representations so that you can make use of them later
+        # vectorizer, tfidf_train = vectorize_train(documents)  # Use if you selected a TFIDF model
+
+        # Instantiate and train the machine learning models
+        # To save time, only uncomment the lines corresponding to the sentiment
+        # analysis model you chose for your chatbot!
+
+        # nb_tfidf, logistic_tfidf, svm_tfidf, mlp_tfidf = instantiate_models() # Uncomment to instantiate a TFIDF model
+        svm_w2v = instantiate_model("svm")  # Instantiate only the model you chose ("nb", "logistic", "svm" or "mlp")
+        # nb_tfidf = train_model_tfidf(nb_tfidf, tfidf_train, labels)
+        # nb_w2v = train_model_w2v(nb_w2v, word2vec, documents, labels)
+        # logistic_tfidf = train_model_tfidf(logistic_tfidf, tfidf_train, labels)
+        # logistic_w2v = train_model_w2v(logistic_w2v, word2vec, documents, labels)
+        # svm_tfidf = train_model_tfidf(svm_tfidf, tfidf_train, labels)
+        svm_w2v = train_model_w2v(svm_w2v, word2vec, documents, labels)
+        # mlp_tfidf = train_model_tfidf(mlp_tfidf, tfidf_train, labels)
+        # mlp_w2v = train_model_w2v(mlp_w2v, word2vec, documents, labels)
+
+        model = svm_w2v  # Update this (and vectorizer, if using TFIDF) to save a different model
+        save_artifacts(MODEL_FILE, model, vectorizer, fingerprint)
+        print("Saved the trained model to {0}.".format(MODEL_FILE))
+
+        if args.command == "train":
+            sys.exit(0)
 
     # ***** New in Project Part 3! *****
     # next_state = welcome_state() # Uncomment to check how this works
@@ -654,6 +1458,15 @@ if __name__ == "__main__":
     # run_chatbot(mlp, word2vec=word2vec) # Example for running the chatbot with
                                         # MLP (make sure to comment/uncomment
                                         # properties of other functions as needed)
-    run_chatbot(svm_w2v, word2vec=word2vec) # Example for running the chatbot with SVM and Word2Vec---make sure your earlier functions are copied over for this to work correctly!
-    f.close()
-    
+    if args.cache_dir:
+        load_caches(args.cache_dir)
+    open_transcript(args.transcript, args.per_session)
+    exporter = start_metrics(args.metrics, args.metrics_interval) if args.metrics else None
+    if args.profile_dir:
+        metrics.install_profiler_toggle(args.profile_dir)
+    run_chatbot(model, vectorizer=vectorizer, word2vec=word2vec) # Example for running the chatbot with SVM and Word2Vec---make sure your earlier functions are copied over for this to work correctly!
+    transcript.close()
+    if exporter is not None:
+        exporter.stop()
+    if args.cache_dir:
+        save_caches(args.cache_dir)
@@ -0,0 +1,214 @@
+# Trains and evaluates every model from chatbot.instantiate_models() on both
+# feature types (TFIDF and averaged Word2Vec) and prints a comparison table.
+#
+# Each feature matrix is computed once in the parent process and placed in shared
+# memory.  The eight (features, model) combinations are then fit and scored in
+# parallel across a process pool, with every worker reading the same copy of the
+# features instead of receiving its own pickled copy.
+#
+# Usage:
+#   python compare_models.py [--data dataset.csv] [--features tfidf w2v] [--workers N] [--output results.csv]
+# =========================================================================================================
+
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy import sparse
+from sklearn.model_selection import train_test_split
+
+import chatbot
+
+COLUMNS = ["features", "model", "precision", "recall", "f1", "accuracy",
+           "fit_seconds", "predict_ms_per_doc", "latency_ms"]
+
+# Number of single-document predictions timed to measure per-call latency.
+LATENCY_SAMPLES = 50
+
+# Feature matrices attached from shared memory in each worker process, keyed by
+# feature name, as (train matrix, test matrix) pairs.
+_features = {}
+_labels = {}
+_segments = []
+
+
+# Function: share_array(array, segments)
+# array: A numpy array
+# segments: A list that the new SharedMemory segment is appended to
+# Returns: A (name, shape, dtype) descriptor that attach_array can rebuild the array from
+def share_array(array, segments):
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+    segments.append(segment)
+    return segment.name, array.shape, array.dtype.str
+
+
+# Function: attach_array(descriptor, segments)
+# descriptor: A descriptor returned by share_array
+# segments: A list that the attached SharedMemory segment is appended to (it must
+#           stay referenced for as long as the array is in use)
+# Returns: A numpy array backed by the shared memory segment
+def attach_array(descriptor, segments):
+    name, shape, dtype = descriptor
+    segment = shared_memory.SharedMemory(name=name)
+    segments.append(segment)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+
+
+# Function: share_matrix(matrix, segments)
+# matrix: A dense numpy array or a scipy.sparse CSR matrix
+# segments: A list that new SharedMemory segments are appended to
+# Returns: A descriptor that attach_matrix can rebuild the matrix from
+def share_matrix(matrix, segments):
+    if sparse.issparse(matrix):
+        matrix = matrix.tocsr()
+        return ("csr", matrix.shape, share_array(matrix.data, segments),
+                share_array(matrix.indices, segments), share_array(matrix.indptr, segments))
+    return ("dense", share_array(np.ascontiguousarray(matrix), segments))
+
+
+# Function: attach_matrix(descriptor, segments)
+# descriptor: A descriptor returned by share_matrix
+# segments: A list that attached SharedMemory segments are appended to
+# Returns: The matrix, backed by shared memory
+def attach_matrix(descriptor, segments):
+    if descriptor[0] == "csr":
+        shape, data, indices, indptr = descriptor[1:]
+        return sparse.csr_matrix((attach_array(data, segments), attach_array(indices, segments),
+                                  attach_array(indptr, segments)), shape=shape, copy=False)
+    return attach_array(descriptor[1], segments)
+
+
+# Function: init_worker(descriptors, train_labels, test_labels, tokenizer)
+# Attaches the shared feature matrices in a worker process.
+def init_worker(descriptors, train_labels, test_labels, tokenizer):
+    chatbot.TOKENIZER = tokenizer
+    for name, (train_descriptor, test_descriptor) in descriptors.items():
+        _features[name] = (attach_matrix(train_descriptor, _segments),
+                           attach_matrix(test_descriptor, _segments))
+    _labels["train"] = train_labels
+    _labels["test"] = test_labels
+
+
+# Function: evaluate_combination(feature_name, model_index)
+# feature_name: "tfidf" or "w2v"
+# model_index: Which of the instantiate_models() models to train
+# Returns: A dictionary with one row of the comparison table
+#
+# This function runs in a worker process.  It trains the model on the shared
+# training features, then scores it and times its predictions on the test features.
+def evaluate_combination(feature_name, model_index):
+    X_train, X_test = _features[feature_name]
+    model = chatbot.instantiate_models()[model_index]
+
+    start = time.perf_counter()
+    if feature_name == "tfidf":
+        chatbot.train_model_tfidf(model, X_train, _labels["train"])
+    else:
+        model.fit(X_train, _labels["train"])
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predicted_labels = chatbot.predict_features(model, X_test)
+    predict_seconds = time.perf_counter() - start
+    precision, recall, f1, accuracy = chatbot.score_predictions(_labels["test"], predicted_labels)
+
+    latencies = []
+    for i in range(min(LATENCY_SAMPLES, X_test.shape[0])):
+        row = X_test[i:i + 1]
+        start = time.perf_counter()
+        chatbot.predict_features(model, row)
+        latencies.append(time.perf_counter() - start)
+
+    return {"features": feature_name, "model": type(model).__name__,
+            "precision": precision, "recall": recall, "f1": f1, "accuracy": accuracy,
+            "fit_seconds": fit_seconds,
+            "predict_ms_per_doc": 1000 * predict_seconds / max(X_test.shape[0], 1),
+            "latency_ms": 1000 * float(np.median(latencies)) if latencies else float("nan")}
+
+
+# Function: compute_features(train_documents, test_documents, feature_names, word2vec=None)
+# Returns: A dictionary mapping each feature name to a (train matrix, test matrix) pair
+def compute_features(train_documents, test_documents, feature_names, word2vec=None):
+    features = {}
+    if "tfidf" in feature_names:
+        vectorizer, tfidf_train = chatbot.vectorize_train(train_documents)
+        features["tfidf"] = (tfidf_train, vectorizer.transform(test_documents))
+    if "w2v" in feature_names:
+        features["w2v"] = (chatbot.strings2vec(word2vec, train_documents),
+                           chatbot.strings2vec(word2vec, test_documents))
+    return features
+
+
+# Function: compare_models(train_documents, train_labels, test_documents, test_labels,
+#                          feature_names=("tfidf", "w2v"), word2vec=None, workers=None)
+# word2vec: The pretrained Word2Vec model (required for "w2v" features)
+# workers: The number of worker processes (defaults to the number of CPUs)
+# Returns: A list of dictionaries, one per (features, model) combination, with the
+#          keys listed in COLUMNS
+def compare_models(train_documents, train_labels, test_documents, test_labels,
+                   feature_names=("tfidf", "w2v"), word2vec=None, workers=None):
+    features = compute_features(train_documents, test_documents, feature_names, word2vec)
+    num_models = len(chatbot.instantiate_models())
+
+    segments = []
+    try:
+        descriptors = {name: (share_matrix(X_train, segments), share_matrix(X_test, segments))
+                       for name, (X_train, X_test) in features.items()}
+        jobs = [(name, model_index) for name in features for model_index in range(num_models)]
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=init_worker,
+                                 initargs=(descriptors, np.asarray(train_labels), np.asarray(test_labels),
+                                           chatbot.TOKENIZER)) as pool:
+            futures = [pool.submit(evaluate_combination, name, model_index) for name, model_index in jobs]
+            return [future.result() for future in futures]
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+
+# Function: format_table(results)
+# results: The list returned by compare_models
+# Returns: The results formatted as a text table
+def format_table(results):
+    header = "{0:<10}{1:<22}{2:>10}{3:>10}{4:>10}{5:>10}{6:>10}{7:>16}{8:>14}".format(
+        "Features", "Model", "Precision", "Recall", "F1", "Accuracy", "Fit (s)", "Predict ms/doc", "Latency (ms)")
+    lines = [header, "-" * len(header)]
+    for row in results:
+        lines.append("{features:<10}{model:<22}{precision:>10.3f}{recall:>10.3f}{f1:>10.3f}{accuracy:>10.3f}"
+                     "{fit_seconds:>10.2f}{predict_ms_per_doc:>16.4f}{latency_ms:>14.3f}".format(**row))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare every model and feature type in parallel.")
+    parser.add_argument("--data", default="dataset.csv")
+    parser.add_argument("--features", nargs="+", choices=["tfidf", "w2v"], default=["tfidf", "w2v"])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--output", default=None, help="also write the table to this CSV file")
+    parser.add_argument("--tokenizer", choices=["nltk", "regex"], default=chatbot.TOKENIZER)
+    args = parser.parse_args()
+    chatbot.TOKENIZER = args.tokenizer
+
+    documents, labels = chatbot.load_as_list(args.data)
+    train_documents, test_documents, train_labels, test_labels = train_test_split(
+        documents, labels, test_size=args.test_size, random_state=100, stratify=labels)
+
+    word2vec = None
+    if "w2v" in args.features:
+        word2vec = chatbot.load_w2v(chatbot.default_embedding_path())
+
+    results = compare_models(train_documents, train_labels, test_documents, test_labels,
+                             feature_names=args.features, word2vec=word2vec, workers=args.workers)
+    print(format_table(results))
+
+    if args.output:
+        with open(args.output, "w", newline="") as fout:
+            writer = csv.DictWriter(fout, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(results)
@@ -0,0 +1,167 @@
+# A long-lived client for the Stanford CoreNLP server's dependency parser.
+#
+# nltk's CoreNLPDependencyParser opens a new HTTP session per parser, and has no
+# limit on concurrent requests, so building one per stylistic analysis pays for a
+# new connection every turn and hangs (for up to a minute) when the server is down.
+# CoreNLPClient instead keeps one pool of keep-alive connections for the whole
+# process, caps the number of requests in flight, and applies a timeout, a small
+# number of retries and a circuit breaker: after several consecutive failures it
+# stops calling the server for a while and fails immediately instead.
+#
+# fake_corenlp.py serves the same API locally for offline testing and benchmarks.
+# =========================================================================================================
+
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_URL = "http://localhost:9000"
+
+# The annotators needed for a dependency parse, as nltk's CoreNLPDependencyParser
+# requests them.  With ssplit.eolonly, sentences are only split at line breaks, so
+# a one-line input with several sentences is parsed as one.
+DEPPARSE_PROPERTIES = {"annotators": "tokenize,pos,lemma,ssplit,depparse", "outputFormat": "json",
+                       "tokenize.whitespace": "false", "ssplit.eolonly": "true"}
+
+
+# Class: CoreNLPUnavailable
+# Raised when the server cannot be reached, times out, returns an error or a
+# response that is not a valid annotation, or the circuit breaker is open.
+class CoreNLPUnavailable(Exception):
+    pass
+
+
+# Class: CoreNLPClient
+# url: The CoreNLP server's URL
+# max_connections: The most requests in flight at once (and the size of the connection pool)
+# timeout: Seconds to wait for a connection, a free request slot, or a response
+# retries: How many times a failed request is retried
+# failure_threshold: Consecutive failures that open the circuit breaker
+# reset_after: Seconds the breaker stays open before a single trial request is let through
+#
+# One client is safe to share between threads.
+class CoreNLPClient:
+    def __init__(self, url=DEFAULT_URL, max_connections=8, timeout=5.0, retries=1, failure_threshold=3,
+                 reset_after=30.0):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.slots = threading.BoundedSemaphore(max_connections)
+
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    # allow_request(): Returns whether the circuit breaker lets a request through.
+    # Once reset_after has passed, one trial request is allowed ("half-open"); its
+    # result closes or re-opens the breaker.
+    def allow_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_after and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    # record_result(success): Updates the circuit breaker after a request (success
+    # is None when the request never reached the server).
+    def record_result(self, success):
+        with self.lock:
+            self.trial_in_flight = False
+            if success is None:
+                return
+            if success:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+    # annotate(text, properties, parse=None): POSTs text to the server and returns
+    # its JSON response (passed through parse, if given), or raises
+    # CoreNLPUnavailable.  A response that is not JSON, or that parse rejects with
+    # a ValueError, KeyError, IndexError, TypeError or AttributeError, counts as a
+    # failed request, like an HTTP 5xx.
+    def annotate(self, text, properties, parse=None):
+        if not self.allow_request():
+            raise CoreNLPUnavailable("circuit breaker is open after {0} failures".format(self.failures))
+        if not self.slots.acquire(timeout=self.timeout):
+            self.record_result(None)  # The server is busy, not down
+            raise CoreNLPUnavailable("no free connection after {0}s".format(self.timeout))
+
+        try:
+            error = None
+            for attempt in range(self.retries + 1):
+                if attempt > 0:
+                    time.sleep(0.05 * 2 ** attempt)
+                try:
+                    response = self.session.post(self.url, params={"properties": json.dumps(properties)},
+                                                 data=text.encode("utf-8"),
+                                                 headers={"Content-Type": "text/plain; charset=utf-8"},
+                                                 timeout=self.timeout)
+                except requests.RequestException as e:
+                    error = e
+                    continue
+                if response.status_code >= 500:
+                    error = "HTTP {0}".format(response.status_code)
+                    continue
+                if response.status_code >= 400:
+                    self.record_result(True)
+                    raise CoreNLPUnavailable("HTTP {0}: {1}".format(response.status_code, response.text[:200]))
+                try:
+                    result = response.json()
+                    if parse is not None:
+                        result = parse(result)
+                except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+                    error = "invalid response ({0!r}): {1}".format(e, response.text[:200])
+                    continue
+                self.record_result(True)
+                return result
+        finally:
+            self.slots.release()
+
+        self.record_result(False)
+        raise CoreNLPUnavailable("{0} failed: {1}".format(self.url, error))
+
+    # dependency_parse(text): Returns the dependency parse of the first line of
+    # text in the same 4-column CoNLL format as nltk's DependencyGraph.to_conll(4)
+    # (word, POS tag, head index, relation), or raises CoreNLPUnavailable.
+    def dependency_parse(self, text):
+        return self.annotate(text, DEPPARSE_PROPERTIES, conll_rows)
+
+    def close(self):
+        self.session.close()
+
+
+# Function: conll_rows(result)
+# result: The server's JSON response to a depparse request
+# Returns: The dependency parse of the first sentence as 4-column CoNLL rows
+#          ("" if there are no sentences)
+#
+# Raises a KeyError, IndexError, TypeError or AttributeError if the response is
+# not shaped like a depparse annotation.
+def conll_rows(result):
+    if not result.get("sentences"):
+        return ""
+    sentence = result["sentences"][0]
+    rows = []
+    for dependency in sorted(sentence["basicDependencies"], key=lambda d: d["dependent"]):
+        if dependency["dependent"] < 1:
+            raise IndexError("dependent {0} is not a token index".format(dependency["dependent"]))
+        token = sentence["tokens"][dependency["dependent"] - 1]
+        rows.append("{0}\t{1}\t{2}\t{3}\n".format(token["word"], token["pos"], dependency["governor"],
+                                                  dependency["dep"]))
+    return "".join(rows)
@@ -0,0 +1,446 @@
+# Provides a memory-mapped, array-backed store for the pretrained Word2Vec
+# representations, as a drop-in replacement for the pickled w2v.pkl dictionary.
+#
+# Unpickling w2v.pkl rebuilds millions of small numpy arrays on every startup, and
+# every process pays for its own private copy.  This module converts the pickle
+# once into a directory containing a contiguous float32 matrix (vectors.npy), a
+# vocabulary index (vocab.txt, one word per line, in row order) and a small
+# metadata file.  Loading the store memory-maps the matrix, so startup only has to
+# read the vocabulary, and every process on a host shares the same page-cache
+# copy of the vectors.
+#
+# The matrix can also be stored in compact form, to fit more workers per host:
+#   float16: half precision (2x smaller)
+#   int8:    each row scaled into [-127, 127], with one float32 scale per row in
+#            scales.npy (~4x smaller)
+# Lookups return float32 vectors whatever the storage format, so every store can be
+# used the same way.  --evaluate reports how the compact formats affect the
+# classifiers' test_model_w2v metrics.
+#
+# Convert once with:
+#   python embedding_store.py w2v.pkl w2v_store [--kind float32|float16|int8] [--evaluate dataset.csv]
+# (the source may also be an existing store directory)
+# =========================================================================================================
+
+import argparse
+import json
+import os
+import pickle as pkl
+import threading
+
+import numpy as np
+
+VECTORS_FILE = "vectors.npy"
+SCALES_FILE = "scales.npy"
+VOCAB_FILE = "vocab.txt"
+META_FILE = "meta.json"
+
+# The storage formats, and the dtype of the stored matrix for each.
+KINDS = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+
+# Function: iter_source_vectors(source)
+# source: The unpickled contents of w2v.pkl
+# Returns: The vocabulary size, the vector dimensionality, and an iterator of
+#          (word, vector) pairs
+#
+# This helper accepts either the dictionary format that chatbot.load_w2v expects,
+# or a gensim KeyedVectors object (see the README), and exposes both the same way.
+def iter_source_vectors(source):
+    if hasattr(source, "index_to_key") and hasattr(source, "vectors"):
+        vectors = source.vectors
+        return len(source.index_to_key), vectors.shape[1], zip(source.index_to_key, vectors)
+
+    if isinstance(source, EmbeddingStore):
+        return len(source), source.dim, ((word, source.vector(row)) for word, row in source.vocab.items())
+
+    if not source:
+        raise ValueError("The source embeddings are empty.")
+    dim = len(next(iter(source.values())))
+    return len(source), dim, iter(source.items())
+
+
+# Function: quantize_int8(vector)
+# vector: A 1-D array of floats
+# Returns: The vector as int8 values in [-127, 127], and the scale that maps them
+#          back (vector ~= values * scale)
+def quantize_int8(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    scale = float(np.abs(vector).max()) / 127 if len(vector) else 0.0
+    if scale == 0.0:
+        return np.zeros(len(vector), dtype=np.int8), 1.0
+    return np.clip(np.rint(vector / scale), -127, 127).astype(np.int8), scale
+
+
+# Function: load_source(source_path)
+# source_path: Path of a pickled Word2Vec dictionary (e.g., w2v.pkl), or of a store directory
+# Returns: The unpickled embeddings, or the EmbeddingStore (without any fallback)
+def load_source(source_path):
+    if os.path.isdir(source_path):
+        return open_store(source_path, fallback=False)
+    with open(source_path, 'rb') as fin:
+        return pkl.load(fin)
+
+
+# Function: convert_w2v(source_path, store_path, kind="float32")
+# source_path: Path of the pickled Word2Vec dictionary (e.g., w2v.pkl), or of an
+#              existing store directory
+# store_path: Path of the directory to write the store to
+# kind: The storage format: "float32", "float16", or "int8"
+# Returns: The number of words written
+#
+# This function performs the one-time conversion from w2v.pkl to the
+# memory-mappable store format.
+def convert_w2v(source_path, store_path, kind="float32"):
+    num_words, dim, pairs = iter_source_vectors(load_source(source_path))
+    return write_store(pairs, num_words, dim, store_path, kind,
+                       {"source": os.path.basename(os.path.normpath(source_path))})
+
+
+# Function: write_store(pairs, num_words, dim, store_path, kind="float32", meta=None)
+# pairs: An iterable of (word, vector) pairs, in the order the rows should be stored
+# num_words: The number of pairs
+# dim: The vector dimensionality
+# store_path: Path of the directory to write the store to
+# kind: The storage format: "float32", "float16", or "int8"
+# meta: OPTIONAL; Extra entries for meta.json
+# Returns: The number of words written
+#
+# Rows are written straight into a memory-mapped output file, so writing a store
+# never holds a second copy of the matrix in RAM.
+def write_store(pairs, num_words, dim, store_path, kind="float32", meta=None):
+    if kind not in KINDS:
+        raise ValueError("Unknown store kind: {0}".format(kind))
+
+    os.makedirs(store_path, exist_ok=True)
+    vectors = np.lib.format.open_memmap(os.path.join(store_path, VECTORS_FILE), mode="w+",
+                                        dtype=KINDS[kind], shape=(num_words, dim))
+    scales = None
+    if kind == "int8":
+        scales = np.lib.format.open_memmap(os.path.join(store_path, SCALES_FILE), mode="w+",
+                                           dtype=np.float32, shape=(num_words,))
+    # vocab.txt is split on "\n" only, so that words containing "\r" or other line
+    # separators keep their own rows.
+    with open(os.path.join(store_path, VOCAB_FILE), "w", encoding="utf-8", newline="\n") as f_vocab:
+        for row, (word, vector) in enumerate(pairs):
+            if "\n" in word:
+                raise ValueError("Cannot store a word containing a newline: {0!r}".format(word))
+            if scales is not None:
+                vectors[row], scales[row] = quantize_int8(vector)
+            else:
+                vectors[row] = vector
+            f_vocab.write(word + "\n")
+    vectors.flush()
+    del vectors
+    if scales is not None:
+        scales.flush()
+        del scales
+
+    meta = dict({"kind": kind, "num_words": num_words, "dim": dim}, **(meta or {}))
+    with open(os.path.join(store_path, META_FILE), "w") as f_meta:
+        json.dump(meta, f_meta, indent=2)
+
+    return num_words
+
+
+# Function: read_vocab(store_path)
+# store_path: Path of a store directory
+# Returns: A dictionary mapping each word to its row in the vectors matrix
+def read_vocab(store_path):
+    with open(os.path.join(store_path, VOCAB_FILE), "r", encoding="utf-8", newline="\n") as fin:
+        words = fin.read().split("\n")
+    if words and words[-1] == "":
+        words.pop()
+    return {word: row for row, word in enumerate(words)}
+
+
+# Class: EmbeddingStore
+# A read-only, memory-mapped collection of word vectors.  It supports the subset of
+# the dictionary interface that chatbot.w2v and chatbot.string2vec rely on
+# ("token in store" and "store[token]"), so it can be passed anywhere the w2v.pkl
+# dictionary is used.
+#
+# This class reads float32 stores; the subclasses below read the compact formats.
+# Subclasses override vector() and take(), which every other lookup goes through.
+class EmbeddingStore:
+    def __init__(self, store_path):
+        self.path = store_path
+        with open(os.path.join(store_path, META_FILE), "r") as fin:
+            self.meta = json.load(fin)
+        self.vectors = np.load(os.path.join(store_path, VECTORS_FILE), mmap_mode="r")
+        self.vocab = read_vocab(store_path)
+        self.dim = self.vectors.shape[1]
+        self.oov_index = None
+        if self.meta.get("oov_index"):
+            from oov_index import OOVIndex
+            self.oov_index = OOVIndex(store_path, self.meta["oov_index"])
+
+    def __contains__(self, token):
+        return token in self.vocab
+
+    def __getitem__(self, token):
+        return self.vector(self.vocab[token])
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def get(self, token, default=None):
+        row = self.vocab.get(token)
+        if row is None:
+            return default
+        return self.vector(row)
+
+    # nbytes: The size of the stored vectors (and scales and OOV tables), in bytes
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes + (self.oov_index.nbytes if self.oov_index is not None else 0)
+
+    # vector(row): Returns the float32 vector stored in a row.
+    def vector(self, row):
+        return self.vectors[row]
+
+    # lookup(tokens): Returns the row of each token as an int64 array, with -1 for
+    # tokens that are not in the vocabulary.
+    def lookup(self, tokens):
+        vocab = self.vocab
+        return np.fromiter((vocab.get(token, -1) for token in tokens), dtype=np.int64, count=len(tokens))
+
+    # take(ids): Gathers the rows for an array of ids in one fancy-indexing
+    # operation.  Rows for out-of-vocabulary ids (-1) are zero, matching chatbot.w2v.
+    def take(self, ids):
+        rows = self.vectors[np.maximum(ids, 0)]
+        rows[ids < 0] = 0
+        return rows
+
+    # fill_oov(tokens, missing, rows): Fills in the rows (at the indices in missing)
+    # of tokens that are not in the vocabulary, using the store's OOV index (see
+    # oov_index.py).  Tokens it cannot resolve keep their zero rows.
+    def fill_oov(self, tokens, missing, rows):
+        if self.oov_index is None or not len(missing):
+            return
+        normalized_ids = self.oov_index.normalized_rows([tokens[i] for i in missing], self.vocab)
+        resolved = normalized_ids >= 0
+        rows[missing[resolved]] = self.take(normalized_ids[resolved])
+        if self.oov_index.use_ngrams and not resolved.all():
+            unresolved = missing[~resolved]
+            rows[unresolved] = self.oov_index.ngram_vectors([tokens[i] for i in unresolved])[0]
+
+    # embed(tokens): Returns an (n_tokens, dim) array with one embedding per token.
+    def embed(self, tokens):
+        ids = self.lookup(tokens)
+        rows = self.take(ids)
+        self.fill_oov(tokens, np.flatnonzero(ids < 0), rows)
+        return rows
+
+
+# Class: Float16EmbeddingStore
+# An EmbeddingStore whose matrix is stored in half precision.
+class Float16EmbeddingStore(EmbeddingStore):
+    def vector(self, row):
+        return self.vectors[row].astype(np.float32)
+
+    def take(self, ids):
+        rows = self.vectors[np.maximum(ids, 0)].astype(np.float32)
+        rows[ids < 0] = 0
+        return rows
+
+
+# Class: Int8EmbeddingStore
+# An EmbeddingStore whose rows are stored as int8 values, each multiplied back by
+# its row's scale (from scales.npy) when looked up.
+class Int8EmbeddingStore(EmbeddingStore):
+    def __init__(self, store_path):
+        super().__init__(store_path)
+        self.scales = np.load(os.path.join(store_path, SCALES_FILE), mmap_mode="r")
+
+    @property
+    def nbytes(self):
+        return super().nbytes + self.scales.nbytes
+
+    def vector(self, row):
+        return self.vectors[row].astype(np.float32) * self.scales[row]
+
+    def take(self, ids):
+        safe_ids = np.maximum(ids, 0)
+        rows = self.vectors[safe_ids].astype(np.float32)
+        rows *= self.scales[safe_ids][:, None]
+        rows[ids < 0] = 0
+        return rows
+
+
+STORE_CLASSES = {"float32": EmbeddingStore, "float16": Float16EmbeddingStore, "int8": Int8EmbeddingStore}
+
+
+# Class: FallbackEmbeddingStore
+# primary: A (pruned) EmbeddingStore that is searched first
+# fallback_path: Path of the full store directory, searched for words missing from primary
+#
+# Supports the same lookups as EmbeddingStore.  The full store is only opened on
+# the first word that the primary store is missing, so a process whose traffic
+# stays within the pruned vocabulary never loads the full vocabulary.
+# fallback_hits counts the words found only in the full store.
+class FallbackEmbeddingStore:
+    def __init__(self, primary, fallback_path):
+        self.primary = primary
+        self.fallback_path = fallback_path
+        self.fallback = None
+        self.fallback_hits = 0
+        self.lock = threading.Lock()
+        self.dim = primary.dim
+
+    # full_store(): Returns the full store, opening it on first use.
+    def full_store(self):
+        if self.fallback is None:
+            with self.lock:
+                if self.fallback is None:
+                    self.fallback = open_store(self.fallback_path, fallback=False)
+        return self.fallback
+
+    def __contains__(self, token):
+        return token in self.primary or token in self.full_store()
+
+    def __getitem__(self, token):
+        vector = self.get(token)
+        if vector is None:
+            raise KeyError(token)
+        return vector
+
+    def __len__(self):
+        return len(self.primary)
+
+    def get(self, token, default=None):
+        vector = self.primary.get(token)
+        if vector is None:
+            vector = self.full_store().get(token)
+            if vector is None:
+                return default
+            self.fallback_hits += 1
+        return vector
+
+    @property
+    def nbytes(self):
+        return self.primary.nbytes + (self.fallback.nbytes if self.fallback is not None else 0)
+
+    # embed(tokens): Returns an (n_tokens, dim) array with one embedding per token,
+    # gathering the primary store's rows at once, then the misses from the full
+    # store, then the rest from the full store's OOV index (or the primary's, if
+    # only the primary has one).
+    def embed(self, tokens):
+        ids = self.primary.lookup(tokens)
+        rows = self.primary.take(ids)
+        missing = np.flatnonzero(ids < 0)
+        if len(missing):
+            fallback_ids = self.full_store().lookup([tokens[i] for i in missing])
+            rows[missing] = self.fallback.take(fallback_ids)
+            self.fallback_hits += int(np.count_nonzero(fallback_ids >= 0))
+            # Words in neither store are resolved as the full store resolves them, so
+            # they get the same vectors as without pruning.
+            oov_store = self.fallback if self.fallback.oov_index is not None else self.primary
+            oov_store.fill_oov(tokens, missing[fallback_ids < 0], rows)
+        return rows
+
+
+# Function: open_store(store_path, fallback=True)
+# store_path: Path of a store directory written by convert_w2v
+# fallback: False to ignore the full store that a pruned store falls back to
+# Returns: An EmbeddingStore (of the subclass matching the store's kind), or a
+#          FallbackEmbeddingStore if the store was pruned with a fallback
+#          (see prune_embeddings.py)
+def open_store(store_path, fallback=True):
+    with open(os.path.join(store_path, META_FILE), "r") as fin:
+        meta = json.load(fin)
+    kind = meta.get("kind", "float32")
+    if kind not in STORE_CLASSES:
+        raise ValueError("{0} has an unknown kind of store: {1}".format(store_path, kind))
+    store = STORE_CLASSES[kind](store_path)
+    if fallback and meta.get("fallback"):
+        # The fallback is recorded relative to the directory containing the store.
+        fallback_path = os.path.join(os.path.dirname(os.path.abspath(store_path)), meta["fallback"])
+        return FallbackEmbeddingStore(store, fallback_path)
+    return store
+
+
+# Function: embeddings_nbytes(word2vec)
+# word2vec: A Word2Vec dictionary or an EmbeddingStore
+# Returns: The memory taken by its vectors, in bytes
+def embeddings_nbytes(word2vec):
+    if isinstance(word2vec, (EmbeddingStore, FallbackEmbeddingStore)):
+        return word2vec.nbytes
+    return sum(np.asarray(vector).nbytes for vector in word2vec.values())
+
+
+# Function: accuracy_report(embeddings, data_file, test_size=0.2)
+# embeddings: A list of (name, Word2Vec dictionary or EmbeddingStore) pairs; the
+#             first is the reference the others are compared with
+# data_file: The labeled CSV file to train and test on (e.g., dataset.csv)
+# test_size: The fraction of data_file held out for testing
+# Returns: A list of dictionaries, one per (embeddings, model) pair, with the
+#          test_model_w2v metrics, the memory the vectors take, and the change in
+#          accuracy and F1 from the reference
+#
+# Every model is trained and tested on the same split for every set of embeddings,
+# so the differences come from the storage format alone.
+def accuracy_report(embeddings, data_file, test_size=0.2):
+    import chatbot
+    from sklearn.model_selection import train_test_split
+
+    documents, labels = chatbot.load_as_list(data_file)
+    train_documents, test_documents, train_labels, test_labels = train_test_split(
+        documents, labels, test_size=test_size, random_state=100, stratify=labels)
+
+    rows = []
+    reference = {}
+    for name, word2vec in embeddings:
+        X_train = chatbot.strings2vec(word2vec, train_documents)
+        for model_name in chatbot.MODEL_NAMES:
+            model = chatbot.instantiate_model(model_name)
+            model.fit(X_train, train_labels)
+            precision, recall, f1, accuracy = chatbot.test_model_w2v(model, word2vec, test_documents, test_labels)
+            reference.setdefault(model_name, (accuracy, f1))
+            rows.append({"embeddings": name, "model": type(model).__name__,
+                         "mbytes": embeddings_nbytes(word2vec) / 2**20,
+                         "precision": precision, "recall": recall, "f1": f1, "accuracy": accuracy,
+                         "accuracy_change": accuracy - reference[model_name][0],
+                         "f1_change": f1 - reference[model_name][1]})
+    return rows
+
+
+# Function: format_report(rows)
+# rows: The list returned by accuracy_report
+# Returns: The rows formatted as a text table
+def format_report(rows):
+    header = "{0:<22}{1:<22}{2:>10}{3:>10}{4:>10}{5:>10}{6:>10}{7:>14}{8:>10}".format(
+        "Embeddings", "Model", "MB", "Precision", "Recall", "F1", "Accuracy", "Accuracy +/-", "F1 +/-")
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        lines.append("{embeddings:<22}{model:<22}{mbytes:>10.1f}{precision:>10.3f}{recall:>10.3f}{f1:>10.3f}"
+                     "{accuracy:>10.3f}{accuracy_change:>+14.3f}{f1_change:>+10.3f}".format(**row))
+    return "\n".join(lines)
+
+
+# This is your main() function.  It converts w2v.pkl to the store format:
+#   python embedding_store.py [w2v.pkl] [w2v_store] [--kind float32|float16|int8] [--evaluate dataset.csv]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert Word2Vec embeddings to a memory-mapped store.")
+    parser.add_argument("source", nargs="?", default="w2v.pkl", help="w2v.pkl, or an existing store directory")
+    parser.add_argument("store", nargs="?", default="w2v_store")
+    parser.add_argument("--kind", choices=list(KINDS), default="float32", help="how the vectors are stored")
+    parser.add_argument("--evaluate", metavar="DATA", default=None,
+                        help="compare the classifiers' accuracy with the source and new embeddings on this CSV file")
+    parser.add_argument("--tokenizer", choices=["nltk", "regex"], default=None,
+                        help="the tokenizer used by --evaluate")
+    args = parser.parse_args()
+
+    num_words = convert_w2v(args.source, args.store, args.kind)
+    store = open_store(args.store)
+    print("Wrote {0} {1} vectors from {2} to {3}/ ({4:.1f} MB)".format(
+        num_words, args.kind, args.source, args.store, store.nbytes / 2**20))
+
+    if args.evaluate:
+        import chatbot
+        if args.tokenizer:
+            chatbot.TOKENIZER = args.tokenizer
+        source = chatbot.load_w2v(args.source)
+        print(format_report(accuracy_report([(os.path.basename(os.path.normpath(args.source)), source),
+                                             (os.path.basename(os.path.normpath(args.store)), store)],
+                                            args.evaluate)))
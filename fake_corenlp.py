@@ -0,0 +1,136 @@
+# A local stand-in for the Stanford CoreNLP server, for testing and benchmarking
+# the dependency-parse client without Java or the CoreNLP models.
+#
+# It answers the same POST request as the real server with the same JSON layout
+# (sentences, tokens, basicDependencies), but the "parse" is a cheap heuristic:
+# the first word of each sentence is the root, everything else depends on it, and
+# only pronouns get a real relation (nsubj or obj).  As on the real server, the
+# "ssplit.eolonly" property splits sentences at line breaks only.  Latency and
+# failures can be injected to see how the chatbot behaves when the parser is slow
+# or down.
+#
+# Usage:
+#   python fake_corenlp.py [--port 9000] [--latency-ms 0] [--failure-rate 0]
+# =========================================================================================================
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SUBJECT_PRONOUNS = {"i", "you", "he", "she", "it", "we", "they"}
+OBJECT_PRONOUNS = {"me", "him", "her", "us", "them"}
+
+_SENTENCE_RE = re.compile(r"[^.!?]+[.!?]*")
+_LINE_RE = re.compile(r"[^\r\n]+")
+_TOKEN_RE = re.compile(r"\w+(?:'\w+)?|[^\w\s]")
+
+
+# Function: fake_annotation(text, eolonly=False)
+# text: The request body
+# eolonly: True to split sentences at line breaks only (the "ssplit.eolonly" property)
+# Returns: A dictionary shaped like CoreNLP's JSON output for the depparse annotators
+def fake_annotation(text, eolonly=False):
+    sentences = []
+    splitter = _LINE_RE if eolonly else _SENTENCE_RE
+    for index, match in enumerate(splitter.finditer(text)):
+        words = _TOKEN_RE.findall(match.group())
+        if not words:
+            continue
+        tokens = []
+        dependencies = []
+        for i, word in enumerate(words, start=1):
+            lower = word.lower()
+            if not word[0].isalnum():
+                pos, dep = ".", "punct"
+            elif lower in SUBJECT_PRONOUNS:
+                pos, dep = "PRP", "nsubj"
+            elif lower in OBJECT_PRONOUNS:
+                pos, dep = "PRP", "obj"
+            else:
+                pos, dep = "NN", "dep"
+            tokens.append({"index": i, "word": word, "originalText": word, "lemma": lower, "pos": pos})
+            if i == 1:
+                dependencies.append({"dep": "ROOT", "governor": 0, "governorGloss": "ROOT",
+                                     "dependent": 1, "dependentGloss": word})
+            else:
+                dependencies.append({"dep": dep, "governor": 1, "governorGloss": words[0],
+                                     "dependent": i, "dependentGloss": word})
+        sentences.append({"index": index, "tokens": tokens, "basicDependencies": dependencies})
+    return {"sentences": sentences}
+
+
+# Class: FakeCoreNLPHandler
+# Handles one request; the server's latency and failure_rate attributes control
+# the injected delay (in seconds) and the fraction of requests answered with HTTP 500.
+class FakeCoreNLPHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real server
+    # Send headers and body in one write with Nagle off, or delayed ACKs add ~40 ms per request.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        text = self.rfile.read(length).decode("utf-8", errors="replace")
+        properties = json.loads(parse_qs(urlparse(self.path).query).get("properties", ["{}"])[0])
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if random.random() < self.server.failure_rate:
+            self.respond(500, b"Injected failure")
+            return
+        if properties.get("outputFormat", "json") != "json":
+            self.respond(400, b"Only outputFormat=json is supported")
+            return
+        eolonly = str(properties.get("ssplit.eolonly", "false")).lower() == "true"
+        self.respond(200, json.dumps(fake_annotation(text, eolonly)).encode("utf-8"), "application/json")
+
+    def respond(self, status, body, content_type="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Function: make_fake_server(host, port, latency_ms=0, failure_rate=0)
+# port: The port to listen on (0 picks a free one)
+# Returns: A ThreadingHTTPServer serving the fake parser (not yet started)
+def make_fake_server(host, port, latency_ms=0, failure_rate=0):
+    server = ThreadingHTTPServer((host, port), FakeCoreNLPHandler)
+    server.daemon_threads = True
+    server.latency = latency_ms / 1000
+    server.failure_rate = failure_rate
+    return server
+
+
+# Function: start_fake_server(host="127.0.0.1", port=0, latency_ms=0, failure_rate=0)
+# Returns: The fake server, running in a background thread, and its URL.  Call
+#          server.shutdown() to stop it.
+def start_fake_server(host="127.0.0.1", port=0, latency_ms=0, failure_rate=0):
+    server = make_fake_server(host, port, latency_ms, failure_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://{0}:{1}".format(*server.server_address[:2])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake CoreNLP dependency parser.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=0, help="delay added to every request")
+    parser.add_argument("--failure-rate", type=float, default=0, help="fraction of requests that return HTTP 500")
+    args = parser.parse_args()
+
+    server = make_fake_server(args.host, args.port, args.latency_ms, args.failure_rate)
+    print("Fake CoreNLP server on http://{0}:{1}".format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
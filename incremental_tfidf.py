@@ -0,0 +1,228 @@
+# TF-IDF features that can absorb new labeled documents without refitting on the
+# whole corpus.
+#
+# chatbot.vectorize_train refits TfidfVectorizer from scratch, so adding a day's
+# newly labeled chat utterances means re-tokenizing every training document.
+# IncrementalTfidf instead keeps the document frequency of each term and the term
+# counts of the documents it has seen.  partial_fit only tokenizes the new
+# documents; the IDF weights are then recomputed from the counts in O(vocabulary),
+# and training_matrix() rebuilds the TF-IDF matrix of the whole corpus from the
+# stored counts.  The weighting matches TfidfVectorizer's defaults (smoothed IDF,
+# raw term counts, L2-normalized rows), so for the same documents the features
+# are the same up to the order of the columns.
+#
+# HashingTfidf maps terms to a fixed number of columns with the hashing trick (as
+# stream_train.py does), so the vocabulary, and with it the model's input size,
+# never grows.
+#
+# Both can be saved with chatbot.save_artifacts in place of the TfidfVectorizer,
+# since they provide the same transform().
+#
+# Usage (the state, with all counts and labels so far, is kept in --state):
+#   python incremental_tfidf.py new_labels.csv [--state tfidf_state.pkl] [--hashing] [--n-features 1048576]
+#                               [--model svm|logistic|mlp] [--output model.pkl] [--tokenizer nltk|regex]
+# =========================================================================================================
+
+import argparse
+import os
+import pickle as pkl
+import time
+import zlib
+
+import numpy as np
+from scipy import sparse
+
+import chatbot
+
+STATE_FILE = "tfidf_state.pkl"
+
+
+# Class: IncrementalTfidf
+# tokenizer: OPTIONAL; The tokenizer applied to each lowercased document
+#            (chatbot.get_tokens if not given)
+# keep_counts: False to keep only the document frequencies, not the term counts
+#              that training_matrix() needs
+class IncrementalTfidf:
+    def __init__(self, tokenizer=None, keep_counts=True):
+        self.tokenizer = tokenizer
+        self.keep_counts = keep_counts
+        self.vocabulary_ = {}
+        self.df = np.zeros(0, dtype=np.int64)
+        self.n_docs = 0
+        self.blocks = []
+        self._idf = None
+
+    # n_features: The number of columns of the feature matrices
+    @property
+    def n_features(self):
+        return len(self.vocabulary_)
+
+    def tokenize(self, document):
+        return (self.tokenizer or chatbot.get_tokens)(document.lower())
+
+    # columns(tokens, grow): Returns the column of each token, adding new tokens to
+    # the vocabulary if grow is True and leaving them out otherwise.
+    def columns(self, tokens, grow):
+        vocabulary = self.vocabulary_
+        if grow:
+            return [vocabulary.setdefault(token, len(vocabulary)) for token in tokens]
+        return [vocabulary[token] for token in tokens if token in vocabulary]
+
+    # count_matrix(documents, grow=False): Returns the documents' term counts as a
+    # CSR matrix with n_features columns.
+    def count_matrix(self, documents, grow=False):
+        indices = []
+        indptr = [0]
+        for document in documents:
+            indices.extend(self.columns(self.tokenize(document), grow))
+            indptr.append(len(indices))
+        counts = sparse.csr_matrix((np.ones(len(indices), dtype=np.int64), indices, indptr),
+                                   shape=(len(documents), self.n_features))
+        counts.sum_duplicates()
+        return counts
+
+    # partial_fit(documents): Adds a batch of documents to the document
+    # frequencies (and stored counts), tokenizing only these documents.
+    def partial_fit(self, documents):
+        counts = self.count_matrix(documents, grow=True)
+        df = np.zeros(self.n_features, dtype=np.int64)
+        df[:len(self.df)] = self.df
+        self.df = df + np.bincount(counts.indices, minlength=self.n_features)
+        self.n_docs += counts.shape[0]
+        if self.keep_counts:
+            self.blocks.append(counts)
+        self._idf = None
+        return self
+
+    # idf_: The IDF weight of each column, ln((1 + n_docs) / (1 + df)) + 1, as in
+    # TfidfVectorizer(smooth_idf=True).  Recomputed only after partial_fit.
+    @property
+    def idf_(self):
+        if self._idf is None:
+            self._idf = np.log((1 + self.n_docs) / (1 + self.df)) + 1
+        return self._idf
+
+    # weight(counts): Returns the TF-IDF matrix for a count matrix, with L2-normalized rows.
+    def weight(self, counts):
+        counts = sparse.csr_matrix((counts.data, counts.indices, counts.indptr),
+                                   shape=(counts.shape[0], self.n_features))
+        tfidf = counts.multiply(self.idf_[None, :]).tocsr()
+        norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sparse.diags(1 / norms) @ tfidf
+
+    def transform(self, documents):
+        return self.weight(self.count_matrix(documents))
+
+    def fit_transform(self, documents):
+        self.partial_fit(documents)
+        return self.weight(self.blocks[-1] if self.keep_counts else self.count_matrix(documents))
+
+    # training_matrix(): Returns the TF-IDF matrix of every document seen so far,
+    # in the order they were added, from the stored counts.
+    def training_matrix(self):
+        if not self.blocks:
+            return sparse.csr_matrix((0, self.n_features))
+        blocks = [sparse.csr_matrix((block.data, block.indices, block.indptr),
+                                    shape=(block.shape[0], self.n_features)) for block in self.blocks]
+        return self.weight(sparse.vstack(blocks, format="csr"))
+
+    # without_counts(): Returns a copy that shares the vocabulary and IDF weights but
+    # not the stored counts, small enough to save with the model for serving.
+    def without_counts(self):
+        copy = object.__new__(type(self))
+        copy.__dict__.update(self.__dict__, blocks=[], keep_counts=False)
+        copy._idf = self.idf_
+        return copy
+
+
+# Class: HashingTfidf
+# n_features: The fixed number of columns that terms are hashed into
+#
+# The same as IncrementalTfidf, except that each term's column is given by its
+# crc32 hash, so there is no vocabulary to grow or store.  Colliding terms share
+# a column.
+class HashingTfidf(IncrementalTfidf):
+    def __init__(self, n_features=2 ** 20, tokenizer=None, keep_counts=True):
+        super().__init__(tokenizer, keep_counts)
+        self.hash_features = n_features
+        self.df = np.zeros(n_features, dtype=np.int64)
+
+    @property
+    def n_features(self):
+        return self.hash_features
+
+    def columns(self, tokens, grow):
+        return [zlib.crc32(token.encode("utf-8")) % self.hash_features for token in tokens]
+
+
+# Function: load_state(filepath, hashing=False, n_features=2 ** 20)
+# Returns: The featurizer and the list of labels saved by save_state, or new ones
+#          if filepath does not exist
+#
+# Raises a ValueError if the saved counts were tokenized with a different
+# chatbot.TOKENIZER than the current one.
+def load_state(filepath, hashing=False, n_features=2 ** 20):
+    if not os.path.exists(filepath):
+        return (HashingTfidf(n_features) if hashing else IncrementalTfidf()), []
+    with open(filepath, 'rb') as fin:
+        state = pkl.load(fin)
+    if isinstance(state["featurizer"], HashingTfidf) != hashing:
+        raise ValueError("{0} holds {1} features; remove it to switch.".format(
+            filepath, "hashed" if not hashing else "vocabulary"))
+    if state.get("tokenizer", chatbot.TOKENIZER) != chatbot.TOKENIZER:
+        raise ValueError("{0} was tokenized with the {1} tokenizer; use --tokenizer {1}, or remove it to "
+                         "switch.".format(filepath, state["tokenizer"]))
+    return state["featurizer"], state["labels"]
+
+
+# Function: save_state(filepath, featurizer, labels)
+# Writes the featurizer (with its stored counts), the labels, and the current
+# chatbot.TOKENIZER atomically.
+def save_state(filepath, featurizer, labels):
+    with open(filepath + ".tmp", 'wb') as fout:
+        pkl.dump({"featurizer": featurizer, "labels": labels, "tokenizer": chatbot.TOKENIZER}, fout,
+                 protocol=pkl.HIGHEST_PROTOCOL)
+    os.replace(filepath + ".tmp", filepath)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add labeled documents to the TF-IDF features and retrain.")
+    parser.add_argument("data", help="a CSV file of new labeled documents (same format as dataset.csv)")
+    parser.add_argument("--state", default=STATE_FILE, help="where the counts and labels so far are kept")
+    parser.add_argument("--hashing", action="store_true", help="hash terms into a fixed number of columns")
+    parser.add_argument("--n-features", type=int, default=2 ** 20, help="columns for hashed features")
+    parser.add_argument("--model", choices=["svm", "logistic", "mlp"], default="svm")
+    parser.add_argument("--output", default=chatbot.MODEL_FILE)
+    parser.add_argument("--tokenizer", choices=["nltk", "regex"], default=chatbot.TOKENIZER)
+    args = parser.parse_args()
+    chatbot.TOKENIZER = args.tokenizer
+
+    # Create the featurizer through the module, so that the saved model refers to
+    # incremental_tfidf.IncrementalTfidf rather than to this script's __main__.
+    import incremental_tfidf
+    try:
+        featurizer, labels = incremental_tfidf.load_state(args.state, args.hashing, args.n_features)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    documents, new_labels = chatbot.load_as_list(args.data)
+
+    start = time.perf_counter()
+    featurizer.partial_fit(documents)
+    labels.extend(new_labels)
+    tokenized = time.perf_counter()
+    X_train = featurizer.training_matrix()
+    weighted = time.perf_counter()
+    model = chatbot.instantiate_model(args.model)
+    model.fit(X_train, labels)
+    trained = time.perf_counter()
+    print("Added {0:,} documents ({1:,} in total, {2:,} features): tokenizing {3:.2f}s, "
+          "weighting {4:.2f}s, training {5:.2f}s.".format(len(documents), featurizer.n_docs, featurizer.n_features,
+                                                          tokenized - start, weighted - tokenized, trained - weighted))
+
+    incremental_tfidf.save_state(args.state, featurizer, labels)
+    # The model comes from every batch added so far rather than one data file, so
+    # no training-data fingerprint is recorded.  The tokenizer is, so that
+    # chatbot.load_artifacts featurizes inputs at serve time the way they were here.
+    chatbot.save_artifacts(args.output, model, featurizer.without_counts(), {}, args.tokenizer)
+    print("Saved the trained model to {0}.".format(args.output))
@@ -0,0 +1,193 @@
+# Recognizes what the user wants to do next (quit, sentiment analysis, or
+# stylistic analysis) from the reply to the chatbot's "What would you like to do
+# next?" prompt.
+#
+# Every phrase the chatbot understands, including synonyms ("exit", "feelings",
+# "writing style") and common misspellings of "quit", is compiled once into a
+# single regular expression, one alternation with a named group per intent, so a
+# turn is classified in one scan of the input.  When nothing matches, each word is
+# looked up in an edit-distance index of the intents' names: every spelling of
+# "sentiment", "stylistic", etc. with up to one or two characters deleted is
+# mapped to the name it comes from, so a misspelled word ("sentimnet", "stlyistic")
+# is matched with a few dictionary lookups (the symmetric delete method) rather
+# than by comparing it with every name.
+#
+# Where several intents match, an explicit quit ("quit", "exit", "bye") wins, then
+# the intents' own names, then their synonyms, e.g. "stylistic analysis of my
+# feelings" asks for stylistic analysis.  Generic words that can also end a
+# session ("done", "stop", "see you") are only used when nothing else matches,
+# even a misspelling, so "redo the sentiment analysis, then I'm done" asks for
+# sentiment analysis while "I'm done" quits.
+# "python benchmark.py intents" compares the router with the original keyword
+# search.
+# =========================================================================================================
+
+import re
+
+# The phrases of each intent, from the highest to the lowest priority.  An intent
+# can appear more than once, so that its synonyms rank below other intents' names.
+# A phrase ending in "*" matches any word that starts with it.
+INTENT_PHRASES = (
+    ("quit", ("quit", "quitting", "exit", "bye", "goodbye", "good bye", "log off", "log out", "qit", "qut")),
+    ("sentiment_analysis", ("sentiment*", "sentiment analysis")),
+    ("stylistic_analysis", ("styl*",)),
+    ("sentiment_analysis", ("feeling", "feelings", "emotion*", "mood", "opinion*", "attitude", "positive",
+                            "negative", "positivity", "negativity")),
+    ("stylistic_analysis", ("writing", "grammar", "syntax", "vocabulary", "punctuation", "how i write",
+                            "type-token", "type token", "sentence length")),
+)
+
+# Phrases that ask for an intent only when the reply asks for nothing else, in the
+# same format as INTENT_PHRASES.
+FALLBACK_PHRASES = (
+    ("quit", ("stop", "end", "done", "finished", "leave", "that's all", "that is all", "nothing else", "no more",
+              "see you", "see ya")),
+)
+
+# The words that misspellings are matched against, and how many edits each may
+# be away.  Words shorter than four letters are never corrected, and short names
+# are allowed only one edit ("style" is left out, since it is one edit from "stale").
+FUZZY_WORDS = {"quit": 1, "sentiment": 2, "sentiments": 2, "stylistic": 2, "stylistics": 2, "emotion": 1,
+               "emotions": 1, "feelings": 1, "goodbye": 1}
+
+# Real words close to a fuzzy word, which are never taken for a misspelling of it.
+NOT_MISSPELLINGS = {"quite", "quiet", "suit", "quid", "quip", "quiz", "quilt", "quint", "emotive"}
+
+_WORD_RE = re.compile(r"[a-z]+(?:['-][a-z]+)*")
+
+
+# Function: phrase_pattern(phrase)
+# Returns: A regular expression matching the phrase as whole words, with any
+#          whitespace between its words
+def phrase_pattern(phrase):
+    if phrase.endswith("*"):
+        return re.escape(phrase[:-1]) + r"\w*"
+    return r"\s+".join(re.escape(word) for word in phrase.split())
+
+
+# Function: compile_phrases(intent_phrases)
+# intent_phrases: The phrases of each intent, in priority order (see INTENT_PHRASES)
+# Returns: A regular expression with one named group (g0, g1, ...) per entry of
+#          intent_phrases, and a dictionary mapping each group's name to its intent
+def compile_phrases(intent_phrases):
+    group_intents = {}
+    alternatives = []
+    for group, (intent, phrases) in enumerate(intent_phrases):
+        name = "g{0}".format(group)
+        group_intents[name] = intent
+        alternatives.append("(?P<{0}>{1})".format(name, "|".join(phrase_pattern(phrase) for phrase in phrases)))
+    return re.compile(r"\b(?:{0})\b".format("|".join(alternatives))), group_intents
+
+
+# Function: deletes(word, max_distance)
+# Returns: The set of strings made by deleting up to max_distance characters from word
+def deletes(word, max_distance):
+    variants = {word}
+    level = {word}
+    for distance in range(max_distance):
+        level = {variant[:i] + variant[i + 1:] for variant in level if len(variant) > 1
+                 for i in range(len(variant))}
+        variants |= level
+    return variants
+
+
+# Function: edit_distance(a, b)
+# Returns: The number of insertions, deletions, substitutions, and transpositions
+#          of adjacent characters needed to turn a into b
+def edit_distance(a, b):
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+# Class: IntentRouter
+# intent_phrases: The phrases of each intent, in priority order (see INTENT_PHRASES)
+# fuzzy_words: The words misspellings are matched against, with the most edits
+#              allowed for each (see FUZZY_WORDS)
+# not_misspellings: Words that are never corrected (see NOT_MISSPELLINGS)
+# fallback_phrases: Phrases tried only when nothing else matches (see FALLBACK_PHRASES)
+#
+# Everything is built once, in the constructor; classify() only scans the input.
+class IntentRouter:
+    def __init__(self, intent_phrases=INTENT_PHRASES, fuzzy_words=FUZZY_WORDS, not_misspellings=NOT_MISSPELLINGS,
+                 fallback_phrases=FALLBACK_PHRASES):
+        self.pattern, self.group_intents = compile_phrases(intent_phrases)
+        self.fallback_pattern, self.fallback_intents = compile_phrases(fallback_phrases)
+
+        # The intent of each fuzzy word is the one whose phrases match it exactly.
+        self.fuzzy_words = {}
+        self.fuzzy_index = {}
+        for word, max_distance in fuzzy_words.items():
+            match = self.pattern.fullmatch(word)
+            if match is None:
+                raise ValueError("{0!r} is not one of the intents' phrases.".format(word))
+            self.fuzzy_words[word] = (self.group_intents[match.lastgroup], max_distance)
+            for variant in deletes(word, max_distance):
+                self.fuzzy_index.setdefault(variant, set()).add(word)
+        self.not_misspellings = frozenset(not_misspellings)
+
+        # The most edits worth trying for a word of each length: a word can only be
+        # within d edits of a fuzzy word whose length differs by at most d.
+        self.length_distances = {}
+        for word, (intent, max_distance) in self.fuzzy_words.items():
+            for length in range(max(len(word) - max_distance, 4), len(word) + max_distance + 1):
+                self.length_distances[length] = max(self.length_distances.get(length, 0), max_distance)
+
+    # match_phrase(text, fallback=False): Returns the intent of the
+    # highest-priority phrase in the lowercased text (of the fallback phrases, if
+    # fallback is True), or None.
+    def match_phrase(self, text, fallback=False):
+        pattern, group_intents = ((self.fallback_pattern, self.fallback_intents) if fallback
+                                  else (self.pattern, self.group_intents))
+        best = None
+        for match in pattern.finditer(text):
+            group = match.lastgroup
+            if best is None or int(group[1:]) < int(best[1:]):
+                best = group
+                if best == "g0":
+                    break
+        return group_intents[best] if best is not None else None
+
+    # match_word(word): Returns the intent of the closest fuzzy word within its
+    # allowed number of edits of word (ties go to the earlier fuzzy word), or None.
+    def match_word(self, word):
+        max_distance = self.length_distances.get(len(word))
+        if max_distance is None or word in self.not_misspellings:
+            return None
+        candidates = set()
+        for variant in deletes(word, max_distance):
+            candidates.update(self.fuzzy_index.get(variant, ()))
+        best = None
+        for candidate in (fuzzy for fuzzy in self.fuzzy_words if fuzzy in candidates):
+            intent, max_distance = self.fuzzy_words[candidate]
+            distance = edit_distance(word, candidate)
+            if distance <= max_distance and (best is None or distance < best[0]):
+                best = (distance, intent)
+                if distance <= 1:
+                    break  # Nothing else can be closer
+        return best[1] if best is not None else None
+
+    # classify(user_input): Returns "quit", "sentiment_analysis", or
+    # "stylistic_analysis", or None if the input does not ask for any of them.
+    def classify(self, user_input):
+        text = user_input.lower()
+        intent = self.match_phrase(text)
+        if intent is not None:
+            return intent
+        for word in _WORD_RE.findall(text):
+            intent = self.match_word(word)
+            if intent is not None:
+                return intent
+        return self.match_phrase(text, fallback=True)
+
+
+# The router chatbot.match_next_state uses.
+ROUTER = IntentRouter()
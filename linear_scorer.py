@@ -0,0 +1,214 @@
+# Exports a trained scikit-learn model to a minimal NumPy scorer for serving.
+#
+# Serving the Word2Vec SVM only takes a dot product between each averaged
+# embedding and the model's weight vector, but model.predict also validates its
+# input and dispatches through several layers of scikit-learn on every call,
+# which costs more than the arithmetic for the one or few rows a turn predicts.
+# The scorers here keep only the trained weights as NumPy arrays:
+#   - LinearScorer, for LinearSVC, LogisticRegression, and other linear
+#     classifiers (anything with coef_ and intercept_): one matrix product.
+#   - MLPScorer, for MLPClassifier: one matrix product and activation per layer.
+# Both predict the same labels as the model for a batch of rows (dense or
+# sparse), and importing or unpickling them does not import scikit-learn.
+# GaussianNB is not supported.
+#
+# The exported artifacts keep the model's vectorizer and training fingerprint, so
+# they load with chatbot.load_artifacts like the original.  Before writing them,
+# the export checks that the scorer and the model predict the same labels on
+# --data and stops if they do not.  (A TF-IDF model still needs scikit-learn for
+# its TfidfVectorizer; Word2Vec models and incremental_tfidf.py features do not.)
+#
+# Usage (then serve with "python server.py --model scorer.pkl"):
+#   python linear_scorer.py [model.pkl] [--output scorer.pkl] [--data dataset.csv] [--tokenizer nltk|regex]
+# "python benchmark.py scorer" compares the per-call latency of the two.
+# =========================================================================================================
+
+import argparse
+import pickle as pkl
+import time
+
+import numpy as np
+
+SCORER_FILE = "scorer.pkl"
+
+
+# Function: predict_labels(scores, classes)
+# scores: One score per row (two classes), or one row of scores per class
+# Returns: The label of each row: classes[1] where the score is above 0, for two
+#          classes, and the class with the highest score otherwise
+def predict_labels(scores, classes):
+    if scores.ndim == 1:
+        return classes[(scores > 0).astype(np.intp)]
+    return classes[scores.argmax(axis=1)]
+
+
+# Class: LinearScorer
+# coef: The weights, of shape (n_classes, n_features), or (1, n_features) for two classes
+# intercept: The bias of each row of coef
+# classes: The class labels, in the model's order
+class LinearScorer:
+    def __init__(self, coef, intercept, classes):
+        self.coef = np.ascontiguousarray(coef, dtype=np.float64)
+        self.intercept = np.asarray(intercept, dtype=np.float64)
+        self.classes = np.asarray(classes)
+
+    # decision_function(X): Returns X @ coef.T + intercept, raveled to one score
+    # per row for two classes (as the scikit-learn models return it).
+    def decision_function(self, X):
+        scores = X @ self.coef.T + self.intercept
+        return scores.ravel() if scores.shape[1] == 1 else scores
+
+    # predict(X): Returns the predicted label of each row of X (a 2-D array or
+    # sparse matrix).
+    def predict(self, X):
+        return predict_labels(self.decision_function(X), self.classes)
+
+
+# The hidden-layer activations MLPClassifier supports, applied in place.
+def _relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+def _tanh(x):
+    return np.tanh(x, out=x)
+
+
+def _logistic(x):
+    np.negative(x, out=x)
+    np.exp(x, out=x)
+    x += 1
+    return np.reciprocal(x, out=x)
+
+
+ACTIVATIONS = {"identity": lambda x: x, "relu": _relu, "tanh": _tanh, "logistic": _logistic}
+
+
+# Class: MLPScorer
+# weights: The weight matrix of each layer (MLPClassifier.coefs_)
+# biases: The bias vector of each layer (MLPClassifier.intercepts_)
+# activation: The hidden layers' activation: "identity", "relu", "tanh", or "logistic"
+# classes: The class labels, in the model's order
+#
+# The output activation is left out: a logistic output is above 0.5 exactly when
+# its input is above 0, and softmax keeps the order of its inputs, so the labels
+# are predicted from the last layer's raw output.
+class MLPScorer:
+    def __init__(self, weights, biases, activation, classes):
+        self.weights = [np.ascontiguousarray(weight, dtype=np.float64) for weight in weights]
+        self.biases = [np.asarray(bias, dtype=np.float64) for bias in biases]
+        self.activation = activation
+        self.classes = np.asarray(classes)
+
+    # decision_function(X): Returns the last layer's output before the output
+    # activation, raveled to one score per row for two classes.
+    def decision_function(self, X):
+        activate = ACTIVATIONS[self.activation]
+        output = X
+        for layer, (weight, bias) in enumerate(zip(self.weights, self.biases)):
+            output = output @ weight
+            output += bias
+            if layer < len(self.weights) - 1:
+                output = activate(output)
+        return output.ravel() if output.shape[1] == 1 else output
+
+    def predict(self, X):
+        return predict_labels(self.decision_function(X), self.classes)
+
+
+# Function: export_model(model)
+# model: A trained LinearSVC, LogisticRegression (or other linear classifier with
+#        coef_ and intercept_), or MLPClassifier
+# Returns: A LinearScorer or MLPScorer that predicts the same labels
+def export_model(model):
+    if hasattr(model, "coefs_") and hasattr(model, "intercepts_"):
+        if getattr(model, "out_activation_", None) not in ("logistic", "softmax"):
+            raise ValueError("Only single-label MLP classifiers can be exported.")
+        return MLPScorer(model.coefs_, model.intercepts_, model.activation, model.classes_)
+    if hasattr(model, "coef_") and hasattr(model, "intercept_") and hasattr(model, "classes_"):
+        coef = model.coef_.toarray() if hasattr(model.coef_, "toarray") else model.coef_
+        return LinearScorer(coef, np.atleast_1d(model.intercept_), model.classes_)
+    raise ValueError("{0} cannot be exported; only linear models and MLPs can.".format(type(model).__name__))
+
+
+# Function: predict_with_scores(model, X)
+# model: A trained model or scorer
+# X: The features of a batch of rows
+# Returns: The predicted label and the decision_function score of each row (the
+#          scores are None for models without decision_function)
+#
+# A scorer, or a scikit-learn linear model (one with coef_), predicts by
+# thresholding its scores, so the labels are derived from the scores rather than
+# by a second call into the model.
+def predict_with_scores(model, X):
+    if not hasattr(model, "decision_function"):
+        return model.predict(X), None
+    scores = np.asarray(model.decision_function(X))
+    if isinstance(model, (LinearScorer, MLPScorer)):
+        return predict_labels(scores, model.classes), scores
+    if hasattr(model, "coef_") and hasattr(model, "classes_"):
+        return predict_labels(scores, model.classes_), scores
+    return model.predict(X), scores
+
+
+# Function: featurize(data_file, vectorizer=None, word2vec=None)
+# Returns: The features of every document in a training CSV file (TF-IDF if a
+#          vectorizer is given, and averaged Word2Vec embeddings otherwise), and the labels
+def featurize(data_file, vectorizer=None, word2vec=None):
+    import chatbot
+    documents, labels = chatbot.load_as_list(data_file)
+    if vectorizer is not None:
+        return vectorizer.transform(documents), labels
+    return chatbot.strings2vec(word2vec, documents), labels
+
+
+# Function: check_parity(model, scorer, features)
+# Returns: The number of rows whose predicted label differs between the model and
+#          the scorer, and the largest absolute difference between their scores
+#          (None for models without decision_function, e.g. MLPClassifier)
+def check_parity(model, scorer, features):
+    import chatbot
+    mismatches = int(np.count_nonzero(chatbot.predict_features(model, features) != scorer.predict(features)))
+    if not hasattr(model, "decision_function"):
+        return mismatches, None
+    differences = np.abs(np.asarray(model.decision_function(features)) - scorer.decision_function(features))
+    return mismatches, float(np.max(differences, initial=0.0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a trained model to a NumPy scorer for serving.")
+    parser.add_argument("model", nargs="?", default="model.pkl", help="artifacts saved by chatbot.py train")
+    parser.add_argument("--output", default=SCORER_FILE)
+    parser.add_argument("--data", default="dataset.csv", help="the CSV file predictions are checked on")
+    parser.add_argument("--tokenizer", choices=["nltk", "regex"], default=None,
+                        help="for models saved without their tokenizer (default: the one they were saved with)")
+    args = parser.parse_args()
+
+    # Export through the module, so that the saved scorer refers to
+    # linear_scorer.LinearScorer rather than to this script's __main__.
+    import chatbot
+    import linear_scorer
+    if args.tokenizer:
+        chatbot.TOKENIZER = args.tokenizer
+    with open(args.model, 'rb') as fin:
+        artifacts = pkl.load(fin)
+    model, vectorizer = artifacts["model"], artifacts["vectorizer"]
+    # Check (and serve) the scorer with the tokenizer the model was trained with.
+    if artifacts.get("tokenizer"):
+        chatbot.TOKENIZER = artifacts["tokenizer"]
+    try:
+        scorer = linear_scorer.export_model(model)
+    except ValueError as e:
+        raise SystemExit("Cannot export {0}: {1}".format(args.model, e))
+
+    word2vec = chatbot.load_w2v(chatbot.default_embedding_path()) if vectorizer is None else None
+    features, labels = linear_scorer.featurize(args.data, vectorizer, word2vec)
+    start = time.perf_counter()
+    mismatches, max_diff = linear_scorer.check_parity(model, scorer, features)
+    print("Checked {0:,} documents from {1} in {2:.1f}s: {3} different predictions{4}".format(
+        features.shape[0], args.data, time.perf_counter() - start, mismatches,
+        ", max score difference {0:.2e}".format(max_diff) if max_diff is not None else ""))
+    if mismatches:
+        raise SystemExit("The scorer does not match the model; {0} was not written.".format(args.output))
+
+    chatbot.save_artifacts(args.output, scorer, vectorizer, artifacts["fingerprint"], chatbot.TOKENIZER)
+    print("Saved the {0} scorer for {1} to {2}.".format(type(scorer).__name__, type(model).__name__, args.output))
@@ -0,0 +1,382 @@
+# Lightweight metrics for tuning the chatbot's serving path.
+#
+# Besides the Histogram used by the batcher, this module keeps a registry of
+# named hot-path metrics: timing spans (histograms of milliseconds per stage, e.g.
+# tokenization, the embedding gather, model.predict, the CoreNLP call) and
+# counters (e.g., OOV tokens, parser errors), plus gauges read from callbacks
+# (e.g., cache hit counts).  They are disabled by default; while disabled, span()
+# returns a shared no-op context manager and count() returns immediately, so the
+# instrumented code pays only a function call.  enable() turns them on, and a
+# MetricsExporter periodically writes them to a sink: a Prometheus text file (for
+# node_exporter's textfile collector) or a JSON log with one snapshot per line.
+#
+# SamplingProfiler records the stacks of all threads every few milliseconds; with
+# install_profiler_toggle(), a signal (SIGUSR2 by default) starts it and, sent
+# again, stops it and writes the collapsed stacks (for flame graph tools).
+# =========================================================================================================
+
+import bisect
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+
+
+# Class: Histogram
+# Counts observations into fixed buckets, Prometheus-style: bucket i counts the
+# observations that are <= buckets[i], and one extra bucket counts the rest.
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    # quantile(q): Returns the upper bound of the bucket containing the q-th
+    # quantile (e.g., q=0.99 for p99), or None if nothing has been observed.
+    # Values above the largest bucket are reported as infinity.
+    def quantile(self, q):
+        with self.lock:
+            counts, count = list(self.counts), self.count
+        if count == 0:
+            return None
+        rank = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + [float("inf")], counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    # snapshot(): Returns the cumulative bucket counts as a dictionary.
+    def snapshot(self):
+        with self.lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        cumulative = 0
+        buckets = []
+        for bound, bucket_count in zip(self.buckets + [float("inf")], counts):
+            cumulative += bucket_count
+            buckets.append((bound, cumulative))
+        return {"buckets": buckets, "count": count, "sum": total}
+
+    # format(name): Returns a one-line summary, e.g. for periodic logging.
+    def format(self, name):
+        snapshot = self.snapshot()
+        if snapshot["count"] == 0:
+            return "{0}: no observations".format(name)
+        return "{0}: count={1} mean={2:.3g} p50<={3:g} p90<={4:g} p99<={5:g}".format(
+            name, snapshot["count"], snapshot["sum"] / snapshot["count"],
+            self.quantile(0.5), self.quantile(0.9), self.quantile(0.99))
+
+
+# Class: Counter
+# A thread-safe, monotonically increasing count.
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+# Buckets (in milliseconds) for the timing spans.
+SPAN_BUCKETS_MS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+ENABLED = False
+_histograms = {}
+_counters = {}
+_gauges = {}
+_registry_lock = threading.Lock()
+
+
+# Function: enable(enabled=True)
+# Turns the hot-path spans and counters on or off (at any time).
+def enable(enabled=True):
+    global ENABLED
+    ENABLED = enabled
+
+
+# Function: histogram(name)
+# Returns: The registered Histogram of span durations called name, created on first use
+def histogram(name):
+    metric = _histograms.get(name)
+    if metric is None:
+        with _registry_lock:
+            metric = _histograms.setdefault(name, Histogram(SPAN_BUCKETS_MS))
+    return metric
+
+
+# Function: counter(name)
+# Returns: The registered Counter called name, created on first use
+def counter(name):
+    metric = _counters.get(name)
+    if metric is None:
+        with _registry_lock:
+            metric = _counters.setdefault(name, Counter())
+    return metric
+
+
+# Function: register_gauges(prefix, read)
+# prefix: A name prefix for the gauges
+# read: A function returning a dictionary of current numeric values, e.g.
+#       LRUCache.stats; each is exported as <prefix>_<key>
+def register_gauges(prefix, read):
+    with _registry_lock:
+        _gauges[prefix] = read
+
+
+# Class: Span
+# Times a with-block into a histogram, in milliseconds.
+class Span:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(1000 * (time.perf_counter() - self.start))
+        return False
+
+
+# Class: NoSpan
+# The context manager span() returns while metrics are disabled; it does nothing.
+class NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+# Function: span(name)
+# Returns: A context manager that records how long its block takes in the
+#          histogram called name (or does nothing while metrics are disabled)
+def span(name):
+    if not ENABLED:
+        return NO_SPAN
+    return Span(histogram(name))
+
+
+# Function: count(name, amount=1)
+# Adds amount to the counter called name (while metrics are enabled).
+def count(name, amount=1):
+    if ENABLED:
+        counter(name).inc(amount)
+
+
+# Function: snapshot()
+# Returns: A dictionary with the current value of every registered metric:
+#          {"time": ..., "spans": {name: Histogram.snapshot()}, "counters": {name: value},
+#           "gauges": {name: value}}
+#
+# A gauge function that raises is reported on stderr and left out of this snapshot.
+def snapshot():
+    with _registry_lock:
+        histograms, counters, gauges = dict(_histograms), dict(_counters), dict(_gauges)
+    gauge_values = {}
+    for prefix, read in gauges.items():
+        try:
+            values = read()
+        except Exception as e:
+            print("Could not read the {0} gauges: {1!r}".format(prefix, e), file=sys.stderr)
+            continue
+        for key, value in values.items():
+            gauge_values["{0}_{1}".format(prefix, key)] = value
+    return {"time": time.time(), "spans": {name: metric.snapshot() for name, metric in histograms.items()},
+            "counters": {name: metric.value for name, metric in counters.items()}, "gauges": gauge_values}
+
+
+# Class: PrometheusFileSink
+# Writes each snapshot to a file in the Prometheus text exposition format,
+# replacing the previous one atomically.  Spans become <prefix>_<name>_ms
+# histograms, counters <prefix>_<name>_total, and gauges <prefix>_<name>.
+class PrometheusFileSink:
+    def __init__(self, filepath, prefix="chatbot"):
+        self.filepath = filepath
+        self.prefix = prefix
+
+    def write(self, metrics):
+        lines = []
+        for name, histogram_snapshot in sorted(metrics["spans"].items()):
+            metric = "{0}_{1}_ms".format(self.prefix, name)
+            lines.append("# TYPE {0} histogram".format(metric))
+            for bound, cumulative in histogram_snapshot["buckets"]:
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append('{0}_bucket{{le="{1}"}} {2}'.format(metric, le, cumulative))
+            lines.append("{0}_sum {1!r}".format(metric, float(histogram_snapshot["sum"])))
+            lines.append("{0}_count {1}".format(metric, histogram_snapshot["count"]))
+        for name, value in sorted(metrics["counters"].items()):
+            lines.append("# TYPE {0}_{1}_total counter".format(self.prefix, name))
+            lines.append("{0}_{1}_total {2}".format(self.prefix, name, value))
+        for name, value in sorted(metrics["gauges"].items()):
+            lines.append("# TYPE {0}_{1} gauge".format(self.prefix, name))
+            lines.append("{0}_{1} {2!r}".format(self.prefix, name, float(value)))
+        with open(self.filepath + ".tmp", "w") as fout:
+            fout.write("\n".join(lines) + "\n")
+        os.replace(self.filepath + ".tmp", self.filepath)
+
+
+# Class: JSONLogSink
+# Appends each snapshot to a file as one JSON line (the last bucket bound of each
+# span is written as "+Inf", since JSON has no infinity).
+class JSONLogSink:
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    def write(self, metrics):
+        spans = {name: dict(histogram_snapshot, buckets=[
+                     ["+Inf" if bound == float("inf") else bound, cumulative]
+                     for bound, cumulative in histogram_snapshot["buckets"]])
+                 for name, histogram_snapshot in metrics["spans"].items()}
+        with open(self.filepath, "a") as fout:
+            fout.write(json.dumps(dict(metrics, spans=spans), allow_nan=False) + "\n")
+
+
+# Function: make_sink(filepath)
+# Returns: A PrometheusFileSink if filepath ends in ".prom", and a JSONLogSink otherwise
+def make_sink(filepath):
+    if filepath.endswith(".prom"):
+        return PrometheusFileSink(filepath)
+    return JSONLogSink(filepath)
+
+
+# Class: MetricsExporter
+# sinks: The sinks to write to
+# interval: Seconds between exports
+#
+# Enables the metrics and writes a snapshot to every sink every interval seconds
+# from a background thread; stop() writes a final snapshot.  A sink that fails is
+# reported on stderr, and the other sinks and later exports carry on.
+class MetricsExporter:
+    def __init__(self, sinks, interval=10.0):
+        self.sinks = sinks
+        self.interval = interval
+        self.stopped = threading.Event()
+        enable()
+        self.thread = threading.Thread(target=self.run, name="metrics-exporter", daemon=True)
+        self.thread.start()
+
+    def export(self):
+        metrics = snapshot()
+        for sink in self.sinks:
+            try:
+                sink.write(metrics)
+            except Exception as e:
+                print("Could not export metrics to {0}: {1!r}".format(type(sink).__name__, e), file=sys.stderr)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.export()
+            except Exception as e:
+                print("Could not export metrics: {0!r}".format(e), file=sys.stderr)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.export()
+
+
+# Class: SamplingProfiler
+# interval: Seconds between samples
+#
+# Samples the stack of every other thread from a background thread, and counts
+# each distinct stack.  The overhead is one stack walk per thread per sample, and
+# nothing at all while stopped.
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = StackCounter()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stacks.clear()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{0}:{1}".format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+
+    # dump(filepath): Writes the samples as collapsed stacks ("a;b;c count" per
+    # line), the input format of flamegraph.pl and speedscope.
+    def dump(self, filepath):
+        with open(filepath, "w") as fout:
+            for stack, samples in self.stacks.most_common():
+                fout.write("{0} {1}\n".format(stack, samples))
+
+
+# Function: install_profiler_toggle(directory, signum=None, interval=0.005)
+# directory: Where the profiles are written, as profile-<timestamp>.txt
+# signum: OPTIONAL; The signal that toggles the profiler (SIGUSR2 by default,
+#         which Windows does not have)
+# Returns: The SamplingProfiler the signal toggles
+#
+# Each time the process receives signum (e.g., kill -USR2 <pid>), the profiler is
+# started, or stopped and its samples written.  Call from the main thread.
+def install_profiler_toggle(directory, signum=None, interval=0.005):
+    if signum is None:
+        signum = signal.SIGUSR2
+    profiler = SamplingProfiler(interval)
+    os.makedirs(directory, exist_ok=True)
+
+    def toggle(received, frame):
+        if not profiler.running:
+            profiler.start()
+            return
+        # Stopping joins the sampling thread, so do it outside the signal handler.
+        def stop_and_dump():
+            profiler.stop()
+            filepath = os.path.join(directory, "profile-{0}.txt".format(time.strftime("%Y%m%d-%H%M%S")))
+            profiler.dump(filepath)
+            print("Wrote profile samples to {0}".format(filepath))
+        threading.Thread(target=stop_and_dump, daemon=True).start()
+
+    signal.signal(signum, toggle)
+    return profiler
@@ -0,0 +1,222 @@
+# Precomputed lookup tables that give out-of-vocabulary tokens an embedding.
+#
+# chatbot.w2v and strings2vec give any token missing from the embeddings a zero
+# vector, which dilutes the average for capitalized words ("Brilliant"), tokens
+# with punctuation attached ("great!!") and misspellings.  This module adds two
+# tables to an embedding store, both built offline:
+#   - a normalization index: each vocabulary word's normalized form (lowercase,
+#     with leading/trailing punctuation stripped) mapped to its row, for forms
+#     that are not words of their own.  A missing token is normalized the same
+#     way and looked up directly.
+#   - character n-gram buckets: every 3- to 5-character n-gram of each word is
+#     hashed (crc32) into one of a fixed number of buckets, and each bucket holds
+#     the mean vector of the words whose n-grams fall into it.  A token the index
+#     cannot resolve gets the mean of its own n-grams' buckets.
+# Resolving a token is a dictionary lookup, or a few crc32 hashes and a gather
+# from the bucket matrix, so the cost per token does not depend on the size of the
+# vocabulary.  Tokens that are only punctuation keep a zero vector.
+#
+# Usage (the store is updated in place; rebuild after converting or pruning it):
+#   python oov_index.py [w2v_store] [--buckets 32768] [--min-n 3] [--max-n 5] [--no-ngrams]
+#                       [--evaluate dataset.csv] [--tokenizer nltk|regex]
+# =========================================================================================================
+
+import argparse
+import json
+import os
+import string
+import zlib
+
+import numpy as np
+
+KEYS_FILE = "oov_keys.txt"
+ROWS_FILE = "oov_rows.npy"
+BUCKETS_FILE = "ngram_buckets.npy"
+COUNTS_FILE = "ngram_counts.npy"
+
+PUNCTUATION = string.punctuation + "‘’“”–—…"
+
+
+# Function: normalize_token(token)
+# Returns: The token in lowercase, with leading and trailing punctuation removed
+def normalize_token(token):
+    return token.strip(PUNCTUATION).lower()
+
+
+# Function: char_ngrams(word, min_n=3, max_n=5)
+# Returns: The character n-grams of "<word>", from min_n to max_n characters long
+def char_ngrams(word, min_n=3, max_n=5):
+    word = "<" + word + ">"
+    return [word[i:i + n] for n in range(min_n, max_n + 1) for i in range(len(word) - n + 1)]
+
+
+# Function: ngram_buckets(word, n_buckets, min_n=3, max_n=5)
+# Returns: The bucket of each of the word's character n-grams
+def ngram_buckets(word, n_buckets, min_n=3, max_n=5):
+    return [zlib.crc32(ngram.encode("utf-8")) % n_buckets for ngram in char_ngrams(word, min_n, max_n)]
+
+
+# Function: build_oov_index(store_path, n_buckets=32768, min_n=3, max_n=5, ngrams=True, batch_size=50000)
+# store_path: Path of a store directory written by embedding_store.py
+# n_buckets: The number of n-gram buckets (each takes dim float16 values)
+# min_n, max_n: The shortest and longest n-grams
+# ngrams: False to build only the normalization index
+# batch_size: The number of words whose n-grams are added up at once
+# Returns: The number of normalized forms indexed
+#
+# The bucket sums are accumulated one batch of words at a time, as a sparse
+# (bucket x word) count matrix times the batch's vectors.
+def build_oov_index(store_path, n_buckets=32768, min_n=3, max_n=5, ngrams=True, batch_size=50000):
+    from scipy import sparse
+    from embedding_store import META_FILE, open_store
+
+    store = open_store(store_path, fallback=False)
+    index = {}
+    for word, row in store.vocab.items():
+        key = normalize_token(word)
+        if key and key not in store.vocab and key not in index:
+            index[key] = row
+    with open(os.path.join(store_path, KEYS_FILE), "w", encoding="utf-8", newline="\n") as f_keys:
+        f_keys.write("".join(key + "\n" for key in index))
+    np.save(os.path.join(store_path, ROWS_FILE), np.fromiter(index.values(), dtype=np.int64, count=len(index)))
+
+    settings = {"ngrams": ngrams}
+    if ngrams:
+        sums = np.zeros((n_buckets, store.dim))
+        counts = np.zeros(n_buckets, dtype=np.int64)
+        items = list(store.vocab.items())
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            buckets, columns = [], []
+            for column, (word, row) in enumerate(batch):
+                key = normalize_token(word)
+                if key:
+                    word_buckets = ngram_buckets(key, n_buckets, min_n, max_n)
+                    buckets.extend(word_buckets)
+                    columns.extend([column] * len(word_buckets))
+            counts_matrix = sparse.csr_matrix((np.ones(len(buckets)), (buckets, columns)),
+                                              shape=(n_buckets, len(batch)))
+            sums += counts_matrix @ store.take(np.array([row for word, row in batch], dtype=np.int64))
+            counts += np.bincount(buckets, minlength=n_buckets)
+        np.save(os.path.join(store_path, BUCKETS_FILE),
+                (sums / np.maximum(counts, 1)[:, None]).astype(np.float16))
+        np.save(os.path.join(store_path, COUNTS_FILE), counts.astype(np.int32))
+        settings.update({"buckets": n_buckets, "min_n": min_n, "max_n": max_n})
+
+    meta = dict(store.meta, oov_index=settings)
+    with open(os.path.join(store_path, META_FILE), "w") as f_meta:
+        json.dump(meta, f_meta, indent=2)
+    return len(index)
+
+
+# Class: OOVIndex
+# store_path: Path of a store directory with an index built by build_oov_index
+# settings: The store's meta["oov_index"]
+#
+# Set use_ngrams to False to resolve tokens with the normalization index only.
+class OOVIndex:
+    def __init__(self, store_path, settings):
+        with open(os.path.join(store_path, KEYS_FILE), "r", encoding="utf-8", newline="\n") as fin:
+            keys = fin.read().split("\n")[:-1]
+        self.index = dict(zip(keys, np.load(os.path.join(store_path, ROWS_FILE)).tolist()))
+        self.use_ngrams = settings.get("ngrams", False)
+        if self.use_ngrams:
+            self.n_buckets = settings["buckets"]
+            self.min_n = settings["min_n"]
+            self.max_n = settings["max_n"]
+            self.buckets = np.load(os.path.join(store_path, BUCKETS_FILE), mmap_mode="r")
+            self.counts = np.load(os.path.join(store_path, COUNTS_FILE), mmap_mode="r")
+
+    # nbytes: The size of the n-gram tables, in bytes
+    @property
+    def nbytes(self):
+        return self.buckets.nbytes + self.counts.nbytes if self.use_ngrams else 0
+
+    # normalized_rows(tokens, vocab): Returns the row of each token's normalized
+    # form in the store (vocab is the store's word -> row dictionary) as an int64
+    # array, with -1 for tokens that do not resolve.
+    def normalized_rows(self, tokens, vocab):
+        rows = np.full(len(tokens), -1, dtype=np.int64)
+        for i, token in enumerate(tokens):
+            key = normalize_token(token)
+            if key:
+                row = vocab.get(key)
+                rows[i] = row if row is not None else self.index.get(key, -1)
+        return rows
+
+    # ngram_vectors(tokens): Returns an (n_tokens, dim) float32 array holding the
+    # mean of each token's n-gram buckets, and a boolean array marking the tokens
+    # that had any (the others get a zero vector).
+    def ngram_vectors(self, tokens):
+        vectors = np.zeros((len(tokens), self.buckets.shape[1]), dtype=np.float32)
+        found = np.zeros(len(tokens), dtype=bool)
+        for i, token in enumerate(tokens):
+            key = normalize_token(token)
+            if not key:
+                continue
+            buckets = [bucket for bucket in ngram_buckets(key, self.n_buckets, self.min_n, self.max_n)
+                       if self.counts[bucket]]
+            if buckets:
+                vectors[i] = self.buckets[buckets].mean(axis=0, dtype=np.float32)
+                found[i] = True
+        return vectors, found
+
+
+# Function: oov_rates(store, tokens)
+# store: An EmbeddingStore with an OOV index
+# tokens: A list of tokens (e.g., from every document in the training data)
+# Returns: The fraction of tokens missing from the vocabulary, still missing after
+#          the normalization index, and still missing after the n-gram buckets
+def oov_rates(store, tokens):
+    missing = np.flatnonzero(store.lookup(tokens) < 0)
+    missing_tokens = [tokens[i] for i in missing]
+    unresolved = [token for token, row in zip(missing_tokens, store.oov_index.normalized_rows(
+        missing_tokens, store.vocab)) if row < 0]
+    after_ngrams = len(unresolved)
+    if store.oov_index.use_ngrams:
+        after_ngrams = int(np.count_nonzero(~store.oov_index.ngram_vectors(unresolved)[1]))
+    total = max(len(tokens), 1)
+    return len(missing) / total, len(unresolved) / total, after_ngrams / total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the OOV lookup tables for an embedding store.")
+    parser.add_argument("store", nargs="?", default="w2v_store")
+    parser.add_argument("--buckets", type=int, default=32768, help="number of character n-gram buckets")
+    parser.add_argument("--min-n", type=int, default=3)
+    parser.add_argument("--max-n", type=int, default=5)
+    parser.add_argument("--no-ngrams", action="store_true", help="build only the normalization index")
+    parser.add_argument("--evaluate", metavar="DATA", default=None,
+                        help="report OOV rates and accuracy with and without the tables on this CSV file")
+    parser.add_argument("--tokenizer", choices=["nltk", "regex"], default=None,
+                        help="the tokenizer used by --evaluate")
+    args = parser.parse_args()
+
+    num_keys = build_oov_index(args.store, args.buckets, args.min_n, args.max_n, not args.no_ngrams)
+    print("Indexed {0:,} normalized forms{1} in {2}/".format(
+        num_keys, "" if args.no_ngrams else " and {0:,} n-gram buckets".format(args.buckets), args.store))
+
+    if args.evaluate:
+        import chatbot
+        from embedding_store import accuracy_report, format_report, open_store
+        if args.tokenizer:
+            chatbot.TOKENIZER = args.tokenizer
+
+        store = open_store(args.store, fallback=False)
+        documents, labels = chatbot.load_as_list(args.evaluate)
+        tokens = [token for document in documents for token in chatbot.get_tokens(document)]
+        exact, normalized, ngrams = oov_rates(store, tokens)
+        print("OOV rate on {0:,} tokens: {1:.2%} exact, {2:.2%} after normalization, {3:.2%} after n-grams".format(
+            len(tokens), exact, normalized, ngrams))
+
+        embeddings = []
+        for name, use_ngrams in (("exact", None), ("normalized", False), ("normalized+ngrams", True)):
+            if use_ngrams and not store.oov_index.use_ngrams:
+                continue
+            variant = open_store(args.store, fallback=False)
+            if use_ngrams is None:
+                variant.oov_index = None
+            else:
+                variant.oov_index.use_ngrams = use_ngrams
+            embeddings.append((name, variant))
+        print(format_report(accuracy_report(embeddings, args.evaluate)))
@@ -1,57 +1,240 @@
-# Function: process_transcripts(fname)
+# Splits chatbot transcripts into their chatbot and user utterances.
+#
+# Transcripts are either the JSONL logs written by transcript.py (one record per
+# message, already tagged with its session and speaker) or text files with
+# "CHATBOT:"/"USER:" speaker tags.  A single transcript is split into three text files (all utterances, chatbot only,
+# user only).  Given directories or glob patterns, thousands of transcripts are
+# split in parallel worker processes, either into three text files each or into one
+# consolidated JSONL (or Parquet, with pyarrow) file with one record per turn:
+# session, turn index, speaker and text.  Throughput is reported in MB/s.
+#
+# Usage:
+#   python process_transcripts.py [test.txt]
+#   python process_transcripts.py transcripts/ "logs/*.txt" [--workers N] [--output-dir DIR]
+#                                 [--consolidated turns.jsonl|turns.parquet]
+# =========================================================================================================
+
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional
+    pa = None
+    pq = None
+
+# Output files are written through large buffers, so each transcript costs a few
+# large writes instead of one write per line.
+BUFFER_SIZE = 1 << 20
+
+SPEAKER_TAGS = (("CHATBOT:", "chatbot"), ("USER:", "user"))
+OUTPUT_PREFIXES = ("all_", "chatbot_", "user_")
+
+
+# Function: split_transcript(lines)
+# lines: An iterable of lines from a transcript file
+# Returns: A generator of (turn index, speaker, message) tuples, one per non-empty
+#          line, where speaker is "chatbot", "user", or None before the first tag
+#
+# A turn starts at each speaker tag; the lines after the tag (up to the next tag)
+# are continuations of the same turn.
+def split_transcript(lines):
+    current_speaker = None  # Tracks the current speaker
+    turn = -1
+
+    for line in lines:
+        line = line.strip()  # Remove leading/trailing whitespace
+
+        if not line:
+            continue  # Skip empty lines
+
+        # Check if the line indicates a new speaker
+        for tag, speaker in SPEAKER_TAGS:
+            if line.startswith(tag):
+                current_speaker = speaker
+                turn += 1
+                # Extract the message after the speaker tag
+                line = line[len(tag):].strip()
+                break
+
+        if line:
+            if turn < 0:
+                turn = 0  # Lines before the first tag form a turn of their own
+            yield turn, current_speaker, line
+
+
+# Function: text_turns(f_in, session)
+# f_in: An open text transcript
+# session: The session name to report
+# Returns: A generator of (session, turn index, speaker, text) tuples, one per turn,
+#          with the turn's lines joined by newlines
+def text_turns(f_in, session):
+    turn_lines = []
+    current = turn_speaker = None
+    for turn, speaker, message in split_transcript(f_in):
+        if turn != current and turn_lines:
+            yield session, current, turn_speaker, "\n".join(turn_lines)
+            turn_lines = []
+        current, turn_speaker = turn, speaker
+        turn_lines.append(message)
+    if turn_lines:
+        yield session, current, turn_speaker, "\n".join(turn_lines)
+
+
+# Function: jsonl_turns(f_in)
+# f_in: An open JSONL transcript written by transcript.py
+# Returns: A generator of (session, turn index, speaker, text) tuples, one per
+#          record, numbering the turns of each session from 0
+def jsonl_turns(f_in):
+    turns = {}
+    for line in f_in:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        session = record["session"]
+        turns[session] = turns.get(session, -1) + 1
+        yield session, turns[session], record["speaker"], record["text"]
+
+
+# Function: iter_turns(fname)
+# fname: A transcript file name (.jsonl, or a text transcript)
+# Returns: A generator of (session, turn index, speaker, text) tuples; text
+#          transcripts are named after their file
+def iter_turns(fname):
+    with open(fname, "r", buffering=BUFFER_SIZE, encoding="utf-8") as f_in:
+        if fname.endswith(".jsonl"):
+            yield from jsonl_turns(f_in)
+        else:
+            yield from text_turns(f_in, os.path.splitext(os.path.basename(fname))[0])
+
+
+# Function: output_paths(fname, output_dir=None)
+# fname: A transcript file name, possibly including directories
+# output_dir: OPTIONAL; Where to write the outputs (defaults to fname's directory)
+# Returns: The paths of the all_, chatbot_ and user_ output files
+def output_paths(fname, output_dir=None):
+    directory = output_dir if output_dir is not None else os.path.dirname(fname)
+    basename = os.path.basename(fname)
+    if basename.endswith(".jsonl"):
+        basename = basename[:-len(".jsonl")] + ".txt"  # The outputs are plain text
+    return tuple(os.path.join(directory, prefix + basename) for prefix in OUTPUT_PREFIXES)
+
+
+# Function: split_to_files(fname, output_dir=None)
+# Returns: The paths of the three files written (see process_transcripts)
+def split_to_files(fname, output_dir=None):
+    all_path, chatbot_path, user_path = output_paths(fname, output_dir)
+    # Open the three output files
+    with open(all_path, "w", buffering=BUFFER_SIZE) as f_out_all, \
+            open(chatbot_path, "w", buffering=BUFFER_SIZE) as f_out_chatbot, \
+            open(user_path, "w", buffering=BUFFER_SIZE) as f_out_user:
+        outputs = {"chatbot": f_out_chatbot, "user": f_out_user, None: None}
+        for session, turn, speaker, text in iter_turns(fname):
+            lines = "".join(line.strip() + "\n" for line in text.splitlines() if line.strip())
+            f_out_all.write(lines)
+            if outputs.get(speaker) is not None:  # If no speaker is identified, write to all only
+                outputs[speaker].write(lines)
+    return all_path, chatbot_path, user_path
+
+
+# Function: process_transcripts(fname, output_dir=None)
 # fname: A string indicating a file name
+# output_dir: OPTIONAL; Where to write the output files (defaults to fname's directory)
 # Returns: Nothing (writes output to file)
 #
 # This function processes a provided transcript file by creating three versions of it:
 # one includes all utterances, with one utterance per line; another includes only the
 # chatbot utterances; and the third includes only the user utterances.  None of these
-# files should contain the speaker tags ("CHATBOT" or "USER").
-def process_transcripts(fname):
-    # Open the input file and the three output files
-    with open(fname, "r") as f_in, \
-            open(f"all_{fname}", "w") as f_out_all, \
-            open(f"chatbot_{fname}", "w") as f_out_chatbot, \
-            open(f"user_{fname}", "w") as f_out_user:
+# files should contain the speaker tags ("CHATBOT" or "USER").  The output files are
+# named by prefixing "all_", "chatbot_" and "user_" to the input file's name.
+def process_transcripts(fname, output_dir=None):
+    all_path, chatbot_path, user_path = split_to_files(fname, output_dir)
 
-        current_speaker = None  # Tracks the current speaker
+    print(f"Processed transcripts saved as {all_path}, {chatbot_path}, and {user_path}.")
 
-        for line in f_in:
-            line = line.strip()  # Remove leading/trailing whitespace
+    return
 
-            if not line:
-                continue  # Skip empty lines
 
-            # Check if the line indicates a new speaker
-            if line.startswith("CHATBOT:"):
-                current_speaker = "chatbot"
-                # Extract the message after the speaker tag
-                message = line[len("CHATBOT:"):].strip()
-                if message:
-                    f_out_all.write(message + "\n")
-                    f_out_chatbot.write(message + "\n")
-            elif line.startswith("USER:"):
-                current_speaker = "user"
-                # Extract the message after the speaker tag
-                message = line[len("USER:"):].strip()
-                if message:
-                    f_out_all.write(message + "\n")
-                    f_out_user.write(message + "\n")
-            else:
-                # Continuation of the previous message
-                if current_speaker == "chatbot":
-                    f_out_all.write(line + "\n")
-                    f_out_chatbot.write(line + "\n")
-                elif current_speaker == "user":
-                    f_out_all.write(line + "\n")
-                    f_out_user.write(line + "\n")
-                else:
-                    # If no speaker is identified, write to all
-                    f_out_all.write(line + "\n")
-
-    print(f"Processed transcripts saved as all_{fname}, chatbot_{fname}, and user_{fname}.")
+# Function: transcript_records(fname)
+# fname: A transcript file name
+# Returns: A list of dictionaries, one per turn, with the session, the turn index,
+#          the speaker, and the turn's text
+def transcript_records(fname):
+    return [{"session": session, "turn": turn, "speaker": speaker, "text": text}
+            for session, turn, speaker, text in iter_turns(fname)]
 
-    return
 
+# Function: find_transcripts(patterns)
+# patterns: File names, directories (all of their .txt and .jsonl files), or glob patterns
+# Returns: The sorted transcript file names, leaving out earlier outputs (all_*,
+#          chatbot_*, user_*)
+def find_transcripts(patterns):
+    fnames = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, "*.txt")) + glob.glob(os.path.join(pattern, "*.jsonl"))
+        else:
+            matches = glob.glob(pattern)
+        for fname in matches:
+            if os.path.isfile(fname) and not os.path.basename(fname).startswith(OUTPUT_PREFIXES):
+                fnames.add(fname)
+    return sorted(fnames)
+
+
+# Class: RecordWriter
+# Appends transcript records to a JSONL file or, if the path ends in ".parquet", to
+# a Parquet file (one row group per batch of transcripts).
+class RecordWriter:
+    def __init__(self, filepath):
+        self.parquet = filepath.endswith(".parquet")
+        if self.parquet:
+            self.schema = pa.schema([("session", pa.string()), ("turn", pa.int64()),
+                                     ("speaker", pa.string()), ("text", pa.string())])
+            self.writer = pq.ParquetWriter(filepath, self.schema)
+        else:
+            self.fout = open(filepath, "w", buffering=BUFFER_SIZE, encoding="utf-8")
+
+    def write(self, records):
+        if self.parquet:
+            self.writer.write_table(pa.Table.from_pylist(records, schema=self.schema))
+        else:
+            self.fout.write("".join(json.dumps(record) + "\n" for record in records))
+
+    def close(self):
+        if self.parquet:
+            self.writer.close()
+        else:
+            self.fout.close()
+
+
+# Function: process_many(fnames, workers=None, output_dir=None, consolidated=None)
+# fnames: Transcript file names (see find_transcripts)
+# workers: The number of worker processes (defaults to the number of CPUs)
+# output_dir: OPTIONAL; Where to write the three text files per transcript
+# consolidated: OPTIONAL; A .jsonl or .parquet file to write all turns to instead
+# Returns: The number of input bytes processed
+def process_many(fnames, workers=None, output_dir=None, consolidated=None):
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    # Small files are handed to workers in batches to keep the per-task overhead low.
+    batch = max(1, min(64, len(fnames) // (4 * (workers or os.cpu_count()))))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if consolidated is None:
+            list(pool.map(split_to_files, fnames, [output_dir] * len(fnames), chunksize=batch))
+        else:
+            writer = RecordWriter(consolidated)
+            try:
+                for records in pool.map(transcript_records, fnames, chunksize=batch):
+                    if records:
+                        writer.write(records)
+            finally:
+                writer.close()
+    return sum(os.path.getsize(fname) for fname in fnames)
 
 
 # This is your main() function.  Use this space to try out and debug your code
@@ -103,5 +286,24 @@ def process_transcripts(fname):
 # I'm currently creating a sample transcript for the CS 421 students.  This will help them ensure that their programs work correctly.  It will also provide an example interaction for them!
 # I think I'd like to quit.
 if __name__ == "__main__":
-    fname = "test.txt"
-    process_transcripts(fname)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Split chatbot transcripts into chatbot and user utterances.")
+    parser.add_argument("paths", nargs="*", default=["test.txt"], help="transcript files, directories or glob patterns")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output-dir", default=None, help="where to write the split text files")
+    parser.add_argument("--consolidated", default=None,
+                        help="write every turn to one .jsonl or .parquet file instead of three text files each")
+    args = parser.parse_args()
+
+    if args.consolidated is not None and args.consolidated.endswith(".parquet") and pq is None:
+        raise SystemExit("Writing Parquet requires pyarrow; use a .jsonl file instead.")
+
+    if args.paths == ["test.txt"] and args.consolidated is None:
+        fname = "test.txt"
+        process_transcripts(fname, args.output_dir)
+    else:
+        fnames = find_transcripts(args.paths)
+        start = time.perf_counter()
+        num_bytes = process_many(fnames, args.workers, args.output_dir, args.consolidated)
+        elapsed = time.perf_counter() - start
+        print("Processed {0} transcripts ({1:.1f} MB) in {2:.2f}s: {3:.1f} MB/s".format(
+            len(fnames), num_bytes / 1e6, elapsed, num_bytes / 1e6 / max(elapsed, 1e-9)))
@@ -0,0 +1,177 @@
+# Builds a pruned embedding store that holds only the words our inputs actually use.
+#
+# Most of the Google News vocabulary never appears in the training data or in
+# what users type, but every process pays for all of it (the vocabulary index alone
+# takes hundreds of MB).  This tool counts the tokens (with chatbot.get_tokens) in
+# the training data and in logged transcripts (users' messages only), keeps the
+# words that occur at least --min-count times, at most --max-words of them, and
+# writes them most frequent first, so the hot words share a few pages of the
+# memory-mapped matrix.  It reports the out-of-vocabulary rate of each input with
+# the full and the pruned vocabulary.
+#
+# With --fallback, the pruned store records the full store it came from, and
+# lookups of words missing from the pruned store fall back to it (see
+# embedding_store.FallbackEmbeddingStore).  The tool then checks that the pruned
+# store gives the same vectors as the full store, for the input's words and for
+# out-of-vocabulary variants of them, and stops if it does not.  chatbot.py loads
+# the pruned store (PRUNED_STORE) in preference to the full one; retrain the model
+# after pruning.
+#
+# Usage:
+#   python prune_embeddings.py [w2v_store] [w2v_pruned] [--data dataset.csv] [--transcripts transcripts.jsonl ...]
+#                              [--min-count 1] [--max-words N] [--kind float32|float16|int8] [--fallback]
+# =========================================================================================================
+
+import argparse
+import os
+from collections import Counter
+
+import chatbot
+from embedding_store import KINDS, embeddings_nbytes, iter_source_vectors, load_source, open_store, write_store
+from process_transcripts import find_transcripts, iter_turns
+
+
+# Function: iter_data_texts(data_file, chunksize=10000)
+# Returns: A generator of the documents in a training CSV file, read in chunks
+def iter_data_texts(data_file, chunksize=10000):
+    for documents, labels in chatbot.load_in_chunks(data_file, chunksize):
+        yield from documents
+
+
+# Function: iter_user_texts(patterns)
+# patterns: Transcript files, directories, or glob patterns (see process_transcripts.find_transcripts)
+# Returns: A generator of the users' messages in the transcripts
+def iter_user_texts(patterns):
+    for fname in find_transcripts(patterns):
+        for session, turn, speaker, text in iter_turns(fname):
+            if speaker == "user":
+                yield text
+
+
+# Function: count_tokens(texts)
+# texts: An iterable of strings
+# Returns: A Counter of the tokens in the texts, as chatbot.get_tokens splits them
+def count_tokens(texts):
+    counts = Counter()
+    for text in texts:
+        counts.update(chatbot.get_tokens(str(text)))
+    return counts
+
+
+# Function: select_vocabulary(counts, source, min_count=1, max_words=None)
+# counts: A Counter of token occurrences
+# source: The full embeddings (a dictionary or an EmbeddingStore)
+# min_count: The fewest occurrences a word needs to be kept
+# max_words: OPTIONAL; The most words kept (the rarest are cut)
+# Returns: The words to keep, most frequent first (ties in first-seen order)
+def select_vocabulary(counts, source, min_count=1, max_words=None):
+    words = [word for word, count in counts.most_common() if count >= min_count and word in source]
+    return words[:max_words] if max_words is not None else words
+
+
+# Function: oov_rate(counts, vocabulary)
+# Returns: The fraction of token occurrences in counts that are not in vocabulary
+def oov_rate(counts, vocabulary):
+    total = sum(counts.values())
+    if not total:
+        return 0.0
+    return sum(count for word, count in counts.items() if word not in vocabulary) / total
+
+
+# Function: prune_store(source, store_path, words, kind="float32", fallback_path=None, meta=None)
+# source: The full embeddings (a dictionary or an EmbeddingStore)
+# store_path: Path of the directory to write the pruned store to
+# words: The words to keep, in the order they should be stored
+# kind: The storage format of the pruned store
+# fallback_path: OPTIONAL; The full store directory to fall back to for other words
+# meta: OPTIONAL; Extra entries for the store's meta.json
+# Returns: The number of words written
+def prune_store(source, store_path, words, kind="float32", fallback_path=None, meta=None):
+    num_words, dim, pairs = iter_source_vectors(source)
+    meta = dict(meta or {})
+    if fallback_path is not None:
+        if not os.path.isdir(fallback_path):
+            raise ValueError("The fallback must be a store directory; convert {0} with embedding_store.py "
+                             "first.".format(fallback_path))
+        meta["fallback"] = os.path.relpath(os.path.abspath(fallback_path),
+                                           os.path.dirname(os.path.abspath(store_path)))
+    return write_store(((word, source[word]) for word in words), len(words), dim, store_path, kind, meta)
+
+
+# Function: oov_variants(words)
+# Returns: Out-of-vocabulary spellings of the words, as users type them:
+#          capitalized, with punctuation attached, and with a letter dropped
+def oov_variants(words):
+    return [variant for word in words
+            for variant in (word.capitalize(), word.upper(), word + "!!", "(" + word + ")", word[:-1] + word[-1] * 2)]
+
+
+# Function: check_fallback(store_path, tokens)
+# store_path: Path of a pruned store written with a fallback
+# tokens: The tokens to compare
+# Returns: The tokens whose vectors differ between the pruned store (with its
+#          fallback) and the full store, and the largest absolute difference
+def check_fallback(store_path, tokens):
+    import numpy as np
+    store = open_store(store_path)
+    pruned_rows = store.embed(tokens)
+    full_rows = store.full_store().embed(tokens)
+    differences = np.abs(pruned_rows - full_rows).max(axis=1) if len(tokens) else np.zeros(0)
+    return [token for token, difference in zip(tokens, differences) if difference > 0], \
+        float(differences.max(initial=0.0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a pruned, frequency-ordered embedding store.")
+    parser.add_argument("source", nargs="?", default=chatbot.EMBEDDING_STORE, help="w2v.pkl or a store directory")
+    parser.add_argument("store", nargs="?", default=chatbot.PRUNED_STORE)
+    parser.add_argument("--data", nargs="*", default=["dataset.csv"], help="training CSV files to scan")
+    parser.add_argument("--transcripts", nargs="*", default=[],
+                        help="transcript files, directories, or glob patterns to scan")
+    parser.add_argument("--min-count", type=int, default=1, help="fewest occurrences for a word to be kept")
+    parser.add_argument("--max-words", type=int, default=None, help="most words kept, most frequent first")
+    parser.add_argument("--kind", choices=list(KINDS), default="float32", help="how the vectors are stored")
+    parser.add_argument("--fallback", action="store_true",
+                        help="look up words missing from the pruned store in the full store")
+    parser.add_argument("--tokenizer", choices=["nltk", "regex"], default=chatbot.TOKENIZER)
+    args = parser.parse_args()
+    chatbot.TOKENIZER = args.tokenizer
+    if args.fallback and not os.path.isdir(args.source):
+        parser.error("--fallback needs a store directory as the source (see embedding_store.py)")
+
+    inputs = {}
+    for data_file in args.data:
+        inputs[data_file] = count_tokens(iter_data_texts(data_file))
+    if args.transcripts:
+        inputs["transcripts"] = count_tokens(iter_user_texts(args.transcripts))
+    counts = sum(inputs.values(), Counter())
+
+    source = load_source(args.source)
+    words = select_vocabulary(counts, source, args.min_count, args.max_words)
+    prune_store(source, args.store, words, args.kind, args.source if args.fallback else None,
+                {"source": os.path.basename(os.path.normpath(args.source)), "min_count": args.min_count,
+                 "max_words": args.max_words})
+    pruned = open_store(args.store, fallback=False)
+    print("Kept {0:,} of {1:,} words ({2:.1f} MB instead of {3:.1f} MB); wrote {4}/".format(
+        len(pruned), len(source), pruned.nbytes / 2**20,
+        embeddings_nbytes(source) / 2**20, args.store))
+
+    kept = set(words)
+    print("{0:<30}{1:>12}{2:>10}{3:>14}{4:>14}".format("Input", "Tokens", "Types", "OOV (full)", "OOV (pruned)"))
+    for name, input_counts in list(inputs.items()) + ([("all", counts)] if len(inputs) > 1 else []):
+        print("{0:<30}{1:>12,}{2:>10,}{3:>14.2%}{4:>14.2%}".format(
+            name, sum(input_counts.values()), len(input_counts), oov_rate(input_counts, source),
+            oov_rate(input_counts, kept)))
+
+    if args.fallback:
+        # Compare every kept word, a sample of the dropped ones, and misspelled or
+        # differently cased variants of both, which the OOV index resolves.
+        dropped = [word for word in counts if word not in kept][:1000]
+        tokens = words[:1000] + dropped
+        tokens += oov_variants(tokens)
+        mismatches, max_diff = check_fallback(args.store, tokens)
+        print("Checked {0:,} tokens against the full store: {1} different vectors, max difference {2:.2e}".format(
+            len(tokens), len(mismatches), max_diff))
+        if mismatches and args.kind == getattr(source, "meta", {}).get("kind", "float32"):
+            raise SystemExit("The pruned store does not give the full store's vectors, e.g. for {0!r}.".format(
+                mismatches[0]))
@@ -0,0 +1,214 @@
+# Serves the chatbot to many users at once from a single process.
+#
+# Each TCP connection is one chat session with its own chatbot.ChatSession, driven
+# by the same transition handlers as the terminal chatbot.  The protocol is
+# line-based: the server sends each chatbot message followed by a newline (multi-
+# line messages are sent as several lines), and reads one line of user input per
+# turn, so "nc localhost 8421" is enough to chat.
+#
+# All sessions share one copy of the trained model and the Word2Vec embeddings.
+# The expensive part of each turn (chatbot.analyze_turn) runs in a thread pool,
+# so the event loop keeps serving other sessions while a prediction or
+# dependency parse is in progress.  Sentiment predictions from all sessions are
+# micro-batched (see batcher.py) unless --max-batch-size is 1.
+#
+# Usage (after "python chatbot.py train"):
+#   python server.py [--host 127.0.0.1] [--port 8421] [--workers 8] [--max-sessions 10000]
+#                    [--max-batch-size 32] [--max-wait-ms 2] [--stats-interval 60] [--cache-dir DIR]
+#                    [--transcript transcripts.jsonl [--per-session]]
+#                    [--metrics metrics.prom [--metrics-interval 10]] [--profile-dir profiles]
+#                    [--sentiment-cache-ttl 3600] [--shared-cache sentiment_cache.db]
+# =========================================================================================================
+
+import argparse
+import asyncio
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import chatbot
+import metrics
+from batcher import InferenceBatcher
+from transcript import TranscriptWriter
+
+BUSY_MESSAGE = "Sorry, the chatbot is busy right now.  Please try again later."
+IDLE_MESSAGE = "Are you still there?  Ending this session since it has been idle."
+
+
+# Class: ChatServer
+# Holds what every session shares: the trained model, the vectorizer or Word2Vec
+# embeddings, the executor that analysis runs on, the sentiment batcher, and the
+# TranscriptWriter conversations are logged to (None to not log them).
+class ChatServer:
+    def __init__(self, model, vectorizer=None, word2vec=None, workers=None, max_sessions=10000,
+                 idle_timeout=600, max_batch_size=32, max_wait_ms=2.0, transcript=None):
+        self.model = model
+        self.vectorizer = vectorizer
+        self.word2vec = word2vec
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.batcher = None
+        if max_batch_size > 1:
+            self.batcher = InferenceBatcher(model, vectorizer, word2vec, max_batch_size, max_wait_ms, self.executor)
+        self.transcript = transcript
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.active_sessions = 0
+        # Session IDs include the start time and process ID, so they are unique across
+        # restarts and across workers started in the same second, and per-session
+        # transcripts never collide.
+        self.session_prefix = "{0}_{1}".format(time.strftime("%Y-%m-%d_%H:%M:%S"), os.getpid())
+        self.session_ids = itertools.count(1)
+
+    # analyze(state, user_input): Runs chatbot.analyze_turn in the executor, or
+    # submits sentiment predictions to the batcher.
+    async def analyze(self, state, user_input):
+        if state == "sentiment_analysis" and self.batcher is not None:
+            return await self.batcher.predict(user_input)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, chatbot.analyze_turn, state, user_input,
+                                          self.model, self.vectorizer, self.word2vec)
+
+    # respond(session, user_input): Runs one turn and returns the chatbot's replies.
+    async def respond(self, session, user_input):
+        start = time.perf_counter()
+        state = session.state
+        analysis = None
+        if state in chatbot.ANALYSIS_STATES:
+            analysis = await self.analyze(state, user_input)
+        replies = chatbot.transition(session, user_input, analysis)
+        self.log(session, "user", user_input, state)
+        self.log(session, "chatbot", "\n".join(replies), state, time.perf_counter() - start)
+        return replies
+
+    # log(session, speaker, text, state, latency=None): Queues a transcript record, if logging.
+    def log(self, session, speaker, text, state, latency=None):
+        if self.transcript is not None:
+            self.transcript.log(session.session_id, speaker, text, state, latency)
+
+    # handle_connection(reader, writer): Runs one chat session over a connection.
+    async def handle_connection(self, reader, writer):
+        if self.active_sessions >= self.max_sessions:
+            await send(writer, [BUSY_MESSAGE])
+            await close(writer)
+            return
+
+        self.active_sessions += 1
+        session = chatbot.ChatSession("{0}-{1}".format(self.session_prefix, next(self.session_ids)))
+        try:
+            greeting = chatbot.start_session(session)
+            self.log(session, "chatbot", "\n".join(greeting), "welcome_state")
+            await send(writer, greeting)
+            while session.state != "quit":
+                try:
+                    line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    await send(writer, [IDLE_MESSAGE])
+                    break
+                if not line:
+                    break
+                user_input = line.decode("utf-8", errors="replace").rstrip("\r\n")
+                await send(writer, await self.respond(session, user_input))
+        except ConnectionError:
+            pass
+        finally:
+            self.active_sessions -= 1
+            await close(writer)
+
+    # report_stats(interval): Prints the batcher's histograms and the parse,
+    # stylistic, and sentiment cache hit rates every interval seconds.
+    async def report_stats(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            lines = ["{0} active sessions".format(self.active_sessions)]
+            if self.batcher is not None:
+                lines.append(self.batcher.format_stats())
+            lines.append(chatbot.PARSE_CACHE.format("parse_cache"))
+            lines.append(chatbot.STYLISTIC_CACHE.format("stylistic_cache"))
+            if chatbot.SENTIMENT_CACHE is not None:
+                lines.append(chatbot.SENTIMENT_CACHE.format("sentiment_cache"))
+            print("\n".join(lines))
+
+    # serve(host, port, stats_interval=None): Accepts connections until cancelled.
+    async def serve(self, host, port, stats_interval=None):
+        # The default listen backlog (100) drops connections when many clients arrive at once.
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=min(self.max_sessions, 4096))
+        addresses = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+        print("Serving the chatbot on {0}".format(addresses))
+        if stats_interval:
+            asyncio.get_running_loop().create_task(self.report_stats(stats_interval))
+        async with server:
+            await server.serve_forever()
+
+
+# Function: send(writer, messages)
+# Writes each message on its own line(s) and waits for the data to be flushed.
+async def send(writer, messages):
+    writer.write("".join(message + "\n" for message in messages).encode("utf-8"))
+    await writer.drain()
+
+
+# Function: close(writer)
+# Closes the connection, ignoring errors from clients that already disconnected.
+async def close(writer):
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the chatbot to many concurrent users.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8421)
+    parser.add_argument("--workers", type=int, default=None, help="threads for model inference and parsing")
+    parser.add_argument("--max-sessions", type=int, default=10000)
+    parser.add_argument("--idle-timeout", type=float, default=600, help="seconds before an idle session is closed")
+    parser.add_argument("--max-batch-size", type=int, default=32, help="1 disables sentiment batching")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0, help="longest wait for a batch to fill")
+    parser.add_argument("--stats-interval", type=float, default=None, help="seconds between batching and cache stats")
+    parser.add_argument("--cache-dir", default=None, help="keep parse and stylistic caches here across restarts")
+    parser.add_argument("--transcript", default=None, help="log conversations to this JSONL file (or directory)")
+    parser.add_argument("--per-session", action="store_true", help="log each session to its own file in --transcript")
+    parser.add_argument("--model", default=chatbot.MODEL_FILE)
+    parser.add_argument("--data", default="dataset.csv", help="the training data the model should come from")
+    parser.add_argument("--metrics", default=None, help="export hot-path timings and counters to this .prom or JSONL file")
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="seconds between metrics exports")
+    parser.add_argument("--profile-dir", default=None, help="let SIGUSR2 start/stop a sampling profiler writing here")
+    parser.add_argument("--sentiment-cache-ttl", type=float, default=chatbot.SENTIMENT_CACHE_TTL,
+                        help="seconds a cached sentiment result stays valid (0 disables the cache)")
+    parser.add_argument("--shared-cache", default=None,
+                        help="share sentiment results with other server processes through this SQLite file")
+    args = parser.parse_args()
+    chatbot.configure_sentiment_cache(args.sentiment_cache_ttl, args.shared_cache)
+
+    embedding_path = chatbot.default_embedding_path()
+    try:
+        model, vectorizer = chatbot.load_artifacts(args.model, chatbot.training_fingerprint(args.data, embedding_path))
+    except (OSError, ValueError) as e:
+        raise SystemExit("Cannot serve: {0}".format(e))
+    word2vec = chatbot.load_w2v(embedding_path) if vectorizer is None and os.path.exists(embedding_path) else None
+
+    if args.cache_dir:
+        chatbot.load_caches(args.cache_dir)
+    transcript = TranscriptWriter(args.transcript, args.per_session) if args.transcript else None
+    chat_server = ChatServer(model, vectorizer, word2vec, args.workers, args.max_sessions, args.idle_timeout,
+                             args.max_batch_size, args.max_wait_ms, transcript)
+    exporter = None
+    if args.metrics:
+        exporter = chatbot.start_metrics(args.metrics, args.metrics_interval, transcript)
+        metrics.register_gauges("server", lambda: {"active_sessions": chat_server.active_sessions})
+    if args.profile_dir:
+        metrics.install_profiler_toggle(args.profile_dir)
+    try:
+        asyncio.run(chat_server.serve(args.host, args.port, args.stats_interval))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if transcript is not None:
+            transcript.close()
+        if exporter is not None:
+            exporter.stop()
+        if args.cache_dir:
+            chatbot.save_caches(args.cache_dir)
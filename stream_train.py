@@ -0,0 +1,144 @@
+# Trains a sentiment model on a labeled CSV file that is too large to fit in
+# memory.  The file is read in chunks with chatbot.load_in_chunks; each chunk is
+# featurized on its own (averaged Word2Vec embeddings, or hashed term frequencies,
+# which need no vocabulary) and passed to the model's partial_fit.  Memory use
+# therefore depends on the chunk size, not on the size of the dataset.
+#
+# Progress is checkpointed every few chunks, so an interrupted run can be resumed
+# with --resume.  The trained model is saved in the same format as
+# "python chatbot.py train", so "python chatbot.py serve" can load it.
+#
+# Usage:
+#   python stream_train.py reviews.csv [--features w2v|hashing] [--model svm|logistic|nb|mlp]
+#                          [--chunksize 10000] [--epochs 1] [--checkpoint stream_checkpoint.pkl] [--resume]
+# =========================================================================================================
+
+import argparse
+import os
+import pickle as pkl
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.naive_bayes import GaussianNB
+from sklearn.neural_network import MLPClassifier
+
+import chatbot
+
+CLASSES = np.array([0, 1])
+CHECKPOINT_FILE = "stream_checkpoint.pkl"
+
+# Name of the logistic loss in SGDClassifier ("log" before scikit-learn 1.1).
+LOGISTIC_LOSS = "log_loss" if "log_loss" in getattr(SGDClassifier, "loss_functions", {}) else "log"
+
+
+# Function: instantiate_streaming_model(name)
+# name: "svm", "logistic", "nb", or "mlp"
+# Returns: An instantiated model that supports partial_fit
+#
+# LinearSVC and LogisticRegression cannot be trained incrementally, so "svm" and
+# "logistic" use SGDClassifier with the equivalent loss functions.
+def instantiate_streaming_model(name):
+    if name == "svm":
+        return SGDClassifier(loss="hinge", random_state=100)
+    if name == "logistic":
+        return SGDClassifier(loss=LOGISTIC_LOSS, random_state=100)
+    if name == "nb":
+        return GaussianNB()
+    if name == "mlp":
+        return MLPClassifier(random_state=100)
+    raise ValueError("Unknown streaming model: {0}".format(name))
+
+
+# Function: hashing_vectorizer(n_features)
+# n_features: The number of hashed feature columns
+# Returns: A HashingVectorizer that tokenizes with chatbot.get_tokens
+#
+# The hashing trick maps each token straight to a column, so documents can be
+# featurized chunk by chunk without first building a vocabulary.
+def hashing_vectorizer(n_features=2 ** 20):
+    return HashingVectorizer(tokenizer=chatbot.get_tokens, lowercase=True, token_pattern=None,
+                             n_features=n_features, alternate_sign=False)
+
+
+# Function: save_checkpoint(filepath, checkpoint)
+# Writes the checkpoint atomically, so an interruption mid-write leaves the
+# previous checkpoint intact.
+def save_checkpoint(filepath, checkpoint):
+    with open(filepath + ".tmp", 'wb') as fout:
+        pkl.dump(checkpoint, fout, protocol=pkl.HIGHEST_PROTOCOL)
+    os.replace(filepath + ".tmp", filepath)
+
+
+# Function: stream_train(data, features="w2v", model_name="svm", word2vec=None, chunksize=10000,
+#                        epochs=1, n_features=2 ** 20, checkpoint_path=CHECKPOINT_FILE,
+#                        checkpoint_every=10, resume=False)
+# data: path of the training CSV file (same format as dataset.csv)
+# features: "w2v" or "hashing"
+# model_name: See instantiate_streaming_model
+# word2vec: The pretrained Word2Vec model (required for "w2v" features)
+# Returns: The trained model, and the vectorizer (None for "w2v" features)
+def stream_train(data, features="w2v", model_name="svm", word2vec=None, chunksize=10000, epochs=1,
+                 n_features=2 ** 20, checkpoint_path=CHECKPOINT_FILE, checkpoint_every=10, resume=False):
+    if features == "hashing" and model_name == "nb":
+        raise ValueError("GaussianNB needs dense input; use it with w2v features.")
+
+    config = {"data": os.path.abspath(data), "features": features, "model": model_name,
+              "chunksize": chunksize, "n_features": n_features}
+    vectorizer = hashing_vectorizer(n_features) if features == "hashing" else None
+
+    checkpoint = {"config": config, "model": instantiate_streaming_model(model_name), "epoch": 0, "rows_done": 0}
+    if resume and os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'rb') as fin:
+            saved = pkl.load(fin)
+        if saved["config"] != config:
+            raise ValueError("{0} was written with different settings: {1}".format(checkpoint_path, saved["config"]))
+        checkpoint = saved
+        print("Resuming at epoch {0}, row {1}.".format(checkpoint["epoch"] + 1, checkpoint["rows_done"]))
+
+    model = checkpoint["model"]
+    while checkpoint["epoch"] < epochs:
+        chunks = chatbot.load_in_chunks(data, chunksize, skip_rows=checkpoint["rows_done"])
+        for chunk_index, (documents, labels) in enumerate(chunks, start=1):
+            if features == "hashing":
+                X = vectorizer.transform(documents)
+            else:
+                X = chatbot.strings2vec(word2vec, documents)
+            model.partial_fit(X, labels, classes=CLASSES)
+
+            checkpoint["rows_done"] += len(documents)
+            if chunk_index % checkpoint_every == 0:
+                save_checkpoint(checkpoint_path, checkpoint)
+                print("Epoch {0}: {1} rows trained.".format(checkpoint["epoch"] + 1, checkpoint["rows_done"]))
+
+        checkpoint["epoch"] += 1
+        checkpoint["rows_done"] = 0
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    return model, vectorizer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a sentiment model on a CSV file too large for memory.")
+    parser.add_argument("data")
+    parser.add_argument("--features", choices=["w2v", "hashing"], default="w2v")
+    parser.add_argument("--model", choices=["svm", "logistic", "nb", "mlp"], default="svm")
+    parser.add_argument("--chunksize", type=int, default=10000)
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--n-features", type=int, default=2 ** 20, help="columns for hashing features")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument("--checkpoint-every", type=int, default=10, help="chunks between checkpoints")
+    parser.add_argument("--resume", action="store_true", help="continue from the checkpoint, if there is one")
+    parser.add_argument("--output", default=chatbot.MODEL_FILE)
+    args = parser.parse_args()
+
+    embedding_path = None
+    word2vec = None
+    if args.features == "w2v":
+        embedding_path = chatbot.default_embedding_path()
+        word2vec = chatbot.load_w2v(embedding_path)
+
+    model, vectorizer = stream_train(args.data, args.features, args.model, word2vec, args.chunksize, args.epochs,
+                                     args.n_features, args.checkpoint, args.checkpoint_every, args.resume)
+    chatbot.save_artifacts(args.output, model, vectorizer, chatbot.training_fingerprint(args.data, embedding_path))
+    print("Saved the trained model to {0}.".format(args.output))
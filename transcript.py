@@ -0,0 +1,126 @@
+# Structured transcript logging that stays off the conversation's hot path.
+#
+# Each chatbot message and user response is one JSON record:
+#   {"ts": 1718030000.123, "session": "...", "speaker": "chatbot" or "user",
+#    "state": "sentiment_analysis", "latency_ms": 3.2, "text": "..."}
+# latency_ms is how long the chatbot took to produce a reply (null for user
+# records).  log() only puts the record on a queue; a background thread writes
+# records in batches and flushes them every flush_interval seconds, so a turn
+# never waits on the disk.  Records go to one shared, append-only JSONL file, or
+# to one JSONL file per session.
+#
+# process_transcripts.py reads these files directly.
+# =========================================================================================================
+
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import metrics
+
+_STOP = object()
+
+
+# Class: TranscriptWriter
+# path: A JSONL file to append to, or (with per_session) a directory for one
+#       <session>.jsonl file per session
+# per_session: True for one file per session
+# flush_interval: The longest a record waits before it is written, in seconds
+# max_batch: The most records written at once
+# max_queue: The most records waiting to be written; if the disk falls this far
+#            behind, further records are dropped (and counted in dropped) rather
+#            than slowing down the conversation
+#
+# A batch that cannot be written (e.g., the disk is full) is reported on stderr
+# and counted in failed, and the writer carries on with the next batch.
+class TranscriptWriter:
+    def __init__(self, path, per_session=False, flush_interval=0.5, max_batch=1000, max_queue=100000):
+        self.path = path
+        self.per_session = per_session
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        if per_session:
+            os.makedirs(path, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, name="transcript-writer", daemon=True)
+        self.thread.start()
+
+    # log(session, speaker, text, state=None, latency=None): Queues one record.
+    # session: The session's ID
+    # speaker: "chatbot" or "user"
+    # state: The dialogue state the message belongs to
+    # latency: For chatbot replies, the seconds spent producing the reply
+    #
+    # This never blocks, so it is safe to call from an asyncio event loop.
+    def log(self, session, speaker, text, state=None, latency=None):
+        record = {"ts": time.time(), "session": str(session), "speaker": speaker, "state": state,
+                  "latency_ms": round(1000 * latency, 3) if latency is not None else None, "text": text}
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # session_path(session): Returns the file a session's records are written to.
+    def session_path(self, session):
+        if self.per_session:
+            return os.path.join(self.path, "{0}.jsonl".format(session))
+        return self.path
+
+    # write_batch(records): Appends records to their files, one write per file.
+    def write_batch(self, records):
+        lines = {}
+        for record in records:
+            lines.setdefault(self.session_path(record["session"]), []).append(json.dumps(record) + "\n")
+        with metrics.span("transcript_write"):
+            for filepath, file_lines in lines.items():
+                with open(filepath, "a", encoding="utf-8") as fout:
+                    fout.write("".join(file_lines))
+        self.written += len(records)
+
+    # run(): The background thread's loop: waits for a record, collects whatever
+    # else arrives within flush_interval (up to max_batch), and writes the batch.
+    def run(self):
+        stopping = False
+        while not stopping:
+            record = self.queue.get()
+            if record is _STOP:
+                break
+            batch = [record]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    record = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                print("Could not write {0} transcript records: {1}".format(len(batch), e), file=sys.stderr)
+
+    # close(timeout=10.0): Writes every queued record and stops the background
+    # thread, waiting at most timeout seconds.  Returns False if the writer did not
+    # finish in time (the records still queued are lost).
+    def close(self, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self.thread.join(max(deadline - time.monotonic(), 0))
+        if self.thread.is_alive():
+            print("The transcript writer did not finish within {0}s; {1} records were not written.".format(
+                timeout, self.queue.qsize()), file=sys.stderr)
+            return False
+        return True